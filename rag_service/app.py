@@ -2,27 +2,76 @@
 
 from __future__ import annotations
 
+import contextvars
 import hashlib
+import json
+import logging
+import math
+import multiprocessing
 import os
+import queue
 import re
+import shutil
+import sqlite3
+import threading
 import time
-from dataclasses import dataclass, field
-from typing import Any, Dict, Iterable, List, Optional, Tuple
+import uuid
+import weakref
+from array import array
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    Future,
+    ProcessPoolExecutor,
+    ThreadPoolExecutor,
+    wait,
+)
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field, replace
+from functools import partial, wraps
+from html.parser import HTMLParser
+from typing import (
+    Any,
+    Callable,
+    Deque,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Literal,
+    Optional,
+    Set,
+    Tuple,
+    Union,
+)
 
 import requests
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel, Field
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import extract_worker
+from extract_worker import trafilatura  # None when not installed
 
 # Optional deps (kept optional to avoid hard crashes if you only use /ingest with explicit URLs)
 try:
-    import trafilatura  # type: ignore
+    from ddgs import DDGS  # type: ignore
 except Exception:  # pragma: no cover
-    trafilatura = None
+    DDGS = None
 
 try:
-    from ddgs import DDGS  # type: ignore
+    import numpy as np  # type: ignore
 except Exception:  # pragma: no cover
-    DDGS = None
+    np = None
+
+try:
+    import fcntl  # POSIX only; without it every worker process acts as the writer
+except ImportError:  # pragma: no cover
+    fcntl = None
 
 try:
     import chromadb  # type: ignore
@@ -32,10 +81,17 @@ except Exception as e:  # pragma: no cover
     ) from e
 
 
+logger = logging.getLogger("rag_service")
+
+
 # -----------------------------
 # Settings
 # -----------------------------
 
+def _env_bool(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() not in ("0", "false", "no", "off", "")
+
+
 @dataclass(frozen=True)
 class Settings:
     data_dir: str = os.getenv("RAG_DATA_DIR", "/data")
@@ -47,6 +103,9 @@ class Settings:
     # Search provider keys (optional)
     tavily_api_key: str | None = os.getenv("TAVILY_API_KEY")
     serper_api_key: str | None = os.getenv("SERPER_API_KEY")
+    # Endpoint overrides (proxies, offline benchmarks)
+    tavily_url: str = os.getenv("RAG_TAVILY_URL", "https://api.tavily.com/search")
+    serper_url: str = os.getenv("RAG_SERPER_URL", "https://google.serper.dev/search")
 
     # Safety/ops
     http_timeout_s: float = float(os.getenv("RAG_HTTP_TIMEOUT_S", "20"))
@@ -56,6 +115,120 @@ class Settings:
         "CoActWebRAG/0.1 (+https://example.local; contact=dev@local)",
     )
 
+    # Pooled HTTP clients. Outbound web traffic (pages + search APIs) and Ollama
+    # get separate pools so slow doc hosts can't exhaust embedding connections.
+    http_pool_size: int = int(os.getenv("RAG_HTTP_POOL_SIZE", "32"))
+    http_pool_hosts: int = int(os.getenv("RAG_HTTP_POOL_HOSTS", "16"))
+    http_keepalive: bool = _env_bool("RAG_HTTP_KEEPALIVE", "1")
+    http_retries: int = int(os.getenv("RAG_HTTP_RETRIES", "2"))
+    http_retry_backoff_s: float = float(os.getenv("RAG_HTTP_RETRY_BACKOFF_S", "0.3"))
+    ollama_pool_size: int = int(os.getenv("RAG_OLLAMA_POOL_SIZE", "8"))
+    ollama_retries: int = int(os.getenv("RAG_OLLAMA_RETRIES", "1"))
+
+    # Raw page cache under data_dir/pages; enables conditional (ETag/Last-Modified) refreshes
+    page_cache: bool = _env_bool("RAG_PAGE_CACHE", "1")
+
+    # Persistent embedding cache keyed by (embed model, sha256(text)), LRU-evicted above the cap
+    embed_cache: bool = _env_bool("RAG_EMBED_CACHE", "1")
+    embed_cache_max_mb: int = int(os.getenv("RAG_EMBED_CACHE_MAX_MB", "512"))
+
+    # Embedding requests: inputs are split into batches bounded by item count and total
+    # characters; up to embed_parallelism batches are in flight to Ollama at once.
+    embed_batch_size: int = int(os.getenv("RAG_EMBED_BATCH_SIZE", "32"))
+    embed_batch_chars: int = int(os.getenv("RAG_EMBED_BATCH_CHARS", "16000"))
+    embed_parallelism: int = int(os.getenv("RAG_EMBED_PARALLELISM", "2"))
+
+    # In-process LRU for query embeddings and retrieve() results (0 disables). Entries are
+    # invalidated by a per-scope generation counter bumped on every write; the TTL bounds
+    # staleness for writes made by *other* worker processes.
+    query_cache_size: int = int(os.getenv("RAG_QUERY_CACHE_SIZE", "1024"))
+    query_cache_ttl_s: float = float(os.getenv("RAG_QUERY_CACHE_TTL_S", "300"))
+
+    # Chunking: structure-aware chunks sized to the embed model's token budget.
+    chunk_max_tokens: int = int(os.getenv("RAG_CHUNK_MAX_TOKENS", "512"))
+
+    # Retrieval: "hybrid" fuses Chroma with a per-scope BM25 index (reciprocal rank
+    # fusion), "vector" is Chroma only, "lexical" is BM25 only (no Ollama round trip).
+    retrieval_mode: str = os.getenv("RAG_RETRIEVAL_MODE", "hybrid")
+    rrf_k: int = int(os.getenv("RAG_RRF_K", "60"))
+    # Scopes with more chunks than this get no BM25 index and are searched by vector
+    # only (0 = no cap).
+    lexical_max_chunks: int = int(os.getenv("RAG_LEXICAL_MAX_CHUNKS", "200000"))
+
+    # Process roles. Exactly one process (the writer) writes to the vector store and runs
+    # the job consumers; readers serve queries from read-only handles and hand ingestion
+    # to the writer through the job queue. "auto": whichever worker takes
+    # data_dir/writer.lock first is the writer, and a reader takes over if it dies.
+    # Readers re-check for the writer's changes at most every reader_refresh_s, and
+    # rebuild their Chroma client for them at most every reader_reopen_s (sooner only
+    # after waiting for their own job).
+    role: str = os.getenv("RAG_ROLE", "auto")
+    reader_refresh_s: float = float(os.getenv("RAG_READER_REFRESH_S", "2"))
+    reader_reopen_s: float = float(os.getenv("RAG_READER_REOPEN_S", "10"))
+    # How long a reader blocks on a job it handed to the writer (/ingest, /ask, admin).
+    # Past that the writer still finishes the job and the caller gets its id (HTTP 202);
+    # keep it below the gunicorn worker timeout (120 s in the base image).
+    reader_wait_s: float = float(os.getenv("RAG_READER_WAIT_S", "90"))
+
+    # Token budget for the context block handed to the agent's LLM (/query, /ask).
+    context_max_tokens: int = int(os.getenv("RAG_CONTEXT_MAX_TOKENS", "1500"))
+
+    # Vector store: "chroma" (default), "numpy" (memory-mapped float16/int8 vectors under
+    # data_dir/vectors; exact search below vector_ivf_min_rows live rows, a coarse
+    # partitioned index above) or "memory" (in-process, not persisted; tests/benchmarks).
+    vector_backend: str = os.getenv("RAG_VECTOR_BACKEND", "chroma")
+    vector_dtype: str = os.getenv("RAG_VECTOR_DTYPE", "float16")
+    vector_ivf_min_rows: int = int(os.getenv("RAG_VECTOR_IVF_MIN_ROWS", "20000"))
+    vector_ivf_nprobe: int = int(os.getenv("RAG_VECTOR_IVF_NPROBE", "8"))
+
+    # Staged pipeline: extract/chunk stage workers, and the default /ask latency budget
+    # (0 = wait for every URL; otherwise answer from what is indexed when it expires).
+    extract_workers: int = int(os.getenv("RAG_EXTRACT_WORKERS", str(os.cpu_count() or 2)))
+    ask_latency_budget_s: float = float(os.getenv("RAG_ASK_LATENCY_BUDGET_S", "0"))
+    # /ask/stream requests served at once per worker; more get 503 instead of queueing.
+    stream_max_concurrent: int = int(os.getenv("RAG_STREAM_MAX_CONCURRENT", "32"))
+
+    # Background ingestion jobs (POST /ingest with "background": true), queued durably in
+    # data_dir/jobs.sqlite3. The writer process runs job_workers consumer threads.
+    job_queue_depth: int = int(os.getenv("RAG_JOB_QUEUE_DEPTH", "100"))
+    job_workers: int = int(os.getenv("RAG_JOB_WORKERS", "4"))
+    job_lease_s: float = float(os.getenv("RAG_JOB_LEASE_S", "600"))
+    # A job claimed this many times without finishing (it keeps killing its worker) fails.
+    job_max_attempts: int = int(os.getenv("RAG_JOB_MAX_ATTEMPTS", "3"))
+    job_retention_s: float = float(os.getenv("RAG_JOB_RETENTION_S", str(24 * 3600)))
+
+    # Search providers: a breaker opens after N consecutive failures and skips the provider
+    # for the cool-down. hedge_delay > 0 starts the next provider if the current one hasn't
+    # produced a result within that many seconds (first good result wins); 0 = serial.
+    search_breaker_failures: int = int(os.getenv("RAG_SEARCH_BREAKER_FAILURES", "3"))
+    search_breaker_cooldown_s: float = float(os.getenv("RAG_SEARCH_BREAKER_COOLDOWN_S", "60"))
+    search_hedge_delay_s: float = float(os.getenv("RAG_SEARCH_HEDGE_DELAY_S", "0"))
+
+    # Persistent search result cache keyed by (normalized query, max_results, providers)
+    search_cache_ttl_s: float = float(os.getenv("RAG_SEARCH_CACHE_TTL_S", str(6 * 3600)))
+    search_cache_max_entries: int = int(os.getenv("RAG_SEARCH_CACHE_MAX_ENTRIES", "5000"))
+
+    # trafilatura runs in a process pool (CPU-bound, holds the GIL); 0 = run in-thread.
+    # A document that exceeds the time limit falls back to the fast single-pass extractor.
+    extract_processes: int = int(os.getenv("RAG_EXTRACT_PROCESSES", str(min(4, os.cpu_count() or 1))))
+    extract_timeout_s: float = float(os.getenv("RAG_EXTRACT_TIMEOUT_S", "15"))
+
+    # URL manifest (per scope): an ingested URL younger than this is served from the index
+    # without any network traffic; older ones are revalidated (conditional GET).
+    ingest_ttl_s: float = float(os.getenv("RAG_INGEST_TTL_S", str(7 * 24 * 3600)))
+
+    # Scope limits (0 = unlimited). Past a cap, whole URLs are evicted: least recently
+    # retrieved first ("lru") or least recently ingested ("oldest"). URLs neither
+    # ingested nor retrieved within scope_ttl_s are evicted regardless of size.
+    scope_max_chunks: int = int(os.getenv("RAG_SCOPE_MAX_CHUNKS", "50000"))
+    scope_max_bytes: int = int(os.getenv("RAG_SCOPE_MAX_BYTES", "0"))
+    scope_ttl_s: float = float(os.getenv("RAG_SCOPE_TTL_S", "0"))
+    scope_eviction: str = os.getenv("RAG_SCOPE_EVICTION", "lru")
+
+    # Ingestion concurrency: global worker cap + max in-flight URLs per domain
+    ingest_workers: int = int(os.getenv("RAG_INGEST_WORKERS", "8"))
+    ingest_per_domain: int = int(os.getenv("RAG_INGEST_PER_DOMAIN", "2"))
+
     # Allowlist domains (comma-separated). If empty -> allow all.
     # NOTE: dataclasses forbids mutable defaults, so we must use default_factory.
     allowed_domains: List[str] = field(
@@ -70,6 +243,62 @@ class Settings:
 SETTINGS = Settings()
 
 
+# -----------------------------
+# HTTP clients
+# -----------------------------
+
+def _make_session(
+    pool_size: int,
+    pool_hosts: int,
+    retries: int,
+    retry_methods: Iterable[str],
+    keepalive: bool,
+) -> requests.Session:
+    """Long-lived session with a bounded keep-alive pool and transport retries."""
+    retry = Retry(
+        total=max(0, retries),
+        connect=max(0, retries),
+        read=max(0, retries),
+        status=max(0, retries),
+        backoff_factor=SETTINGS.http_retry_backoff_s,
+        status_forcelist=(429, 502, 503, 504),
+        allowed_methods=frozenset(m.upper() for m in retry_methods),
+        raise_on_status=False,  # let callers see the final response and raise_for_status()
+    )
+    adapter = HTTPAdapter(
+        pool_connections=max(1, pool_hosts),
+        pool_maxsize=max(1, pool_size),
+        max_retries=retry,
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    session.headers["User-Agent"] = SETTINGS.user_agent
+    if not keepalive:
+        session.headers["Connection"] = "close"
+    return session
+
+
+# Page downloads + search provider APIs. Only idempotent methods are retried;
+# search POSTs are not, since provider calls may count against quota.
+_web_http = _make_session(
+    pool_size=SETTINGS.http_pool_size,
+    pool_hosts=SETTINGS.http_pool_hosts,
+    retries=SETTINGS.http_retries,
+    retry_methods=("GET", "HEAD"),
+    keepalive=SETTINGS.http_keepalive,
+)
+
+# Ollama: a single host, so one pool; /api/embed is idempotent and safe to retry.
+_ollama_http = _make_session(
+    pool_size=SETTINGS.ollama_pool_size,
+    pool_hosts=1,
+    retries=SETTINGS.ollama_retries,
+    retry_methods=("POST",),
+    keepalive=SETTINGS.http_keepalive,
+)
+
+
 # -----------------------------
 # Helpers
 # -----------------------------
@@ -85,6 +314,64 @@ def _hash_id(*parts: str) -> str:
     return h
 
 
+def _sqlite_connect(path: str) -> sqlite3.Connection:
+    """Open a WAL-mode SQLite database shared by all threads/workers of the service."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+class LRUCache:
+    """Thread-safe in-process LRU with optional per-entry TTL."""
+
+    def __init__(self, maxsize: int, ttl_s: float = 0.0):
+        self.maxsize = max(0, maxsize)
+        self.ttl_s = ttl_s
+        self._data: "OrderedDict[Any, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Any) -> Any:
+        with self._lock:
+            item = self._data.get(key)
+            if item is not None and self.ttl_s and time.monotonic() - item[0] > self.ttl_s:
+                del self._data[key]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+
+    def put(self, key: Any, value: Any) -> None:
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic(), value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._data),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+            }
+
+
+def _normalize_query(query: str) -> str:
+    return " ".join(query.split()).casefold()
+
+
 def _domain(url: str) -> str:
     m = re.match(r"https?://([^/]+)/?", url.strip(), re.I)
     return (m.group(1).lower() if m else "")
@@ -97,374 +384,4425 @@ def _domain_allowed(url: str) -> bool:
     return any(d == allow or d.endswith("." + allow) for allow in SETTINGS.allowed_domains)
 
 
-def fetch_url(url: str) -> str:
-    if not _domain_allowed(url):
-        raise HTTPException(status_code=400, detail=f"Domain not allowed: {url}")
+# -----------------------------
+# Metrics
+# -----------------------------
 
-    headers = {"User-Agent": SETTINGS.user_agent}
-    with requests.get(url, headers=headers, timeout=SETTINGS.http_timeout_s, stream=True) as r:
-        r.raise_for_status()
-        content = b""
-        for chunk in r.iter_content(chunk_size=32_768):
-            if not chunk:
-                continue
-            content += chunk
-            if len(content) > SETTINGS.max_download_bytes:
-                raise HTTPException(
-                    status_code=413,
-                    detail=f"Downloaded content too large (> {SETTINGS.max_download_bytes} bytes): {url}",
-                )
+# Upper bounds (seconds) shared by every latency histogram: 5 ms .. 2 min.
+_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
 
-    # Try to decode with apparent encoding fallback
-    enc = r.encoding or "utf-8"
-    try:
-        return content.decode(enc, errors="replace")
-    except Exception:
-        return content.decode("utf-8", errors="replace")
 
+class Histogram:
+    """Cumulative Prometheus histogram with a single label (e.g. ``stage``)."""
 
-def extract_main_text(html: str, url: str) -> str:
-    # Best effort extraction
-    if trafilatura is not None:
-        try:
-            downloaded = trafilatura.extract(
-                html,
-                url=url,
-                include_comments=False,
-                include_tables=True,
-                favor_recall=True,
-            )
-            if downloaded:
-                return downloaded
-        except Exception:
-            pass
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...]):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._series: Dict[str, List[float]] = {}  # value -> per-bucket counts + [sum, count]
 
-    # Fallback: strip tags very roughly
-    text = re.sub(r"<script[\s\S]*?</script>", " ", html, flags=re.I)
-    text = re.sub(r"<style[\s\S]*?</style>", " ", text, flags=re.I)
-    text = re.sub(r"<[^>]+>", " ", text)
-    text = re.sub(r"\s+", " ", text)
-    return text.strip()
+    def observe(self, key: str, value: float) -> None:
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0.0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
 
+    def render(self, extra: str) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                labels = f'{self.label}="{key}",{extra}'
+                for bound, n in zip(self.buckets, series):
+                    lines.append(f'{self.name}_bucket{{{labels},le="{bound}"}} {int(n)}')
+                lines.append(f'{self.name}_bucket{{{labels},le="+Inf"}} {int(series[-1])}')
+                lines.append(f"{self.name}_sum{{{labels}}} {series[-2]:.6f}")
+                lines.append(f"{self.name}_count{{{labels}}} {int(series[-1])}")
+        return lines
 
-def chunk_text(text: str, chunk_chars: int = 1600, overlap: int = 200) -> List[str]:
-    text = re.sub(r"\s+", " ", text).strip()
-    if not text:
-        return []
-    chunks: List[str] = []
-    start = 0
-    while start < len(text):
-        end = min(len(text), start + chunk_chars)
-        chunk = text[start:end].strip()
-        if chunk:
-            chunks.append(chunk)
-        if end == len(text):
-            break
-        start = max(0, end - overlap)
-    return chunks
 
+class CounterVec:
+    """Monotonic Prometheus counter with a single label."""
 
-# -----------------------------
-# Search
-# -----------------------------
+    def __init__(self, name: str, help_text: str, label: str):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self._lock = threading.Lock()
+        self._values: Dict[str, float] = {}
 
-def search_web(query: str, max_results: int = 5) -> List[str]:
-    query = query.strip()
-    if not query:
-        return []
+    def inc(self, key: str, amount: float = 1.0) -> None:
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
 
-    # 1) Tavily
-    if SETTINGS.tavily_api_key:
-        try:
-            resp = requests.post(
-                "https://api.tavily.com/search",
-                json={
-                    "api_key": SETTINGS.tavily_api_key,
-                    "query": query,
-                    "max_results": max_results,
-                    "include_answer": False,
-                },
-                timeout=SETTINGS.http_timeout_s,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            urls = [r.get("url") for r in data.get("results", []) if r.get("url")]
-            return urls[:max_results]
-        except Exception:
-            pass
+    def render(self, extra: str) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f'{self.name}{{{self.label}="{key}",{extra}}} {value:g}')
+        return lines
 
-    # 2) Serper (Google)
-    if SETTINGS.serper_api_key:
-        try:
-            resp = requests.post(
-                "https://google.serper.dev/search",
-                headers={"X-API-KEY": SETTINGS.serper_api_key},
-                json={"q": query, "num": max_results},
-                timeout=SETTINGS.http_timeout_s,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-            urls = [r.get("link") for r in data.get("organic", []) if r.get("link")]
-            return urls[:max_results]
-        except Exception:
-            pass
 
-    # 3) DuckDuckGo fallback
-    if DDGS is None:
-        raise HTTPException(
-            status_code=503,
-            detail=(
-                "No search provider configured. Set TAVILY_API_KEY or SERPER_API_KEY, "
-                "or install duckduckgo_search in the rag_service container."
-            ),
-        )
+_stage_seconds = Histogram(
+    "rag_stage_duration_seconds", "Time spent in each pipeline stage.", "stage", _LATENCY_BUCKETS
+)
+_stage_errors = CounterVec("rag_stage_errors_total", "Stage calls that raised.", "stage")
+_request_seconds = Histogram(
+    "rag_request_duration_seconds", "End-to-end API request latency.", "endpoint", _LATENCY_BUCKETS
+)
 
-    urls: List[str] = []
-    try:
-        with DDGS() as ddgs:
-            for r in ddgs.text(query, max_results=max_results):
-                u = r.get("href") or r.get("url")
-                if u:
-                    urls.append(u)
-    except Exception as e:
-        raise HTTPException(status_code=503, detail=f"Search failed: {e}")
 
-    # Basic de-dup
-    out: List[str] = []
-    seen = set()
-    for u in urls:
-        if u in seen:
-            continue
-        seen.add(u)
-        out.append(u)
-    return out[:max_results]
+class RequestTimings:
+    """Seconds per stage for one API request.
 
+    Stages that run in parallel (one fetch per URL, say) are summed, so the
+    stage totals can exceed the wall-clock ``total``.
+    """
 
-# -----------------------------
-# Embeddings + Vector store
-# -----------------------------
-class OllamaEmbeddingFunction:
-    """Embedding function compatible with Chroma + Ollama (/api/embed)."""
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, float] = {}
 
-    def __init__(self, base_url: str, model: str, timeout_s: float = 20.0):
-        self.base_url = base_url.rstrip("/")
-        self.model = model
-        self.timeout_s = timeout_s
-        self.is_legacy = False  # some Chroma versions check this
+    def add(self, stage: str, seconds: float) -> None:
+        with self._lock:
+            self._stages[stage] = self._stages.get(stage, 0.0) + seconds
 
-    def name(self) -> str:
-        return "ollama"
+    def snapshot(self) -> Dict[str, float]:
+        with self._lock:
+            out = {k: round(v, 6) for k, v in self._stages.items()}
+        out["total"] = round(time.perf_counter() - self.started, 6)
+        return out
 
-    def get_config(self) -> dict:
-        return {"base_url": self.base_url, "model": self.model}
 
-    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
-        if not texts:
-            return []
+_request_timings: contextvars.ContextVar[Optional[RequestTimings]] = contextvars.ContextVar(
+    "rag_request_timings", default=None
+)
 
-        try:
-            # Use the modern Ollama embeddings endpoint
-            resp = requests.post(
-                f"{self.base_url}/api/embed",
-                json={"model": self.model, "input": texts},
-                timeout=self.timeout_s,
-            )
-            resp.raise_for_status()
-            data = resp.json()
-        except Exception as e:
-            # Fallback debug info
-            print(f"Ollama embedding error: {e}")
-            raise RuntimeError(f"Ollama connection failed: {e}")
 
-        # Handle various Ollama response formats
-        embs = data.get("embeddings")
-        
-        # Fallback for older Ollama or different response structure
-        if not embs and "embedding" in data:
-            embs = [data["embedding"]]
+@contextmanager
+def stage_timer(stage: str) -> Iterator[None]:
+    t0 = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        _stage_errors.inc(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - t0
+        _stage_seconds.observe(stage, elapsed)
+        timings = _request_timings.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
 
-        if not embs:
-            # Empty response
-            return []
 
-        # CRITICAL FIX: Normalize shape.
-        # We need List[List[float]].
-        # If Ollama returns a flat list [0.1, 0.2, ...], wrap it.
-        first_item = embs[0]
-        
-        # Case 1: It's a flat list of floats (single vector returned incorrectly)
-        if isinstance(first_item, (int, float)):
-            return [embs]
-            
-        # Case 2: It's a list of lists (Correct)
-        if isinstance(first_item, list):
-            return embs
+def timed(stage: str) -> Callable[[Callable[..., Any]], Callable[..., Any]]:
+    """Decorator form of :func:`stage_timer`."""
 
-        raise RuntimeError(f"Invalid embeddings shape from Ollama: {type(first_item)}")
+    def decorate(fn: Callable[..., Any]) -> Callable[..., Any]:
+        @wraps(fn)
+        def wrapper(*args: Any, **kwargs: Any) -> Any:
+            with stage_timer(stage):
+                return fn(*args, **kwargs)
 
-    def embed_documents(self, input: List[str]) -> List[List[float]]:
-        # Chroma passes a list[str]
-        return self._embed_texts(list(input))
+        return wrapper
 
-    def embed_query(self, input) -> List[List[float]]:
-        # Chroma rust oczekuje query_embeddings jako List[List[float]]
-        if isinstance(input, list):
-            texts = [str(x) for x in input]
-        else:
-            texts = [str(input)]
-        return self._embed_texts(texts)
+    return decorate
 
 
-    def __call__(self, input) -> List[List[float]]:
-        # Chroma EmbeddingFunction interface backwards compatibility
-        if isinstance(input, str):
-            texts = [input]
-        else:
-            texts = list(input)
-        return self._embed_texts(texts)
+@contextmanager
+def request_timer(endpoint: str) -> Iterator[RequestTimings]:
+    """Collect stage timings for an API call; nested calls (``/ask`` -> ``/query``) share one."""
+    timings = _request_timings.get()
+    if timings is not None:
+        yield timings
+        return
+    timings = RequestTimings()
+    token = _request_timings.set(timings)
+    try:
+        yield timings
+    finally:
+        _request_timings.reset(token)
+        _request_seconds.observe(endpoint, time.perf_counter() - timings.started)
 
 
+def _with_context(fn: Callable[..., Any]) -> Callable[..., Any]:
+    """Bind ``fn`` to a copy of the caller's contextvars; executor threads don't inherit them."""
+    return partial(contextvars.copy_context().run, fn)
 
-_embedder = OllamaEmbeddingFunction(
-    base_url=SETTINGS.ollama_url,
-    model=SETTINGS.embed_model,
-    timeout_s=SETTINGS.http_timeout_s,
-)
 
+class PageStore:
+    """Content-addressed store of raw downloaded pages.
 
-def _chroma_client() -> Any:
-    os.makedirs(SETTINGS.chroma_dir, exist_ok=True)
-    return chromadb.PersistentClient(path=SETTINGS.chroma_dir)
+    Layout under ``root``:
+      objects/<aa>/<sha256>   raw response bodies, keyed by content hash
+      index/<sha256(url)>.json validators (ETag / Last-Modified), encoding, content hash
+    """
 
+    def __init__(self, root: str):
+        self.root = root
+        self._objects = os.path.join(root, "objects")
+        self._index = os.path.join(root, "index")
 
-def get_collection(scope: str):
-    client = _chroma_client()
-    name = _safe_collection_name(scope)
-    return client.get_or_create_collection(name=name, embedding_function=_embedder)
+    def _object_path(self, content_hash: str) -> str:
+        return os.path.join(self._objects, content_hash[:2], content_hash)
 
+    def _index_path(self, url: str) -> str:
+        return os.path.join(self._index, f"{_hash_id(url)}.json")
 
-def already_ingested(collection, url: str) -> bool:
-    # Chroma filtering support depends on version; we try a cheap heuristic:
-    try:
-        res = collection.get(where={"url": url}, limit=1)
-        ids = res.get("ids") if isinstance(res, dict) else None
-        return bool(ids)
-    except Exception:
-        return False
+    @staticmethod
+    def _write_atomic(path: str, data: bytes) -> None:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as fh:
+            fh.write(data)
+        os.replace(tmp, path)
 
+    def lookup(self, url: str) -> Optional[Dict[str, Any]]:
+        try:
+            with open(self._index_path(url), "r", encoding="utf-8") as fh:
+                entry = json.load(fh)
+        except (OSError, ValueError):
+            return None
+        if not os.path.exists(self._object_path(entry.get("content_hash", ""))):
+            return None
+        return entry
 
-def upsert_url(collection, url: str, text: str, chunk_chars: int, overlap: int) -> int:
-    chunks = chunk_text(text, chunk_chars=chunk_chars, overlap=overlap)
-    if not chunks:
-        return 0
+    def load_body(self, content_hash: str) -> bytes:
+        with open(self._object_path(content_hash), "rb") as fh:
+            return fh.read()
 
-    ids: List[str] = []
-    docs: List[str] = []
-    metas: List[Dict[str, Any]] = []
+    def save(self, url: str, body: bytes, headers: Any, encoding: Optional[str]) -> Dict[str, Any]:
+        content_hash = hashlib.sha256(body).hexdigest()
+        obj = self._object_path(content_hash)
+        if not os.path.exists(obj):
+            self._write_atomic(obj, body)
+        entry = {
+            "url": url,
+            "content_hash": content_hash,
+            "etag": headers.get("ETag"),
+            "last_modified": headers.get("Last-Modified"),
+            "encoding": encoding,
+            "fetched_at": int(time.time()),
+        }
+        self._write_atomic(self._index_path(url), json.dumps(entry).encode("utf-8"))
+        return entry
 
-    ts = int(time.time())
-    for i, ch in enumerate(chunks):
-        ids.append(_hash_id(url, str(i)))
-        docs.append(ch)
-        metas.append({"url": url, "chunk": i, "ingested_at": ts})
+    def touch(self, url: str, entry: Dict[str, Any], headers: Any) -> None:
+        # A 304 may carry refreshed validators; keep the newest ones.
+        entry = dict(entry)
+        entry["etag"] = headers.get("ETag") or entry.get("etag")
+        entry["last_modified"] = headers.get("Last-Modified") or entry.get("last_modified")
+        entry["fetched_at"] = int(time.time())
+        self._write_atomic(self._index_path(url), json.dumps(entry).encode("utf-8"))
 
-    collection.upsert(ids=ids, documents=docs, metadatas=metas)
-    return len(chunks)
+    def sweep(self, keep_urls: Set[str], min_age_s: float = 3600.0) -> Tuple[int, int]:
+        """Forget pages whose URL is in no scope, then delete unreferenced bodies.
 
+        Files younger than ``min_age_s`` are left alone: they may belong to an
+        ingestion that hasn't reached the manifest yet. Returns (entries, objects) removed.
+        """
+        cutoff = time.time() - min_age_s
+        referenced: Set[str] = set()
+        entries_removed = objects_removed = 0
+        for dirpath, _, files in os.walk(self._index):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    with open(path, "r", encoding="utf-8") as fh:
+                        entry = json.load(fh)
+                    if entry.get("url") not in keep_urls and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        entries_removed += 1
+                    else:
+                        referenced.add(entry.get("content_hash", ""))
+                except (OSError, ValueError):
+                    continue
+        for dirpath, _, files in os.walk(self._objects):
+            for name in files:
+                path = os.path.join(dirpath, name)
+                try:
+                    if name not in referenced and os.path.getmtime(path) < cutoff:
+                        os.remove(path)
+                        objects_removed += 1
+                except OSError:
+                    continue
+        return entries_removed, objects_removed
 
-def retrieve(collection, query: str, k: int = 6) -> List[Tuple[str, str, float]]:
-    # Returns list of (url, chunk_text, distance)
-    res = collection.query(query_texts=[query], n_results=k)
-    docs = res.get("documents", [[]])[0]
-    metas = res.get("metadatas", [[]])[0]
-    dists = res.get("distances", [[]])[0]
 
-    out: List[Tuple[str, str, float]] = []
-    for doc, meta, dist in zip(docs, metas, dists):
-        url = meta.get("url") if isinstance(meta, dict) else ""
-        out.append((url or "", doc or "", float(dist)))
-    return out
+_page_store: Optional[PageStore] = (
+    PageStore(os.path.join(SETTINGS.data_dir, "pages")) if SETTINGS.page_cache else None
+)
 
 
-def format_context(items: List[Tuple[str, str, float]], max_chars: int = 6000) -> str:
-    # Smaller distance typically means more relevant for Chroma; we don't over-interpret.
-    parts: List[str] = []
-    total = 0
-    used_urls: List[str] = []
+@dataclass
+class FetchedPage:
+    url: str
+    html: str
+    content_hash: str  # sha256 of the body; on a 304, of the stored copy
 
-    for url, text, dist in items:
-        snippet = text.strip()
-        if not snippet:
-            continue
 
-        block = (
-            f"SOURCE: {url}\n"
-            f"RELEVANCE_DISTANCE: {dist:.4f}\n"
-            f"CONTENT:\n{snippet}\n"
-            f"---\n"
-        )
-        if total + len(block) > max_chars:
-            break
-        parts.append(block)
-        total += len(block)
-        if url and url not in used_urls:
-            used_urls.append(url)
+def _decode(body: bytes, encoding: Optional[str]) -> str:
+    # Try to decode with apparent encoding fallback
+    try:
+        return body.decode(encoding or "utf-8", errors="replace")
+    except Exception:
+        return body.decode("utf-8", errors="replace")
 
-    header = (
-        "You can use the following retrieved documentation excerpts. "
-        "Cite the SOURCE URLs when referencing details.\n\n"
-    )
-    return header + "".join(parts)
 
+@timed("fetch_url")
+def fetch_page(url: str, revalidate: bool = True) -> FetchedPage:
+    """Download ``url``, revalidating against the page store when we have a copy
+    (``revalidate=False``: always a full GET, the copy is only replaced).
 
-# -----------------------------
-# API models
-# -----------------------------
+    The page store is shared by every scope, so a 304 only means "same as the copy
+    some scope fetched last". Callers decide whether to re-index by comparing
+    ``content_hash`` with what *they* indexed.
+    """
+    if not _domain_allowed(url):
+        raise HTTPException(status_code=400, detail=f"Domain not allowed: {url}")
 
-class IngestRequest(BaseModel):
-    urls: List[str] = Field(default_factory=list)
-    scope: str = "global"
-    force_refresh: bool = False
-    chunk_chars: int = 1600
-    overlap: int = 200
+    cached = _page_store.lookup(url) if _page_store is not None and revalidate else None
+    headers = {"User-Agent": SETTINGS.user_agent}
+    if cached:
+        if cached.get("etag"):
+            headers["If-None-Match"] = cached["etag"]
+        if cached.get("last_modified"):
+            headers["If-Modified-Since"] = cached["last_modified"]
 
+    with _web_http.get(url, headers=headers, timeout=SETTINGS.http_timeout_s, stream=True) as r:
+        r.raise_for_status()
+        if r.status_code == 304 and cached:
+            _page_store.touch(url, cached, r.headers)
+            body = _page_store.load_body(cached["content_hash"])
+            return FetchedPage(
+                url=url,
+                html=_decode(body, cached.get("encoding")),
+                content_hash=cached["content_hash"],
+            )
 
-class IngestResponse(BaseModel):
-    scope: str
-    ingested_urls: int
-    ingested_chunks: int
-    skipped_urls: int
-    errors: List[str] = Field(default_factory=list)
+        # bytearray grows in place; `bytes += chunk` would copy the whole body every time.
+        buf = bytearray()
+        for chunk in r.iter_content(chunk_size=32_768):
+            if not chunk:
+                continue
+            buf += chunk
+            if len(buf) > SETTINGS.max_download_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Downloaded content too large (> {SETTINGS.max_download_bytes} bytes): {url}",
+                )
+        body = bytes(buf)
+        encoding = r.encoding
+        resp_headers = r.headers
 
+    if _page_store is not None:
+        content_hash = _page_store.save(url, body, resp_headers, encoding)["content_hash"]
+    else:
+        content_hash = hashlib.sha256(body).hexdigest()
+    return FetchedPage(url=url, html=_decode(body, encoding), content_hash=content_hash)
 
-class QueryRequest(BaseModel):
-    query: str
-    scope: str = "global"
-    k: int = 6
 
+def fetch_url(url: str) -> str:
+    return fetch_page(url).html
 
-class QueryResponse(BaseModel):
-    scope: str
-    context: str
-    sources: List[str]
+
+_SKIP_TAGS = frozenset({"script", "style", "noscript", "template", "svg", "head", "nav", "footer"})
+_BLOCK_TAGS = frozenset({
+    "p", "div", "section", "article", "main", "header", "aside", "blockquote", "figure",
+    "figcaption", "ul", "ol", "dl", "dt", "dd", "table", "thead", "tbody", "form", "hr",
+})
+_LINE_TAGS = frozenset({"br", "li", "tr"})
+_HEADING_TAGS = {f"h{i}": i for i in range(1, 7)}
+
+
+class FastTextExtractor(HTMLParser):
+    """Single-pass HTML -> text extractor on the stdlib parser.
+
+    Skips script/style/navigation content, keeps paragraph breaks, renders
+    headings as ``#`` lines and ``<pre>`` blocks as fenced code, so the chunker
+    can still see the page structure.
+    """
+
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self._out: List[str] = []
+        self._skip: List[str] = []
+        self._pre = 0
+
+    def handle_starttag(self, tag: str, attrs: List[Tuple[str, Optional[str]]]) -> None:
+        if self._skip or tag in _SKIP_TAGS:
+            if tag in _SKIP_TAGS:
+                self._skip.append(tag)
+            return
+        if tag in _HEADING_TAGS:
+            self._out.append("\n\n" + "#" * _HEADING_TAGS[tag] + " ")
+        elif tag == "pre":
+            self._pre += 1
+            if self._pre == 1:
+                self._out.append("\n\n```\n")
+        elif tag in _BLOCK_TAGS:
+            self._out.append("\n\n")
+        elif tag in _LINE_TAGS:
+            self._out.append("\n- " if tag == "li" else "\n")
+        elif tag in ("td", "th"):
+            self._out.append(" | ")
+
+    def handle_endtag(self, tag: str) -> None:
+        if self._skip:
+            if tag in self._skip:
+                # Tolerate unclosed children: unwind to the matching skip tag.
+                while self._skip and self._skip.pop() != tag:
+                    pass
+            return
+        if tag in _HEADING_TAGS or tag in _BLOCK_TAGS:
+            self._out.append("\n\n")
+        elif tag == "pre" and self._pre:
+            self._pre -= 1
+            if not self._pre:
+                self._out.append("\n```\n\n")
+
+    def handle_data(self, data: str) -> None:
+        if self._skip or not data:
+            return
+        if self._pre:
+            self._out.append(data)
+            return
+        words = data.split()
+        if not words:
+            self._out.append(" ")
+            return
+        lead = " " if data[0].isspace() else ""
+        trail = " " if data[-1].isspace() else ""
+        self._out.append(lead + " ".join(words) + trail)
+
+    def text(self) -> str:
+        lines: List[str] = []
+        in_fence = False
+        blank = True
+        for line in "".join(self._out).split("\n"):
+            if line.strip() == "```":
+                in_fence = not in_fence
+                lines.append("```")
+                blank = False
+                continue
+            if not in_fence:
+                line = line.strip()
+                if not line:
+                    if not blank:
+                        lines.append("")
+                    blank = True
+                    continue
+            lines.append(line.rstrip())
+            blank = False
+        return "\n".join(lines).strip()
+
+
+def fast_extract_text(html: str) -> str:
+    parser = FastTextExtractor()
+    try:
+        parser.feed(html)
+        parser.close()
+    except Exception:
+        pass  # keep whatever was extracted before the parser gave up
+    return parser.text()
+
+
+class ExtractProcessPool:
+    """trafilatura worker processes, handed at most one document per worker at a time.
+
+    Callers wait for a free worker *before* submitting, so a document's time limit
+    only counts its own run time. A stuck document retires the pool: new documents go
+    to a fresh one, and the old processes are killed once every other document
+    already running there has finished.
+    """
+
+    def __init__(self, workers: int):
+        # forkserver: forking a heavily threaded server process is not safe. Workers
+        # fork from a server that preloaded only extract_worker, not this module.
+        context = multiprocessing.get_context("forkserver")
+        context.set_forkserver_preload(["extract_worker"])
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=context)
+        self.retired = False
+        self._slots = threading.Semaphore(workers)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Optional[Future]:
+        """Start ``fn`` once a worker is free; None if the pool was retired meanwhile."""
+        self._slots.acquire()
+        with self._lock:
+            if self.retired:
+                self._slots.release()
+                return None
+            self._in_flight += 1
+        try:
+            return self.executor.submit(fn, *args)
+        except Exception:
+            self.release(retire=True)
+            raise
+
+    def release(self, retire: bool = False) -> None:
+        """The caller is done with its document (``retire``: it timed out or crashed)."""
+        with self._lock:
+            self._in_flight -= 1
+            self.retired = self.retired or retire
+            drained = self.retired and self._in_flight == 0
+        self._slots.release()
+        if drained:
+            self._terminate()
+
+    def _terminate(self) -> None:
+        # No public terminate API before 3.14; workers are plain multiprocessing.Process objects.
+        for proc in list((getattr(self.executor, "_processes", None) or {}).values()):
+            try:
+                proc.terminate()
+            except Exception:
+                pass
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+
+_extract_procs_lock = threading.Lock()
+_extract_procs: Optional[ExtractProcessPool] = None
+
+
+def _extract_process_pool() -> ExtractProcessPool:
+    global _extract_procs
+    with _extract_procs_lock:
+        if _extract_procs is None or _extract_procs.retired:
+            _extract_procs = ExtractProcessPool(SETTINGS.extract_processes)
+        return _extract_procs
+
+
+def _extract_in_process(html: str, url: str) -> Optional[str]:
+    while True:
+        pool = _extract_process_pool()
+        fut = pool.submit(extract_worker.extract, html, url)
+        if fut is not None:
+            break
+    stuck = False
+    try:
+        return fut.result(timeout=SETTINGS.extract_timeout_s)
+    except FutureTimeoutError:
+        logger.warning("Extraction timed out after %.0fs: %s", SETTINGS.extract_timeout_s, url)
+        stuck = True
+        return None
+    except BrokenProcessPool:
+        # A worker died (OOM, crash): the executor is unusable, start a new one.
+        stuck = True
+        return None
+    finally:
+        pool.release(retire=stuck)
+
+
+@timed("extract_main_text")
+def extract_main_text(html: str, url: str) -> str:
+    # Best effort extraction
+    if trafilatura is not None:
+        try:
+            if SETTINGS.extract_processes > 0:
+                downloaded = _extract_in_process(html, url)
+            else:
+                downloaded = extract_worker.extract(html, url)
+            if downloaded:
+                return downloaded
+        except Exception:
+            pass
+
+    # Fallback: fast single pass over the HTML
+    return fast_extract_text(html)
+
+
+_TOKEN_RE = re.compile(r"\w+|[^\w\s]")
+_HEADING_RE = re.compile(r"^(#{1,6})\s+(.*?)\s*#*\s*$")
+
+
+def _estimate_tokens(text: str) -> int:
+    # Words + punctuation, floored at chars/4: close enough to WordPiece/BPE counts
+    # for docs prose, and errs high on long identifiers.
+    return max(len(_TOKEN_RE.findall(text)), len(text) // 4)
+
+
+@dataclass
+class Chunk:
+    text: str
+    breadcrumb: str = ""  # "Page title > Section > Subsection" at the chunk's start
+
+
+def _pack_units(units: List[str], sep: str, max_tokens: int, max_chars: int) -> List[str]:
+    parts: List[str] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    cur_chars = 0
+    for unit in units:
+        # A single unit longer than the cap (minified code, base64, ...) gets hard-cut.
+        pieces = [unit[i : i + max_chars] for i in range(0, len(unit), max_chars)] or [unit]
+        for piece in pieces:
+            t = _estimate_tokens(piece) + 1
+            if cur and (cur_tokens + t > max_tokens or cur_chars + len(piece) + 1 > max_chars):
+                parts.append(sep.join(cur))
+                cur, cur_tokens, cur_chars = [], 0, 0
+            cur.append(piece)
+            cur_tokens += t
+            cur_chars += len(piece) + 1
+    if cur:
+        parts.append(sep.join(cur))
+    return [p for p in parts if p.strip()]
+
+
+def _split_oversized(block: str, is_code: bool, max_tokens: int, max_chars: int) -> List[str]:
+    """Split a single block that doesn't fit: code and tables by lines, prose by words."""
+    if block.startswith("|"):
+        rows = block.split("\n")
+        n_head = 2 if len(rows) > 2 and set(rows[1]) <= set("|-: ") else 0
+        head = "\n".join(rows[:n_head])
+        # Every piece repeats the header row, so its cells stay labelled.
+        parts = _pack_units(
+            rows[n_head:],
+            "\n",
+            max(1, max_tokens - _estimate_tokens(head) - 1),
+            max(16, max_chars - len(head) - 1),
+        )
+        return [f"{head}\n{part}" if head else part for part in parts]
+    if not is_code:
+        return _pack_units(block.split(" "), " ", max_tokens, max_chars)
+    lines = block.split("\n")
+    opener = lines[0] if lines[0].startswith("```") else "```"
+    body = lines[1:-1] if len(lines) > 1 and lines[-1].strip().startswith("```") else lines[1:]
+    # Every piece stays a valid fence, so the embedder and the LLM still see code as code.
+    return [
+        f"{opener}\n{part}\n```"
+        for part in _pack_units(body, "\n", max_tokens - 4, max_chars - len(opener) - 8)
+    ]
+
+
+@timed("chunk_text")
+def chunk_text(
+    text: str, max_tokens: Optional[int] = None, max_chars: Optional[int] = None
+) -> List[Chunk]:
+    """Single-pass, structure-aware chunker for (markdown-ish) extracted docs text.
+
+    Blocks are headings, paragraphs/tables (blank-line separated) and fenced code.
+    Blocks are packed into chunks of at most ``max_tokens`` (estimated); a chunk
+    never starts mid-block, code fences are only split when a single fence exceeds
+    the budget, and a heading closes the running chunk once it is reasonably full.
+    There is no overlap between chunks.
+    """
+    max_tokens = max(16, max_tokens or SETTINGS.chunk_max_tokens)
+    max_chars = max(64, max_chars or max_tokens * 8)
+    min_tokens = max_tokens // 4
+
+    chunks: List[Chunk] = []
+    headings: List[Tuple[int, str]] = []
+    cur: List[str] = []
+    cur_tokens = 0
+    cur_chars = 0
+    cur_crumb = ""
+
+    def breadcrumb() -> str:
+        return " > ".join(title for _, title in headings)
+
+    def flush() -> None:
+        nonlocal cur, cur_tokens, cur_chars
+        if cur:
+            chunks.append(Chunk(text="\n\n".join(cur), breadcrumb=cur_crumb))
+        cur, cur_tokens, cur_chars = [], 0, 0
+
+    def add(block: str, is_code: bool = False) -> None:
+        nonlocal cur_tokens, cur_chars, cur_crumb
+        tokens = _estimate_tokens(block)
+        if tokens <= max_tokens and len(block) <= max_chars:
+            pieces = [(block, tokens)]
+        else:
+            pieces = [
+                (p, _estimate_tokens(p))
+                for p in _split_oversized(block, is_code, max_tokens, max_chars)
+            ]
+        for piece, t in pieces:
+            if cur and (cur_tokens + t > max_tokens or cur_chars + len(piece) > max_chars):
+                flush()
+            if not cur:
+                cur_crumb = breadcrumb()
+            cur.append(piece)
+            cur_tokens += t
+            cur_chars += len(piece) + 2
+
+    para: List[str] = []
+    fence: Optional[List[str]] = None
+    for raw in text.split("\n"):
+        if fence is not None:
+            fence.append(raw.rstrip())
+            if raw.strip().startswith("```"):
+                add("\n".join(fence), is_code=True)
+                fence = None
+            continue
+        line = " ".join(raw.split())
+        if line.startswith("```"):
+            if para:
+                add(" ".join(para) if not para[0].startswith("|") else "\n".join(para))
+                para = []
+            fence = [line]
+            continue
+        m = _HEADING_RE.match(line)
+        if m or not line:
+            if para:
+                # Tables keep their rows; prose lines are re-joined into one paragraph.
+                add("\n".join(para) if para[0].startswith("|") else " ".join(para))
+                para = []
+            if m:
+                level, title = len(m.group(1)), m.group(2)
+                if cur_tokens >= min_tokens:
+                    flush()
+                while headings and headings[-1][0] >= level:
+                    headings.pop()
+                headings.append((level, title))
+                add(line)
+            continue
+        para.append(line)
+
+    if fence is not None:  # unterminated fence
+        add("\n".join(fence + ["```"]), is_code=True)
+    if para:
+        add("\n".join(para) if para[0].startswith("|") else " ".join(para))
+    flush()
+    return chunks
+
+
+class DomainLimitedPool:
+    """Thread pool with a global worker cap and a per-domain concurrency cap.
+
+    Tasks for a domain that is already at its limit wait in a per-domain queue
+    instead of occupying a worker, so one slow host cannot starve the others.
+    """
+
+    def __init__(self, max_workers: int, per_domain: int):
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_workers), thread_name_prefix="ingest"
+        )
+        self._per_domain = max(1, per_domain)
+        self._lock = threading.Lock()
+        self._active: Dict[str, int] = {}
+        self._waiting: Dict[str, Deque[Tuple[Future, Callable[[], Any]]]] = {}
+
+    def submit(self, domain: str, fn: Callable[[], Any]) -> Future:
+        fut: Future = Future()
+        with self._lock:
+            active = self._active.get(domain, 0)
+            if active < self._per_domain:
+                self._active[domain] = active + 1
+                start = True
+            else:
+                self._waiting.setdefault(domain, deque()).append((fut, fn))
+                start = False
+        if start:
+            self._start(domain, fut, fn)
+        return fut
+
+    def _start(self, domain: str, fut: Future, fn: Callable[[], Any]) -> None:
+        def run() -> None:
+            try:
+                if fut.set_running_or_notify_cancel():
+                    try:
+                        fut.set_result(fn())
+                    except BaseException as e:  # propagated via fut.result()
+                        fut.set_exception(e)
+            finally:
+                self._release(domain)
+
+        self._executor.submit(run)
+
+    def _release(self, domain: str) -> None:
+        nxt: Optional[Tuple[Future, Callable[[], Any]]] = None
+        with self._lock:
+            waiting = self._waiting.get(domain)
+            if waiting:
+                # Hand the slot straight to the next queued task of this domain.
+                nxt = waiting.popleft()
+                if not waiting:
+                    del self._waiting[domain]
+            else:
+                active = self._active.get(domain, 1) - 1
+                if active > 0:
+                    self._active[domain] = active
+                else:
+                    self._active.pop(domain, None)
+        if nxt is not None:
+            self._start(domain, *nxt)
+
+
+_ingest_pool = DomainLimitedPool(
+    max_workers=SETTINGS.ingest_workers,
+    per_domain=SETTINGS.ingest_per_domain,
+)
+_extract_pool = ThreadPoolExecutor(
+    max_workers=max(1, SETTINGS.extract_workers), thread_name_prefix="extract"
+)
+
+
+# -----------------------------
+# Search
+# -----------------------------
+
+class SearchCache:
+    """TTL + LRU cache of search results, persisted in SQLite (shared by all workers).
+
+    Each entry remembers how long the original provider call took, so hits can
+    report the latency they saved.
+    """
+
+    def __init__(self, path: str, ttl_s: float, max_entries: int):
+        self.ttl_s = ttl_s
+        self.max_entries = max(0, max_entries)
+        self._lock = threading.Lock()
+        self._conn = _sqlite_connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS search_cache ("
+            " key TEXT PRIMARY KEY, urls TEXT NOT NULL, created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL, fetch_s REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS search_cache_lru ON search_cache (last_used)"
+        )
+        self.hits = 0
+        self.misses = 0
+        self.saved_s = 0.0
+
+    @staticmethod
+    def key(query: str, max_results: int, provider: str) -> str:
+        return _hash_id(provider, str(max_results), _normalize_query(query))
+
+    def get(self, key: str) -> Optional[List[str]]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT urls, created_at, fetch_s FROM search_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None or now - row[1] > self.ttl_s:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE search_cache SET last_used = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            self.saved_s += row[2]
+        return json.loads(row[0])
+
+    def put(self, key: str, urls: List[str], fetch_s: float) -> None:
+        if not self.max_entries:
+            return
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO search_cache (key, urls, created_at, last_used, fetch_s)"
+                " VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(urls), now, now, fetch_s),
+            )
+            # Expired rows first, then the least recently used beyond the cap.
+            self._conn.execute(
+                "DELETE FROM search_cache WHERE created_at < ?", (now - self.ttl_s,)
+            )
+            self._conn.execute(
+                "DELETE FROM search_cache WHERE key IN (SELECT key FROM search_cache"
+                " ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "saved_latency_s": self.saved_s,
+            }
+
+
+_search_cache = SearchCache(
+    os.path.join(SETTINGS.data_dir, "search_cache.sqlite3"),
+    ttl_s=SETTINGS.search_cache_ttl_s,
+    max_entries=SETTINGS.search_cache_max_entries,
+)
+
+
+def _search_providers() -> List[str]:
+    """Providers search_web() would try, in order (part of the cache key)."""
+    providers: List[str] = []
+    if SETTINGS.tavily_api_key:
+        providers.append("tavily")
+    if SETTINGS.serper_api_key:
+        providers.append("serper")
+    if DDGS is not None:
+        providers.append("ddgs")
+    return providers
+
+
+@timed("search_web")
+def search_web(query: str, max_results: int = 5) -> List[str]:
+    query = query.strip()
+    if not query:
+        return []
+
+    key = SearchCache.key(query, max_results, "+".join(_search_providers()))
+    cached = _search_cache.get(key)
+    if cached is not None:
+        return cached
+
+    t0 = time.perf_counter()
+    urls = _search_uncached(query, max_results)
+    if urls:
+        _search_cache.put(key, urls, time.perf_counter() - t0)
+    return urls
+
+
+def _dedup(urls: Iterable[str]) -> List[str]:
+    # Basic de-dup, order preserving
+    out: List[str] = []
+    seen = set()
+    for u in urls:
+        if u in seen:
+            continue
+        seen.add(u)
+        out.append(u)
+    return out
+
+
+def _search_tavily(query: str, max_results: int) -> List[str]:
+    resp = _web_http.post(
+        SETTINGS.tavily_url,
+        json={
+            "api_key": SETTINGS.tavily_api_key,
+            "query": query,
+            "max_results": max_results,
+            "include_answer": False,
+        },
+        timeout=SETTINGS.http_timeout_s,
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    return [r.get("url") for r in data.get("results", []) if r.get("url")]
+
+
+def _search_serper(query: str, max_results: int) -> List[str]:
+    resp = _web_http.post(
+        SETTINGS.serper_url,
+        headers={"X-API-KEY": SETTINGS.serper_api_key},
+        json={"q": query, "num": max_results},
+        timeout=SETTINGS.http_timeout_s,
+    )
+    resp.raise_for_status()
+    data = resp.json()
+    return [r.get("link") for r in data.get("organic", []) if r.get("link")]
+
+
+def _search_ddgs(query: str, max_results: int) -> List[str]:
+    if DDGS is None:
+        raise RuntimeError("ddgs is not installed in the rag_service container")
+    urls: List[str] = []
+    with DDGS() as ddgs:
+        for r in ddgs.text(query, max_results=max_results):
+            u = r.get("href") or r.get("url")
+            if u:
+                urls.append(u)
+    return urls
+
+
+_SEARCH_FUNCS: Dict[str, Callable[[str, int], List[str]]] = {
+    "tavily": _search_tavily,
+    "serper": _search_serper,
+    "ddgs": _search_ddgs,
+}
+
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: open after ``threshold`` failures, probe after ``cooldown_s``."""
+
+    def __init__(self, threshold: int, cooldown_s: float):
+        self.threshold = max(1, threshold)
+        self.cooldown_s = cooldown_s
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probing = False
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            if self._probing or time.monotonic() - self._opened_at < self.cooldown_s:
+                return False
+            # Half-open: let exactly one request through to test the provider.
+            self._probing = True
+            return True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+            self._probing = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            self._probing = False
+            if self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "half_open" if self._probing else "open"
+
+
+class ProviderStats:
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.empty = 0
+        self.skipped = 0  # breaker open
+        self.latency_s = 0.0
+
+    def record(self, seconds: float, ok: bool, empty: bool = False) -> None:
+        with self._lock:
+            self.calls += 1
+            self.latency_s += seconds
+            if not ok:
+                self.errors += 1
+            elif empty:
+                self.empty += 1
+
+    def record_skip(self) -> None:
+        with self._lock:
+            self.skipped += 1
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "empty": self.empty,
+                "skipped": self.skipped,
+                "error_rate": (self.errors / self.calls) if self.calls else 0.0,
+                "avg_latency_s": (self.latency_s / self.calls) if self.calls else 0.0,
+            }
+
+
+_search_breakers: Dict[str, CircuitBreaker] = {
+    name: CircuitBreaker(SETTINGS.search_breaker_failures, SETTINGS.search_breaker_cooldown_s)
+    for name in _SEARCH_FUNCS
+}
+_search_stats: Dict[str, ProviderStats] = {name: ProviderStats() for name in _SEARCH_FUNCS}
+# Hedged calls that lose the race keep running here; they only update stats/breakers.
+_search_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="search")
+
+
+def search_provider_stats() -> Dict[str, Any]:
+    return {
+        name: {**_search_stats[name].snapshot(), "breaker": _search_breakers[name].state}
+        for name in _SEARCH_FUNCS
+    }
+
+
+def _call_provider(name: str, query: str, max_results: int) -> List[str]:
+    t0 = time.perf_counter()
+    try:
+        urls = _dedup(_SEARCH_FUNCS[name](query, max_results))[:max_results]
+    except Exception:
+        _search_stats[name].record(time.perf_counter() - t0, ok=False)
+        _search_breakers[name].record_failure()
+        raise
+    _search_stats[name].record(time.perf_counter() - t0, ok=True, empty=not urls)
+    _search_breakers[name].record_success()
+    return urls
+
+
+def _admit_provider(name: str) -> bool:
+    # Ask the breaker only right before the call is made: in half-open state allow()
+    # hands out the single probe, which is only returned by recording its outcome.
+    if _search_breakers[name].allow():
+        return True
+    _search_stats[name].record_skip()
+    return False
+
+
+def _search_uncached(query: str, max_results: int) -> List[str]:
+    providers = _search_providers()
+    if not providers:
+        # A configuration problem, not a provider failure: keep it out of the breakers.
+        raise HTTPException(
+            status_code=503,
+            detail=(
+                "No search provider configured. Set TAVILY_API_KEY or SERPER_API_KEY, "
+                "or install ddgs in the rag_service container."
+            ),
+        )
+    errors: List[str] = []
+    tried: List[str] = []
+    if SETTINGS.search_hedge_delay_s > 0:
+        urls = _search_hedged(query, max_results, providers, errors, tried)
+    else:
+        urls = []
+        for name in providers:
+            if not _admit_provider(name):
+                continue
+            tried.append(name)
+            try:
+                urls = _call_provider(name, query, max_results)
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+                continue
+            if urls:
+                break
+
+    if not tried:
+        raise HTTPException(
+            status_code=503,
+            detail="All search providers are failing; retrying after their cool-down.",
+        )
+    if urls or not errors:
+        return urls
+    raise HTTPException(status_code=503, detail=f"Search failed: {'; '.join(errors)}")
+
+
+def _search_hedged(
+    query: str, max_results: int, providers: List[str], errors: List[str], tried: List[str]
+) -> List[str]:
+    """Race providers in order, starting the next one after the hedge delay or on failure."""
+    remaining = list(providers)
+    pending: Dict[Future, str] = {}
+
+    def launch() -> None:
+        while remaining:
+            name = remaining.pop(0)
+            if _admit_provider(name):
+                tried.append(name)
+                pending[
+                    _search_pool.submit(_with_context(_call_provider), name, query, max_results)
+                ] = name
+                return
+
+    launch()
+    while pending:
+        done, _ = wait(
+            list(pending),
+            timeout=SETTINGS.search_hedge_delay_s if remaining else None,
+            return_when=FIRST_COMPLETED,
+        )
+        if not done:
+            launch()  # the current provider is slow: hedge
+            continue
+        for fut in done:
+            name = pending.pop(fut)
+            try:
+                urls = fut.result()
+            except Exception as e:
+                errors.append(f"{name}: {e}")
+                continue
+            if urls:
+                return urls
+        if remaining and not pending:
+            launch()  # everything in flight failed or came back empty
+    return []
+
+
+# -----------------------------
+# Embeddings + Vector store
+# -----------------------------
+class EmbeddingCache:
+    """Persistent (model, sha256(text)) -> float32 vector store with LRU eviction.
+
+    Vectors are stored as packed float32 blobs in SQLite, so a 768-d embedding
+    costs ~3 KB on disk. ``last_used`` is refreshed on every hit; once the total
+    blob size exceeds ``max_bytes`` the least recently used rows are dropped.
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max(0, max_bytes)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        conn = self._conn()
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            " model TEXT NOT NULL, text_hash TEXT NOT NULL, dim INTEGER NOT NULL,"
+            " vec BLOB NOT NULL, last_used REAL NOT NULL,"
+            " PRIMARY KEY (model, text_hash))"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS embeddings_lru ON embeddings (last_used)")
+        row = conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()
+        self._approx_bytes = int(row[0])
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = _sqlite_connect(self.path)
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def text_hash(text: str) -> str:
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found: Dict[str, List[float]] = {}
+        conn = self._conn()
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), 500):  # stay under SQLite's bound-parameter limit
+            part = unique[i : i + 500]
+            marks = ",".join("?" * len(part))
+            rows = conn.execute(
+                f"SELECT text_hash, vec FROM embeddings WHERE model = ? AND text_hash IN ({marks})",
+                [model, *part],
+            ).fetchall()
+            for h, blob in rows:
+                found[h] = array("f", blob).tolist()
+            if rows:
+                hit_marks = ",".join("?" * len(rows))
+                conn.execute(
+                    f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({hit_marks})",
+                    [time.time(), model, *[h for h, _ in rows]],
+                )
+        with self._lock:
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += sum(1 for h in hashes if h not in found)
+        return found
+
+    def put_many(self, model: str, items: List[Tuple[str, List[float]]]) -> None:
+        if not items:
+            return
+        now = time.time()
+        rows = [(model, h, len(vec), array("f", vec).tobytes(), now) for h, vec in items]
+        conn = self._conn()
+        conn.executemany(
+            "INSERT OR REPLACE INTO embeddings (model, text_hash, dim, vec, last_used)"
+            " VALUES (?, ?, ?, ?, ?)",
+            rows,
+        )
+        with self._lock:
+            self._approx_bytes += sum(len(r[3]) for r in rows)
+            over = self.max_bytes and self._approx_bytes > self.max_bytes
+        if over:
+            self._evict()
+
+    def _evict(self) -> None:
+        conn = self._conn()
+        with self._lock:
+            # Other workers write to the same file; re-read the real size first.
+            total, count = conn.execute(
+                "SELECT COALESCE(SUM(LENGTH(vec)), 0), COUNT(*) FROM embeddings"
+            ).fetchone()
+            if total <= self.max_bytes or not count:
+                self._approx_bytes = int(total)
+                return
+            # Evict down to 90% of the cap so we don't evict on every insert.
+            avg = total / count
+            n = int((total - 0.9 * self.max_bytes) / max(avg, 1.0)) + 1
+            conn.execute(
+                "DELETE FROM embeddings WHERE rowid IN"
+                " (SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (n,),
+            )
+            self.evictions += n
+            self._approx_bytes = int(
+                conn.execute("SELECT COALESCE(SUM(LENGTH(vec)), 0) FROM embeddings").fetchone()[0]
+            )
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": (self.hits / lookups) if lookups else 0.0,
+                "evictions": self.evictions,
+                "approx_bytes": self._approx_bytes,
+                "max_bytes": self.max_bytes,
+            }
+
+
+class EmbeddingBatchError(RuntimeError):
+    """Ollama rejected this batch's payload; a smaller one may go through."""
+
+
+def _is_batch_error(e: Exception) -> bool:
+    # Only 400/413 (payload too large, context length exceeded) are about the batch.
+    # Timeouts and 5xx mostly mean an overloaded Ollama: halving would multiply the
+    # requests (up to 2n - 1, each paying the full timeout) right when it needs less.
+    if isinstance(e, requests.HTTPError):
+        return e.response is not None and e.response.status_code in (400, 413)
+    return False
+
+
+class OllamaEmbeddingFunction:
+    """Embedding function compatible with Chroma + Ollama (/api/embed)."""
+
+    def __init__(
+        self,
+        base_url: str,
+        model: str,
+        timeout_s: float = 20.0,
+        session: Optional[requests.Session] = None,
+        cache: Optional[EmbeddingCache] = None,
+        batch_size: int = 32,
+        batch_chars: int = 16000,
+        parallelism: int = 2,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout_s = timeout_s
+        self.session = session or requests.Session()
+        self.cache = cache
+        self.batch_size = max(1, batch_size)
+        self.batch_chars = max(1, batch_chars)
+        # Shared by all callers, so it also caps total in-flight batches per process.
+        self._pool = ThreadPoolExecutor(max_workers=max(1, parallelism), thread_name_prefix="embed")
+        self._stats_lock = threading.Lock()
+        self._batch_stats: Dict[int, Dict[str, float]] = {}
+        self.is_legacy = False  # some Chroma versions check this
+
+    def name(self) -> str:
+        return "ollama"
+
+    def get_config(self) -> dict:
+        return {"base_url": self.base_url, "model": self.model}
+
+    @timed("_embed_texts")
+    def _embed_texts(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        if self.cache is None:
+            return self._embed_uncached(texts)
+
+        hashes = [EmbeddingCache.text_hash(t) for t in texts]
+        found = self.cache.get_many(self.model, hashes)
+
+        # Only cache misses go to Ollama (each distinct text once).
+        missing: Dict[str, str] = {}
+        for h, t in zip(hashes, texts):
+            if h not in found:
+                missing.setdefault(h, t)
+        if missing:
+            vecs = self._embed_uncached(list(missing.values()))
+            if len(vecs) != len(missing):
+                raise RuntimeError(
+                    f"Ollama returned {len(vecs)} embeddings for {len(missing)} inputs"
+                )
+            fresh = list(zip(missing.keys(), vecs))
+            self.cache.put_many(self.model, fresh)
+            found.update(fresh)
+
+        return [found[h] for h in hashes]
+
+    def _batches(self, texts: List[str]) -> List[List[str]]:
+        batches: List[List[str]] = []
+        cur: List[str] = []
+        cur_chars = 0
+        for t in texts:
+            if cur and (len(cur) >= self.batch_size or cur_chars + len(t) > self.batch_chars):
+                batches.append(cur)
+                cur, cur_chars = [], 0
+            cur.append(t)
+            cur_chars += len(t)
+        if cur:
+            batches.append(cur)
+        return batches
+
+    def _embed_uncached(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = self._batches(texts)
+        if len(batches) == 1:
+            return self._embed_batch_splitting(batches[0])
+
+        # Results are concatenated in submission order, so output order matches input.
+        futures = [
+            self._pool.submit(_with_context(self._embed_batch_splitting), b) for b in batches
+        ]
+        out: List[List[float]] = []
+        for fut in futures:
+            out.extend(fut.result())
+        return out
+
+    def _embed_batch_splitting(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch; if Ollama chokes on it, retry both halves (synchronously).
+
+        Only errors that point at the payload split; an unreachable Ollama fails at once.
+        """
+        try:
+            return self._embed_batch(texts)
+        except EmbeddingBatchError as e:
+            if len(texts) == 1:
+                raise
+            mid = len(texts) // 2
+            logger.warning(
+                "Embedding batch of %d failed (%s); retrying as %d + %d",
+                len(texts), e, mid, len(texts) - mid,
+            )
+            return self._embed_batch_splitting(texts[:mid]) + self._embed_batch_splitting(texts[mid:])
+
+    def _record_batch(self, texts: List[str], seconds: float, ok: bool) -> None:
+        bucket = 1 << max(0, len(texts) - 1).bit_length()  # 1, 2, 4, 8, ...
+        with self._stats_lock:
+            st = self._batch_stats.setdefault(
+                bucket, {"batches": 0, "failures": 0, "texts": 0, "chars": 0, "seconds": 0.0}
+            )
+            st["batches"] += 1
+            st["seconds"] += seconds
+            if ok:
+                st["texts"] += len(texts)
+                st["chars"] += sum(len(t) for t in texts)
+            else:
+                st["failures"] += 1
+
+    def batch_stats(self) -> Dict[str, Dict[str, float]]:
+        """Throughput per batch-size bucket (key = upper bound on texts per batch)."""
+        with self._stats_lock:
+            out: Dict[str, Dict[str, float]] = {}
+            for bucket, st in sorted(self._batch_stats.items()):
+                secs = st["seconds"] or 1e-9
+                out[str(bucket)] = {
+                    **st,
+                    "texts_per_s": st["texts"] / secs,
+                    "chars_per_s": st["chars"] / secs,
+                }
+            return out
+
+    def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        t0 = time.perf_counter()
+        try:
+            embs = self._post_embed(texts)
+            if len(embs) != len(texts):
+                raise EmbeddingBatchError(
+                    f"Ollama returned {len(embs)} embeddings for {len(texts)} inputs"
+                )
+        except RuntimeError:
+            self._record_batch(texts, time.perf_counter() - t0, ok=False)
+            raise
+        self._record_batch(texts, time.perf_counter() - t0, ok=True)
+        return embs
+
+    def _post_embed(self, texts: List[str]) -> List[List[float]]:
+        try:
+            # Use the modern Ollama embeddings endpoint
+            resp = self.session.post(
+                f"{self.base_url}/api/embed",
+                json={"model": self.model, "input": texts},
+                timeout=self.timeout_s,
+            )
+            resp.raise_for_status()
+            data = resp.json()
+        except Exception as e:
+            logger.warning("Ollama embedding error: %s", e)
+            if _is_batch_error(e):
+                raise EmbeddingBatchError(f"Ollama failed on a batch of {len(texts)}: {e}")
+            raise RuntimeError(f"Ollama embedding request failed: {e}")
+
+        # Handle various Ollama response formats
+        embs = data.get("embeddings")
+        
+        # Fallback for older Ollama or different response structure
+        if not embs and "embedding" in data:
+            embs = [data["embedding"]]
+
+        if not embs:
+            # Empty response
+            return []
+
+        # CRITICAL FIX: Normalize shape.
+        # We need List[List[float]].
+        # If Ollama returns a flat list [0.1, 0.2, ...], wrap it.
+        first_item = embs[0]
+        
+        # Case 1: It's a flat list of floats (single vector returned incorrectly)
+        if isinstance(first_item, (int, float)):
+            return [embs]
+            
+        # Case 2: It's a list of lists (Correct)
+        if isinstance(first_item, list):
+            return embs
+
+        raise RuntimeError(f"Invalid embeddings shape from Ollama: {type(first_item)}")
+
+    def embed_documents(self, input: List[str]) -> List[List[float]]:
+        # Chroma passes a list[str]
+        return self._embed_texts(list(input))
+
+    def embed_query(self, input) -> List[List[float]]:
+        # Chroma rust oczekuje query_embeddings jako List[List[float]]
+        if isinstance(input, list):
+            texts = [str(x) for x in input]
+        else:
+            texts = [str(input)]
+        return self._embed_texts(texts)
+
+
+    def __call__(self, input) -> List[List[float]]:
+        # Chroma EmbeddingFunction interface backwards compatibility
+        if isinstance(input, str):
+            texts = [input]
+        else:
+            texts = list(input)
+        return self._embed_texts(texts)
+
+
+
+_embed_cache: Optional[EmbeddingCache] = (
+    EmbeddingCache(
+        os.path.join(SETTINGS.data_dir, "embed_cache.sqlite3"),
+        max_bytes=SETTINGS.embed_cache_max_mb * 1024 * 1024,
+    )
+    if SETTINGS.embed_cache
+    else None
+)
+
+_embedder = OllamaEmbeddingFunction(
+    base_url=SETTINGS.ollama_url,
+    model=SETTINGS.embed_model,
+    timeout_s=SETTINGS.http_timeout_s,
+    session=_ollama_http,
+    cache=_embed_cache,
+    batch_size=SETTINGS.embed_batch_size,
+    batch_chars=SETTINGS.embed_batch_chars,
+    parallelism=SETTINGS.embed_parallelism,
+)
+
+
+# Scopes live in a VectorStore. Each scope is a collection exposing the part of Chroma's
+# Collection API this service uses (name, count, get, query, upsert, update, delete), so
+# everything above and below this point works unchanged on any backend.
+class VectorStore:
+    def get_or_create(self, name: str) -> Any:
+        raise NotImplementedError
+
+    def get(self, name: str) -> Optional[Any]:
+        """Open an existing scope without creating it (None if there is none)."""
+        raise NotImplementedError
+
+    def list_names(self) -> List[str]:
+        raise NotImplementedError
+
+    def drop(self, name: str) -> None:
+        raise NotImplementedError
+
+    def refresh(self, force: bool = False) -> bool:
+        """Make handles opened from now on see writes made by other processes.
+
+        Returns False if the store put it off (rate limit); handles opened now may
+        still miss recent writes. ``force`` skips the rate limit.
+        """
+        return True
+
+
+class _ChromaClient:
+    """A ``PersistentClient`` plus how many handles opened from it are still alive."""
+
+    def __init__(self, path: str):
+        self.client = chromadb.PersistentClient(path=path)
+        self.system = getattr(self.client, "_system", None)
+        self.handles = 0
+        self.retired = False
+
+
+class _ChromaCollection:
+    """A Chroma collection that keeps its client's System running while referenced."""
+
+    def __init__(self, collection: Any, on_release: Callable[[], None]):
+        self._collection = collection
+        self.name = collection.name
+        weakref.finalize(self, on_release)
+
+    def count(self) -> int:
+        return self._collection.count()
+
+    def get(self, *args: Any, **kwargs: Any) -> Any:
+        return self._collection.get(*args, **kwargs)
+
+    def query(self, *args: Any, **kwargs: Any) -> Any:
+        return self._collection.query(*args, **kwargs)
+
+    def upsert(self, *args: Any, **kwargs: Any) -> Any:
+        return self._collection.upsert(*args, **kwargs)
+
+    def update(self, *args: Any, **kwargs: Any) -> Any:
+        return self._collection.update(*args, **kwargs)
+
+    def delete(self, *args: Any, **kwargs: Any) -> Any:
+        return self._collection.delete(*args, **kwargs)
+
+    def __getattr__(self, attr: str) -> Any:
+        return getattr(self._collection, attr)
+
+
+class ChromaStore(VectorStore):
+    """The default backend: one ``chromadb.PersistentClient`` per worker process.
+
+    A client loads each collection's vector index once and then only sees its own
+    writes, so readers pick up the writer's changes by building a new client. The
+    old one stays up while handles opened from it are referenced (cached handles on
+    scopes that didn't change, in-flight queries) and its System is stopped after.
+    """
+
+    def __init__(self, path: str, embedding_function: Any, reopen_s: float = 0.0):
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+        self.embedding_function = embedding_function
+        self.reopen_s = reopen_s
+        self._lock = threading.RLock()
+        self._current = _ChromaClient(path)
+        self._reopened_at = time.monotonic()
+
+    @property
+    def client(self) -> Any:
+        return self._current.client
+
+    def _wrap(self, collection: Any) -> _ChromaCollection:
+        with self._lock:
+            owner = self._current
+            owner.handles += 1
+        return _ChromaCollection(collection, partial(self._release, owner))
+
+    def _release(self, owner: _ChromaClient) -> None:
+        with self._lock:
+            owner.handles -= 1
+            if not (owner.retired and owner.handles == 0):
+                return
+        self._stop(owner)
+
+    @staticmethod
+    def _stop(owner: _ChromaClient) -> None:
+        if owner.system is None:
+            return
+        try:
+            owner.system.stop()
+        except Exception as e:
+            logger.warning("Stopping a replaced Chroma client failed: %s", e)
+
+    def get_or_create(self, name: str) -> Any:
+        return self._wrap(
+            self.client.get_or_create_collection(
+                name=name, embedding_function=self.embedding_function
+            )
+        )
+
+    def get(self, name: str) -> Optional[Any]:
+        if name not in self.list_names():
+            return None
+        return self._wrap(
+            self.client.get_collection(name=name, embedding_function=self.embedding_function)
+        )
+
+    def refresh(self, force: bool = False) -> bool:
+        with self._lock:
+            if not force and time.monotonic() - self._reopened_at < self.reopen_s:
+                return False
+            old = self._current
+            # clear_system_cache() only forgets the shared System; without this the new
+            # client would get the old one (and its loaded indexes) right back.
+            try:
+                from chromadb.api.client import SharedSystemClient  # type: ignore
+
+                SharedSystemClient.clear_system_cache()
+            except ImportError:  # pragma: no cover
+                pass
+            self._current = _ChromaClient(self.path)
+            self._reopened_at = time.monotonic()
+            old.retired = True
+            idle = old.handles == 0
+        if idle:
+            self._stop(old)
+        return True
+
+    def list_names(self) -> List[str]:
+        # Chroma >= 0.6 returns names, older versions return Collection objects.
+        return [
+            c if isinstance(c, str) else getattr(c, "name", "")
+            for c in self.client.list_collections()
+        ]
+
+    def drop(self, name: str) -> None:
+        self.client.delete_collection(name)
+
+
+def _where_matches(meta: Dict[str, Any], where: Optional[Dict[str, Any]]) -> bool:
+    """Equality-only subset of Chroma's ``where`` filter (all this service uses)."""
+    if not where:
+        return True
+    for key, value in where.items():
+        if key.startswith("$") or isinstance(value, dict):
+            raise ValueError(f"Unsupported where clause: {where!r}")
+        if meta.get(key) != value:
+            return False
+    return True
+
+
+class _MemoryVectors:
+    """Vector rows in a growable in-process array."""
+
+    def __init__(self, dtype: Any, dim: int):
+        self._buf = np.empty((0, dim), dtype=dtype)
+
+    def write(self, epoch: int, start: int, rows: Any) -> None:
+        end = start + len(rows)
+        if end > len(self._buf):
+            grown = np.empty((max(end, 2 * len(self._buf), 256), self._buf.shape[1]), self._buf.dtype)
+            grown[: len(self._buf)] = self._buf
+            self._buf = grown
+        self._buf[start:end] = rows
+
+    def view(self, epoch: int, n: int) -> Any:
+        return self._buf[:n]
+
+    def rewrite(self, epoch: int, rows: Any) -> None:
+        self._buf = np.array(rows, dtype=self._buf.dtype)
+
+    def drop(self, epoch: int) -> None:
+        pass
+
+
+class _MappedVectors:
+    """Vector rows in ``vectors-<epoch>.bin``, read through ``np.memmap``.
+
+    Rows are only ever appended to a file; compaction writes a new epoch's file,
+    so a reader still mapping the old one keeps a consistent view until it reloads.
+    """
+
+    def __init__(self, path: str, dtype: Any, dim: int):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        self.dim = dim
+
+    def _file(self, epoch: int) -> str:
+        return os.path.join(self.path, f"vectors-{epoch}.bin")
+
+    def write(self, epoch: int, start: int, rows: Any) -> None:
+        path = self._file(epoch)
+        with open(path, "r+b" if os.path.exists(path) else "w+b") as f:
+            f.seek(start * self.dim * self.dtype.itemsize)
+            f.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+
+    def view(self, epoch: int, n: int) -> Any:
+        if n == 0:
+            return np.empty((0, self.dim), dtype=self.dtype)
+        return np.memmap(self._file(epoch), dtype=self.dtype, mode="r", shape=(n, self.dim))
+
+    def rewrite(self, epoch: int, rows: Any) -> None:
+        tmp = self._file(epoch) + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(np.ascontiguousarray(rows, dtype=self.dtype).tobytes())
+        os.replace(tmp, self._file(epoch))
+
+    def drop(self, epoch: int) -> None:
+        try:
+            os.remove(self._file(epoch))
+        except FileNotFoundError:
+            pass
+
+
+class NumpyCollection:
+    """A scope stored as quantized vectors plus a SQLite table of ids/documents/metadata.
+
+    Vectors are float32, float16 or int8 (per-row scale); distances are squared L2
+    like Chroma's default space, so scores stay comparable across backends. Scopes
+    below ``ivf_min_rows`` live vectors are searched exactly (blocked matrix
+    products); larger ones get a coarse k-means partition and only the ``nprobe``
+    nearest partitions are scanned. Deletes are tombstones until ``compact()``.
+
+    With ``path=None`` everything stays in memory (the "memory" backend). On disk,
+    SQLite's ``data_version`` tells a worker that another process wrote, and the
+    in-memory row mirror is reloaded.
+    """
+
+    _BLOCK_ROWS = 8192
+
+    def __init__(
+        self,
+        name: str,
+        path: Optional[str],
+        dtype: str = "float16",
+        embedding_function: Any = None,
+        ivf_min_rows: int = 20000,
+        nprobe: int = 8,
+    ):
+        self.name = name
+        self.path = path
+        self._embed = embedding_function
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = max(1, nprobe)
+        self._lock = threading.RLock()
+        if path:
+            self._conn = _sqlite_connect(os.path.join(path, "rows.sqlite3"))
+        else:
+            self._conn = sqlite3.connect(":memory:", isolation_level=None, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rows (row INTEGER PRIMARY KEY, id TEXT NOT NULL,"
+            " url TEXT, document TEXT, metadata TEXT, norm REAL NOT NULL, scale REAL NOT NULL,"
+            " list INTEGER NOT NULL DEFAULT -1, alive INTEGER NOT NULL DEFAULT 1)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS rows_id ON rows (id) WHERE alive = 1")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS rows_url ON rows (url) WHERE alive = 1")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        self._conn.execute(
+            "INSERT OR IGNORE INTO meta (key, value) VALUES ('dtype', ?)", (str(np.dtype(dtype)),)
+        )
+        self._store: Any = None
+        self._inode = self._rows_inode()
+        self._load()
+
+    # --- mirror -------------------------------------------------------------------
+
+    def _meta(self, key: str) -> Any:
+        row = self._conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, key: str, value: Any) -> None:
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def _read_data_version(self) -> int:
+        return int(self._conn.execute("PRAGMA data_version").fetchone()[0])
+
+    def _rows_inode(self) -> Optional[int]:
+        if not self.path:
+            return None
+        try:
+            return os.stat(os.path.join(self.path, "rows.sqlite3")).st_ino
+        except OSError:
+            return -1
+
+    def replaced(self) -> bool:
+        """True once another process dropped (and maybe recreated) this scope's files."""
+        return self._rows_inode() != self._inode
+
+    def _load(self) -> None:
+        """(Re)build the in-memory mirror from SQLite (call with the lock held)."""
+        self.dtype = np.dtype(self._meta("dtype"))
+        dim = self._meta("dim")
+        self.dim: Optional[int] = int(dim) if dim is not None else None
+        self._epoch = int(self._meta("epoch") or 0)
+        blob = self._meta("centroids")
+        self._centroids = (
+            np.frombuffer(blob, dtype=np.float32).reshape(-1, self.dim).copy()
+            if blob is not None and self.dim
+            else None
+        )
+        self._ivf_rows = int(self._meta("ivf_rows") or 0)
+
+        rows = self._conn.execute(
+            "SELECT row, id, norm, scale, list, alive FROM rows ORDER BY row"
+        ).fetchall()
+        self._n = len(rows)
+        self._row_of: Dict[str, int] = {r[1]: r[0] for r in rows if r[5]}
+        self._norms = np.array([r[2] for r in rows], dtype=np.float32)
+        self._scales = np.array([r[3] for r in rows], dtype=np.float32)
+        self._lists = np.array([r[4] for r in rows], dtype=np.int32)
+        self._alive = np.array([bool(r[5]) for r in rows], dtype=bool)
+        self._partitions: Optional[Tuple[Any, Any]] = None
+
+        self._vecs = None
+        if self.dim is not None:
+            if self._store is None:
+                self._store = self._open_vectors()
+            self._vecs = self._store.view(self._epoch, self._n)
+        self._data_version = self._read_data_version()
+
+    def _open_vectors(self) -> Any:
+        if self.path:
+            return _MappedVectors(self.path, self.dtype, self.dim)
+        return _MemoryVectors(self.dtype, self.dim)
+
+    def _sync(self) -> None:
+        if self.path and self._read_data_version() != self._data_version:
+            self._load()
+
+    def _begin(self) -> None:
+        self._conn.execute("BEGIN IMMEDIATE")
+        # Another process may have committed between our last read and taking the lock.
+        self._sync()
+
+    @contextmanager
+    def _snapshot(self) -> Iterator[None]:
+        """Hold one SQLite read transaction while the mirror is used to fetch rows.
+
+        ``compact()`` in another process renumbers rows; picking row numbers from
+        the mirror and fetching them after that commit would return other chunks.
+        Inside the snapshot the mirror matches the table (call with the lock held).
+        """
+        for _ in range(5):
+            before = self._read_data_version()
+            self._conn.execute("BEGIN")
+            try:
+                # The first read pins the snapshot; commits after it stay invisible.
+                self._meta("epoch")
+                if self.path and self._read_data_version() != self._data_version:
+                    self._load()
+                    # The snapshot is at least as new as ``before``; anything later is
+                    # picked up by the next reader.
+                    self._data_version = before
+            except FileNotFoundError:
+                # compact() already dropped this snapshot's vector file: retry on a newer one.
+                self._conn.execute("COMMIT")
+                continue
+            except BaseException:
+                self._conn.execute("COMMIT")
+                raise
+            try:
+                yield
+            finally:
+                self._conn.execute("COMMIT")
+            return
+        raise RuntimeError(f"Collection {self.name!r} kept being compacted while reading")
+
+    # --- quantization / search ----------------------------------------------------
+
+    def _quantize(self, emb: Any) -> Tuple[Any, Any, Any]:
+        """Stored rows, per-row scales and squared norms of what is actually stored."""
+        if self.dtype == np.int8:
+            scales = np.abs(emb).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            stored = np.clip(np.rint(emb / scales[:, None]), -127, 127).astype(np.int8)
+            approx = stored.astype(np.float32) * scales[:, None]
+        else:
+            scales = np.ones(len(emb), dtype=np.float32)
+            stored = emb.astype(self.dtype)
+            approx = stored.astype(np.float32)
+        return stored, scales.astype(np.float32), (approx * approx).sum(axis=1)
+
+    def _nearest_lists(self, emb: Any) -> Any:
+        if self._centroids is None:
+            return np.full(len(emb), -1, dtype=np.int32)
+        return _l2_topk(emb, self._centroids, 1)[1][:, 0].astype(np.int32)
+
+    def _topk(self, queries: Any, k: int, rows: Optional[Any] = None) -> Tuple[Any, Any]:
+        """Exact squared-L2 top-k of each query over ``rows`` (None: every row)."""
+        m = len(queries)
+        q_norms = (queries * queries).sum(axis=1)
+        best_d = np.empty((m, 0), dtype=np.float32)
+        best_r = np.empty((m, 0), dtype=np.int64)
+        total = self._n if rows is None else len(rows)
+        for start in range(0, total, self._BLOCK_ROWS):
+            end = min(total, start + self._BLOCK_ROWS)
+            if rows is None:
+                idx = np.arange(start, end)
+                block = np.asarray(self._vecs[start:end], dtype=np.float32)
+            else:
+                idx = rows[start:end]
+                block = np.asarray(self._vecs[idx], dtype=np.float32)
+            dots = queries @ block.T
+            if self.dtype == np.int8:
+                dots *= self._scales[idx]
+            dist = self._norms[idx] - 2.0 * dots + q_norms[:, None]
+            dist[:, ~self._alive[idx]] = np.inf
+            cand_d = np.concatenate([best_d, dist], axis=1)
+            cand_r = np.concatenate([best_r, np.broadcast_to(idx, dist.shape)], axis=1)
+            if cand_d.shape[1] > k:
+                part = np.argpartition(cand_d, k - 1, axis=1)[:, :k]
+                cand_d = np.take_along_axis(cand_d, part, axis=1)
+                cand_r = np.take_along_axis(cand_r, part, axis=1)
+            best_d, best_r = cand_d, cand_r
+        order = np.argsort(best_d, axis=1)
+        return np.take_along_axis(best_d, order, axis=1), np.take_along_axis(best_r, order, axis=1)
+
+    def _partition_rows(self) -> Tuple[Any, Any]:
+        """Rows sorted by partition, plus each partition's [start, end) bounds."""
+        if self._partitions is None:
+            order = np.argsort(self._lists, kind="stable")
+            bounds = np.searchsorted(self._lists[order], np.arange(len(self._centroids) + 1))
+            self._partitions = (order, bounds)
+        return self._partitions
+
+    def _build_ivf(self) -> None:
+        """k-means over a sample of live rows, then assign every row (lock + txn held)."""
+        live = np.flatnonzero(self._alive)
+        nlist = max(16, int(math.sqrt(len(live))))
+        rng = np.random.default_rng(0)
+        sample_rows = np.sort(rng.choice(live, size=min(len(live), 64 * nlist), replace=False))
+        sample = self._dequantize(sample_rows)
+        centroids = sample[rng.choice(len(sample), size=nlist, replace=False)].copy()
+        for _ in range(10):
+            assign = _l2_topk(sample, centroids, 1)[1][:, 0]
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assign, sample)
+            counts = np.bincount(assign, minlength=nlist)
+            filled = counts > 0
+            centroids[filled] = sums[filled] / counts[filled, None]
+        self._centroids = centroids.astype(np.float32)
+
+        lists = np.full(self._n, -1, dtype=np.int32)
+        for start in range(0, len(live), self._BLOCK_ROWS):
+            chunk = live[start : start + self._BLOCK_ROWS]
+            lists[chunk] = self._nearest_lists(self._dequantize(chunk))
+        self._conn.executemany(
+            "UPDATE rows SET list = ? WHERE row = ?",
+            [(int(lists[r]), int(r)) for r in live],
+        )
+        self._set_meta("centroids", self._centroids.tobytes())
+        self._set_meta("ivf_rows", len(live))
+        self._lists = lists
+        self._ivf_rows = len(live)
+        self._partitions = None
+
+    def _dequantize(self, rows: Any) -> Any:
+        out = np.asarray(self._vecs[rows], dtype=np.float32)
+        if self.dtype == np.int8:
+            out = out * self._scales[rows][:, None]
+        return out
+
+    # --- Chroma-compatible API ----------------------------------------------------
+
+    def count(self) -> int:
+        with self._lock:
+            self._sync()
+            return len(self._row_of)
+
+    def _fetch(self, rows: List[int], include: List[str]) -> Dict[int, Tuple[str, str, Any]]:
+        out: Dict[int, Tuple[str, str, Any]] = {}
+        want_docs = "documents" in include
+        want_metas = "metadatas" in include
+        for start in range(0, len(rows), 500):
+            part = rows[start : start + 500]
+            marks = ",".join("?" * len(part))
+            for row, cid, doc, meta in self._conn.execute(
+                f"SELECT row, id, {'document' if want_docs else 'NULL'},"
+                f" {'metadata' if want_metas else 'NULL'} FROM rows WHERE row IN ({marks})",
+                part,
+            ):
+                out[row] = (cid, doc, json.loads(meta) if meta else None)
+        return out
+
+    def get(
+        self,
+        ids: Optional[List[str]] = None,
+        where: Optional[Dict[str, Any]] = None,
+        include: Optional[List[str]] = None,
+        limit: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        include = ["documents", "metadatas"] if include is None else list(include)
+        with self._lock, self._snapshot():
+            if ids is not None:
+                rows = sorted(self._row_of[i] for i in ids if i in self._row_of)
+            elif where and set(where) == {"url"} and isinstance(where["url"], str):
+                rows = [
+                    r
+                    for (r,) in self._conn.execute(
+                        "SELECT row FROM rows WHERE url = ? AND alive = 1 ORDER BY row",
+                        (where["url"],),
+                    )
+                ]
+                where = None
+            else:
+                rows = sorted(self._row_of.values())
+            fetched = self._fetch(rows, include + (["metadatas"] if where else []))
+        picked = [
+            fetched[r] for r in rows if _where_matches(fetched[r][2] or {}, where)
+        ][: limit if limit is not None else None]
+        res: Dict[str, Any] = {"ids": [cid for cid, _, _ in picked]}
+        if "documents" in include:
+            res["documents"] = [doc for _, doc, _ in picked]
+        if "metadatas" in include:
+            res["metadatas"] = [meta for _, _, meta in picked]
+        return res
+
+    def query(
+        self,
+        query_embeddings: Optional[List[List[float]]] = None,
+        query_texts: Optional[List[str]] = None,
+        n_results: int = 10,
+        include: Optional[List[str]] = None,
+    ) -> Dict[str, Any]:
+        include = ["documents", "metadatas", "distances"] if include is None else list(include)
+        if query_embeddings is None:
+            query_embeddings = self._embed(list(query_texts or []))
+        queries = np.asarray(query_embeddings, dtype=np.float32).reshape(len(query_embeddings), -1)
+        with self._lock, self._snapshot():
+            if not self._row_of or not len(queries):
+                hits = [[] for _ in range(len(queries))]
+            else:
+                k = min(max(1, n_results), len(self._row_of))
+                if self._centroids is None:
+                    dists, rows = self._topk(queries, k)
+                    hits = [
+                        [(float(d), int(r)) for d, r in zip(dr, rr) if np.isfinite(d)]
+                        for dr, rr in zip(dists, rows)
+                    ]
+                else:
+                    order, bounds = self._partition_rows()
+                    probes = _l2_topk(queries, self._centroids, min(self.nprobe, len(self._centroids)))[1]
+                    # Rows written since the last rebuild may be unassigned (-1).
+                    loose = order[: bounds[0]]
+                    hits = []
+                    for q, probe in zip(queries, probes):
+                        cand = np.concatenate(
+                            [loose] + [order[bounds[c] : bounds[c + 1]] for c in probe]
+                        )
+                        dists, rows = self._topk(q[None, :], min(k, len(cand)), np.sort(cand))
+                        hits.append(
+                            [(float(d), int(r)) for d, r in zip(dists[0], rows[0]) if np.isfinite(d)]
+                        )
+            fetched = self._fetch(sorted({r for h in hits for _, r in h}), include)
+        res: Dict[str, Any] = {"ids": [[fetched[r][0] for _, r in h] for h in hits]}
+        if "documents" in include:
+            res["documents"] = [[fetched[r][1] for _, r in h] for h in hits]
+        if "metadatas" in include:
+            res["metadatas"] = [[fetched[r][2] for _, r in h] for h in hits]
+        if "distances" in include:
+            res["distances"] = [[d for d, _ in h] for h in hits]
+        return res
+
+    def upsert(
+        self,
+        ids: List[str],
+        embeddings: Optional[List[List[float]]] = None,
+        documents: Optional[List[str]] = None,
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+    ) -> None:
+        ids = list(ids)
+        if not ids:
+            return
+        documents = list(documents) if documents is not None else [""] * len(ids)
+        metadatas = list(metadatas) if metadatas is not None else [{} for _ in ids]
+        if embeddings is None:
+            embeddings = self._embed(documents)
+        # Last write wins for ids repeated within the batch.
+        last = {cid: i for i, cid in enumerate(ids)}
+        keep = sorted(last.values())
+        ids = [ids[i] for i in keep]
+        documents = [documents[i] for i in keep]
+        metadatas = [metadatas[i] for i in keep]
+        emb = np.asarray(embeddings, dtype=np.float32)[keep]
+
+        with self._lock:
+            self._begin()
+            try:
+                if self.dim is None:
+                    self.dim = int(emb.shape[1])
+                    self._set_meta("dim", self.dim)
+                    self._store = self._open_vectors()
+                elif emb.shape[1] != self.dim:
+                    raise ValueError(
+                        f"Embedding dimension {emb.shape[1]} does not match collection ({self.dim})"
+                    )
+                stored, scales, norms = self._quantize(emb)
+                lists = self._nearest_lists(emb)
+                replaced = [self._row_of[cid] for cid in ids if cid in self._row_of]
+                start = self._n
+                self._store.write(self._epoch, start, stored)
+                self._conn.executemany(
+                    "UPDATE rows SET alive = 0 WHERE row = ?", [(r,) for r in replaced]
+                )
+                self._conn.executemany(
+                    "INSERT INTO rows (row, id, url, document, metadata, norm, scale, list)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (
+                            start + i,
+                            cid,
+                            (meta or {}).get("url"),
+                            doc,
+                            json.dumps(meta or {}),
+                            float(norms[i]),
+                            float(scales[i]),
+                            int(lists[i]),
+                        )
+                        for i, (cid, doc, meta) in enumerate(zip(ids, documents, metadatas))
+                    ],
+                )
+                alive = self._alive.copy()
+                alive[replaced] = False
+                self._alive = np.concatenate([alive, np.ones(len(ids), dtype=bool)])
+                self._norms = np.concatenate([self._norms, norms.astype(np.float32)])
+                self._scales = np.concatenate([self._scales, scales])
+                self._lists = np.concatenate([self._lists, lists])
+                self._n = start + len(ids)
+                self._row_of.update({cid: start + i for i, cid in enumerate(ids)})
+                self._vecs = self._store.view(self._epoch, self._n)
+                self._partitions = None
+
+                live = len(self._row_of)
+                if live >= self.ivf_min_rows and (
+                    self._centroids is None or live >= 2 * self._ivf_rows
+                ):
+                    self._build_ivf()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                self._load()
+                raise
+            self._data_version = self._read_data_version()
+            if self._n - len(self._row_of) > max(1024, len(self._row_of)):
+                self.compact()
+
+    def update(
+        self,
+        ids: List[str],
+        metadatas: Optional[List[Dict[str, Any]]] = None,
+        documents: Optional[List[str]] = None,
+    ) -> None:
+        with self._lock:
+            self._begin()
+            try:
+                for i, cid in enumerate(ids):
+                    row = self._row_of.get(cid)
+                    if row is None:
+                        continue
+                    if metadatas is not None:
+                        meta = metadatas[i] or {}
+                        self._conn.execute(
+                            "UPDATE rows SET metadata = ?, url = ? WHERE row = ?",
+                            (json.dumps(meta), meta.get("url"), row),
+                        )
+                    if documents is not None:
+                        self._conn.execute(
+                            "UPDATE rows SET document = ? WHERE row = ?", (documents[i], row)
+                        )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._data_version = self._read_data_version()
+
+    def delete(
+        self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None
+    ) -> None:
+        if ids is None:
+            ids = self.get(where=where, include=[])["ids"]
+        with self._lock:
+            self._begin()
+            try:
+                rows = [self._row_of[cid] for cid in ids if cid in self._row_of]
+                self._conn.executemany("UPDATE rows SET alive = 0 WHERE row = ?", [(r,) for r in rows])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            alive = self._alive.copy()
+            alive[rows] = False
+            self._alive = alive
+            for cid in ids:
+                self._row_of.pop(cid, None)
+            self._data_version = self._read_data_version()
+
+    def close(self) -> None:
+        with self._lock:
+            self._vecs = None
+            self._conn.close()
+
+    def compact(self) -> int:
+        """Rewrite the vectors without tombstoned rows; returns how many rows were dropped."""
+        with self._lock:
+            self._begin()
+            try:
+                live = np.flatnonzero(self._alive)
+                dropped = self._n - len(live)
+                if not dropped:
+                    self._conn.execute("COMMIT")
+                    return 0
+                old_epoch = self._epoch
+                if self._store is not None:
+                    self._store.rewrite(old_epoch + 1, np.asarray(self._vecs[live]))
+                kept = self._conn.execute(
+                    "SELECT id, url, document, metadata, norm, scale, list FROM rows"
+                    " WHERE alive = 1 ORDER BY row"
+                ).fetchall()
+                self._conn.execute("DELETE FROM rows")
+                self._conn.executemany(
+                    "INSERT INTO rows (row, id, url, document, metadata, norm, scale, list)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(i,) + tuple(r) for i, r in enumerate(kept)],
+                )
+                self._set_meta("epoch", old_epoch + 1)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            if self._store is not None:
+                # Readers still mapping the old file keep its inode until they reload.
+                self._store.drop(old_epoch)
+            self._load()
+            return dropped
+
+
+def _l2_topk(queries: Any, points: Any, k: int) -> Tuple[Any, Any]:
+    """Squared-L2 distances and indices of the k nearest ``points`` for each query."""
+    dist = (
+        (queries * queries).sum(axis=1)[:, None]
+        - 2.0 * queries @ points.T
+        + (points * points).sum(axis=1)[None, :]
+    )
+    k = min(k, points.shape[0])
+    part = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    part_d = np.take_along_axis(dist, part, axis=1)
+    order = np.argsort(part_d, axis=1)
+    return np.take_along_axis(part_d, order, axis=1), np.take_along_axis(part, order, axis=1)
+
+
+class NumpyStore(VectorStore):
+    """Scopes as :class:`NumpyCollection` directories under ``root`` (None: in memory)."""
+
+    def __init__(
+        self,
+        root: Optional[str],
+        dtype: str,
+        embedding_function: Any,
+        ivf_min_rows: int,
+        nprobe: int,
+    ):
+        if np is None:
+            raise RuntimeError("The numpy vector backend needs 'numpy' installed.")
+        self.root = root
+        self.dtype = dtype
+        self.embedding_function = embedding_function
+        self.ivf_min_rows = ivf_min_rows
+        self.nprobe = nprobe
+        self._open: Dict[str, NumpyCollection] = {}
+        self._lock = threading.Lock()
+        if root:
+            os.makedirs(root, exist_ok=True)
+
+    def get_or_create(self, name: str) -> NumpyCollection:
+        with self._lock:
+            col = self._open.get(name)
+            if col is None:
+                col = NumpyCollection(
+                    name,
+                    os.path.join(self.root, name) if self.root else None,
+                    dtype=self.dtype,
+                    embedding_function=self.embedding_function,
+                    ivf_min_rows=self.ivf_min_rows,
+                    nprobe=self.nprobe,
+                )
+                self._open[name] = col
+            return col
+
+    def get(self, name: str) -> Optional[NumpyCollection]:
+        if self.root:
+            exists = os.path.exists(os.path.join(self.root, name, "rows.sqlite3"))
+        else:
+            exists = name in self._open
+        return self.get_or_create(name) if exists else None
+
+    def refresh(self, force: bool = False) -> bool:
+        # Open scopes follow other processes' writes by themselves (SQLite data_version);
+        # only handles on files the writer deleted need reopening.
+        with self._lock:
+            for name, col in list(self._open.items()):
+                if col.replaced():
+                    del self._open[name]
+        return True
+
+    def list_names(self) -> List[str]:
+        if not self.root:
+            return list(self._open)
+        return sorted(
+            name
+            for name in os.listdir(self.root)
+            if os.path.exists(os.path.join(self.root, name, "rows.sqlite3"))
+        )
+
+    def drop(self, name: str) -> None:
+        with self._lock:
+            col = self._open.pop(name, None)
+            if col is not None:
+                col.close()
+            if self.root:
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
+
+
+def make_vector_store(backend: Optional[str] = None) -> VectorStore:
+    backend = (backend or SETTINGS.vector_backend).lower()
+    if backend == "chroma":
+        return ChromaStore(SETTINGS.chroma_dir, _embedder, reopen_s=SETTINGS.reader_reopen_s)
+    if backend == "numpy":
+        return NumpyStore(
+            os.path.join(SETTINGS.data_dir, "vectors"),
+            SETTINGS.vector_dtype,
+            _embedder,
+            SETTINGS.vector_ivf_min_rows,
+            SETTINGS.vector_ivf_nprobe,
+        )
+    if backend == "memory":
+        return NumpyStore(
+            None, "float32", _embedder, SETTINGS.vector_ivf_min_rows, SETTINGS.vector_ivf_nprobe
+        )
+    raise ValueError(f"Unknown vector backend: {backend!r}")
+
+
+class _EmptyCollection:
+    """Stand-in a reader serves for a scope the writer hasn't created yet (never cached)."""
+
+    def __init__(self, name: str):
+        self.name = name
+
+    def count(self) -> int:
+        return 0
+
+    def get(self, **_: Any) -> Dict[str, Any]:
+        return {"ids": [], "documents": [], "metadatas": []}
+
+    def query(self, query_embeddings: List[List[float]], **_: Any) -> Dict[str, Any]:
+        empty = [[] for _ in query_embeddings]
+        return {"ids": empty, "documents": empty, "metadatas": empty, "distances": empty}
+
+
+# One store per worker process and one handle per collection; building either is far
+# too slow for the request path.
+_store_lock = threading.RLock()
+_store: Optional[VectorStore] = None
+_collections: Dict[str, Any] = {}
+_opened_generations: Optional[Dict[str, int]] = None  # readers: what the handles have seen
+_reopen_due = threading.Event()  # readers: a job we waited for finished; skip the rate limit
+
+
+def _vector_store() -> VectorStore:
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = make_vector_store()
+    return _store
+
+
+def _refresh_handles() -> None:
+    """Readers: reopen the handles (and drop the BM25 indexes) of scopes the writer changed.
+
+    If the store puts the reopen off, the open handles keep serving and the change
+    is picked up on a later call; caches stay keyed by what the handles have seen.
+    """
+    global _opened_generations
+    gens = _generations.snapshot()
+    if gens == _opened_generations:
+        return
+    with _store_lock:
+        if _opened_generations is not None and gens != _opened_generations:
+            changed = {
+                name
+                for name in set(gens) | set(_opened_generations)
+                if gens.get(name) != _opened_generations.get(name)
+            }
+            if not _vector_store().refresh(force=_reopen_due.is_set()):
+                return
+            _reopen_due.clear()
+            for name in changed:
+                _collections.pop(name, None)
+        _opened_generations = gens
+
+
+def _get_collection_by_name(name: str):
+    writer = is_writer()
+    if not writer:
+        _refresh_handles()
+    col = _collections.get(name)
+    if col is None:
+        with _store_lock:
+            col = _collections.get(name)
+            if col is None:
+                if writer:
+                    col = _vector_store().get_or_create(name)
+                else:
+                    col = _vector_store().get(name)
+                    if col is None:
+                        return _EmptyCollection(name)
+                _collections[name] = col
+    return col
+
+
+def get_collection(scope: str):
+    return _get_collection_by_name(_safe_collection_name(scope))
+
+
+def warm_up() -> List[str]:
+    """Open the persistent store and cache handles for every existing scope."""
+    loaded: List[str] = []
+    for name in _vector_store().list_names():
+        if name.startswith("webdocs_"):
+            _get_collection_by_name(name)
+            loaded.append(name)
+    return loaded
+
+
+@dataclass
+class ManifestEntry:
+    url: str
+    ingested_at: float  # last time the page was fetched and found current
+    content_hash: str  # sha256 of the raw page body ("" for entries backfilled from Chroma)
+    chunks: int
+    bytes: int = 0  # UTF-8 size of the URL's chunk texts
+    used_at: float = 0.0  # last time one of its chunks was returned by a query
+
+    @property
+    def last_active(self) -> float:
+        return max(self.ingested_at, self.used_at)
+
+
+class UrlManifest:
+    """Per-scope index of ingested URLs, persisted in SQLite next to the Chroma data.
+
+    Each scope is mirrored in memory on first use. SQLite's ``data_version`` changes
+    whenever another connection (e.g. another worker) commits, which tells us to
+    drop the in-memory mirrors and reload them lazily. Query hits (``touch``) are
+    buffered and written at most every ``touch_interval_s``.
+    """
+
+    touch_interval_s = 30.0
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = _sqlite_connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest ("
+            " scope TEXT NOT NULL, url TEXT NOT NULL, ingested_at REAL NOT NULL,"
+            " content_hash TEXT NOT NULL, chunks INTEGER NOT NULL,"
+            " PRIMARY KEY (scope, url))"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(manifest)")}
+        if "bytes" not in columns:
+            self._conn.execute("ALTER TABLE manifest ADD COLUMN bytes INTEGER NOT NULL DEFAULT 0")
+        if "used_at" not in columns:
+            self._conn.execute("ALTER TABLE manifest ADD COLUMN used_at REAL NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS manifest_scopes (scope TEXT PRIMARY KEY)")
+        self._scopes: Dict[str, Dict[str, ManifestEntry]] = {}
+        self._touched: Dict[Tuple[str, str], float] = {}
+        self._touch_flushed = time.monotonic()
+        self._data_version = self._read_data_version()
+
+    def _read_data_version(self) -> int:
+        return int(self._conn.execute("PRAGMA data_version").fetchone()[0])
+
+    def _scope(self, collection) -> Dict[str, ManifestEntry]:
+        """In-memory mirror for ``collection`` (call with the lock held)."""
+        version = self._read_data_version()
+        if version != self._data_version:
+            self._scopes.clear()
+            self._data_version = version
+        name = collection.name
+        entries = self._scopes.get(name)
+        if entries is None:
+            known = self._conn.execute(
+                "SELECT 1 FROM manifest_scopes WHERE scope = ?", (name,)
+            ).fetchone()
+            if not known:
+                self._backfill(collection)
+            entries = {
+                row[0]: ManifestEntry(
+                    url=row[0],
+                    ingested_at=row[1],
+                    content_hash=row[2],
+                    chunks=row[3],
+                    bytes=row[4],
+                    used_at=max(row[5], self._touched.get((name, row[0]), 0.0)),
+                )
+                for row in self._conn.execute(
+                    "SELECT url, ingested_at, content_hash, chunks, bytes, used_at"
+                    " FROM manifest WHERE scope = ?",
+                    (name,),
+                )
+            }
+            self._scopes[name] = entries
+        return entries
+
+    def _backfill(self, collection) -> None:
+        # Scopes indexed before the manifest existed: rebuild it from chunk metadata once.
+        res = collection.get(include=["documents", "metadatas"])
+        by_url: Dict[str, Tuple[float, int, int]] = {}
+        for doc, meta in zip(res.get("documents") or [], res.get("metadatas") or []):
+            if not isinstance(meta, dict) or not meta.get("url"):
+                continue
+            ts, n, size = by_url.get(meta["url"], (0.0, 0, 0))
+            by_url[meta["url"]] = (
+                max(ts, float(meta.get("ingested_at") or 0)),
+                n + 1,
+                size + len((doc or "").encode("utf-8")),
+            )
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO manifest"
+                " (scope, url, ingested_at, content_hash, chunks, bytes)"
+                " VALUES (?, ?, ?, '', ?, ?)",
+                [(collection.name, url, ts, n, size) for url, (ts, n, size) in by_url.items()],
+            )
+            self._conn.execute(
+                "INSERT OR IGNORE INTO manifest_scopes (scope) VALUES (?)", (collection.name,)
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._data_version = self._read_data_version()
+
+    def lookup(self, collection, urls: Iterable[str]) -> Dict[str, ManifestEntry]:
+        """Batched membership check: entries for the URLs of ``urls`` that are indexed."""
+        with self._lock:
+            entries = self._scope(collection)
+            return {u: entries[u] for u in urls if u in entries}
+
+    def record(
+        self, collection, url: str, content_hash: str, chunks: int, size: Optional[int] = None
+    ) -> None:
+        """Mark ``url`` as current; ``size=None`` keeps the stored byte count (revalidation)."""
+        with self._lock:
+            entries = self._scope(collection)
+            old = entries.get(url)
+            entry = ManifestEntry(
+                url=url,
+                ingested_at=time.time(),
+                content_hash=content_hash,
+                chunks=chunks,
+                bytes=size if size is not None else (old.bytes if old else 0),
+                used_at=old.used_at if old else 0.0,
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO manifest"
+                " (scope, url, ingested_at, content_hash, chunks, bytes, used_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (
+                    collection.name,
+                    url,
+                    entry.ingested_at,
+                    content_hash,
+                    chunks,
+                    entry.bytes,
+                    entry.used_at,
+                ),
+            )
+            # data_version only moves for other connections' commits, so the mirror stays valid.
+            entries[url] = entry
+
+    def remove(self, collection, urls: Iterable[str]) -> None:
+        urls = list(urls)
+        with self._lock:
+            entries = self._scope(collection)
+            self._conn.executemany(
+                "DELETE FROM manifest WHERE scope = ? AND url = ?",
+                [(collection.name, u) for u in urls],
+            )
+            for u in urls:
+                entries.pop(u, None)
+                self._touched.pop((collection.name, u), None)
+
+    def touch(self, collection, urls: Iterable[str]) -> None:
+        """Note that ``urls`` were just returned by a query (drives LRU eviction)."""
+        now = time.time()
+        with self._lock:
+            entries = self._scope(collection)
+            for u in urls:
+                entry = entries.get(u)
+                if entry is not None:
+                    entry.used_at = now
+                    self._touched[(collection.name, u)] = now
+            if time.monotonic() - self._touch_flushed >= self.touch_interval_s:
+                self.flush_touches()
+
+    def flush_touches(self) -> None:
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touch_flushed = time.monotonic()
+            if touched:
+                self._conn.executemany(
+                    "UPDATE manifest SET used_at = MAX(used_at, ?) WHERE scope = ? AND url = ?",
+                    [(ts, scope, url) for (scope, url), ts in touched.items()],
+                )
+
+    def entries(self, collection) -> List[ManifestEntry]:
+        with self._lock:
+            return [replace(e) for e in self._scope(collection).values()]
+
+    def totals(self) -> Dict[str, Dict[str, float]]:
+        """Per collection: URL count, chunks, bytes and the oldest / newest activity."""
+        self.flush_touches()
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT scope, COUNT(*), SUM(chunks), SUM(bytes), MIN(ingested_at),"
+                " MAX(MAX(ingested_at, used_at)) FROM manifest GROUP BY scope"
+            ).fetchall()
+        return {
+            r[0]: {
+                "urls": r[1],
+                "chunks": r[2] or 0,
+                "bytes": r[3] or 0,
+                "oldest_ingested_at": r[4] or 0.0,
+                "last_active_at": r[5] or 0.0,
+            }
+            for r in rows
+        }
+
+    def all_urls(self) -> Set[str]:
+        with self._lock:
+            return {r[0] for r in self._conn.execute("SELECT DISTINCT url FROM manifest")}
+
+    def drop_scope(self, collection_name: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute("DELETE FROM manifest WHERE scope = ?", (collection_name,))
+                self._conn.execute(
+                    "DELETE FROM manifest_scopes WHERE scope = ?", (collection_name,)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._scopes.pop(collection_name, None)
+            self._touched = {k: v for k, v in self._touched.items() if k[0] != collection_name}
+
+    def is_fresh(self, entry: ManifestEntry) -> bool:
+        return (time.time() - entry.ingested_at) < SETTINGS.ingest_ttl_s
+
+
+_manifest = UrlManifest(
+    os.path.join(os.path.dirname(SETTINGS.chroma_dir.rstrip("/")) or ".", "manifest.sqlite3")
+)
+
+
+@dataclass
+class UpsertStats:
+    total: int = 0  # chunks the page has now
+    new: int = 0  # embedded + inserted
+    unchanged: int = 0  # already stored, kept as-is
+    deleted: int = 0  # stored for this URL but no longer on the page
+    bytes: int = 0  # UTF-8 size of the page's chunk texts
+
+
+class ScopeGenerations:
+    """Per-scope change counters shared by all worker processes (SQLite in data_dir).
+
+    The writer bumps a scope after every write. Everyone else sees the new value within
+    ``recheck_s``: it keys their retrieval caches and tells readers to reopen handles.
+    """
+
+    def __init__(self, path: str, recheck_s: float):
+        self.recheck_s = recheck_s
+        self._lock = threading.Lock()
+        self._conn = _sqlite_connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS generations"
+            " (scope TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+        )
+        self._memo: Dict[str, int] = {}
+        self._data_version = -1
+        self._checked_at = float("-inf")
+
+    def _reload(self) -> None:
+        # Caller holds self._lock. Our own bumps don't move data_version; they update the memo.
+        now = time.monotonic()
+        if now - self._checked_at < self.recheck_s:
+            return
+        self._checked_at = now
+        version = int(self._conn.execute("PRAGMA data_version").fetchone()[0])
+        if version != self._data_version:
+            self._memo = dict(self._conn.execute("SELECT scope, generation FROM generations"))
+            self._data_version = version
+
+    def get(self, collection_name: str) -> int:
+        with self._lock:
+            self._reload()
+            return self._memo.get(collection_name, 0)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            self._reload()
+            return dict(self._memo)
+
+    def expire(self) -> None:
+        """Re-read on next use (after waiting for the writer to finish something)."""
+        with self._lock:
+            self._checked_at = float("-inf")
+
+    def bump(self, collection_name: str) -> int:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                self._conn.execute(
+                    "INSERT INTO generations (scope, generation) VALUES (?, 1)"
+                    " ON CONFLICT (scope) DO UPDATE SET generation = generation + 1",
+                    (collection_name,),
+                )
+                (gen,) = self._conn.execute(
+                    "SELECT generation FROM generations WHERE scope = ?", (collection_name,)
+                ).fetchone()
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._memo[collection_name] = gen
+            return gen
+
+
+_generations = ScopeGenerations(
+    os.path.join(SETTINGS.data_dir, "generations.sqlite3"), SETTINGS.reader_refresh_s
+)
+
+
+def scope_generation(collection_name: str) -> int:
+    if not is_writer() and _opened_generations is not None:
+        # A reader's handles may lag the shared counters (reopens are rate-limited);
+        # a newer key must not hold results read through older handles.
+        return _opened_generations.get(collection_name, 0)
+    return _generations.get(collection_name)
+
+
+def bump_scope_generation(collection_name: str) -> None:
+    """Invalidate every cached retrieval for this collection, in every worker process."""
+    _generations.bump(collection_name)
+
+
+_query_embedding_cache = LRUCache(SETTINGS.query_cache_size)
+_retrieval_cache = LRUCache(SETTINGS.query_cache_size, ttl_s=SETTINGS.query_cache_ttl_s)
+
+
+def _chunk_id(url: str, chunk: str) -> str:
+    # Content-derived identity: inserting a paragraph only adds ids, it doesn't shift later ones.
+    return _hash_id(url, chunk)
+
+
+@dataclass
+class UpsertPlan:
+    """Diff of a page's current chunks against what the collection holds for its URL."""
+
+    collection: Any
+    url: str
+    total: int = 0
+    bytes: int = 0
+    new_ids: List[str] = field(default_factory=list)
+    new_docs: List[str] = field(default_factory=list)
+    new_metas: List[Dict[str, Any]] = field(default_factory=list)
+    moved_ids: List[str] = field(default_factory=list)
+    moved_metas: List[Dict[str, Any]] = field(default_factory=list)
+    stale_ids: List[str] = field(default_factory=list)
+
+
+def plan_upsert(collection, url: str, chunks: List[Chunk]) -> UpsertPlan:
+    # Current page, de-duplicated (repeated boilerplate maps to the same id).
+    current: Dict[str, Tuple[int, Chunk]] = {}
+    for i, ch in enumerate(chunks):
+        current.setdefault(_chunk_id(url, ch.text), (i, ch))
+
+    existing = collection.get(where={"url": url}, include=["metadatas"])
+    stored: Dict[str, Dict[str, Any]] = {
+        cid: (meta or {})
+        for cid, meta in zip(existing.get("ids") or [], existing.get("metadatas") or [])
+    }
+
+    plan = UpsertPlan(
+        collection=collection,
+        url=url,
+        total=len(current),
+        bytes=sum(len(ch.text.encode("utf-8")) for _, ch in current.values()),
+    )
+    ts = int(time.time())
+    for cid, (i, ch) in current.items():
+        meta = stored.get(cid)
+        if meta is None:
+            plan.new_ids.append(cid)
+            plan.new_docs.append(ch.text)
+            plan.new_metas.append(
+                {"url": url, "chunk": i, "section": ch.breadcrumb, "ingested_at": ts}
+            )
+        elif meta.get("chunk") != i or meta.get("section", "") != ch.breadcrumb:
+            # Same text at a new position / under a renamed heading: fix the metadata
+            # without re-embedding.
+            plan.moved_ids.append(cid)
+            plan.moved_metas.append({**meta, "url": url, "chunk": i, "section": ch.breadcrumb})
+
+    plan.stale_ids = [cid for cid in stored if cid not in current]
+    return plan
+
+
+@timed("upsert_url")
+def apply_upsert(plan: UpsertPlan, embeddings: Optional[List[List[float]]] = None) -> UpsertStats:
+    """Write a plan. ``embeddings`` (for ``plan.new_docs``) skips embedding in Chroma."""
+    collection = plan.collection
+    # Insert before deleting so the URL never disappears from the index mid-update.
+    if plan.new_ids:
+        if embeddings is not None:
+            collection.upsert(
+                ids=plan.new_ids,
+                embeddings=embeddings,
+                documents=plan.new_docs,
+                metadatas=plan.new_metas,
+            )
+        else:
+            collection.upsert(ids=plan.new_ids, documents=plan.new_docs, metadatas=plan.new_metas)
+    if plan.moved_ids:
+        collection.update(ids=plan.moved_ids, metadatas=plan.moved_metas)
+    if plan.stale_ids:
+        collection.delete(ids=plan.stale_ids)
+    if plan.new_ids or plan.moved_ids or plan.stale_ids:
+        bump_scope_generation(collection.name)
+        # Moved chunks keep their text, so only new and stale ids touch the BM25 index.
+        if plan.new_ids or plan.stale_ids:
+            _lexical.update(collection, plan.new_ids, plan.new_docs, plan.stale_ids)
+
+    return UpsertStats(
+        total=plan.total,
+        new=len(plan.new_ids),
+        unchanged=plan.total - len(plan.new_ids),
+        deleted=len(plan.stale_ids),
+        bytes=plan.bytes,
+    )
+
+
+def upsert_url(collection, url: str, text: str, max_chars: Optional[int] = None) -> UpsertStats:
+    chunks = chunk_text(text, max_chars=max_chars)
+    if not chunks:
+        return UpsertStats()
+    return apply_upsert(plan_upsert(collection, url, chunks))
+
+
+_IDENT_RE = re.compile(r"[A-Za-z_][A-Za-z0-9_]*|\d+")
+_CAMEL_RE = re.compile(r"[A-Z]+(?=[A-Z][a-z])|[A-Z]?[a-z]+|[A-Z]+|\d+")
+
+
+def _lexical_terms(text: str) -> List[str]:
+    """Terms for BM25: whole identifiers plus their snake/camel-case parts.
+
+    ``CORSMiddleware`` -> corsmiddleware, cors, middleware;
+    ``allow_origins`` -> allow_origins, allow, origins.
+    """
+    terms: List[str] = []
+    for tok in _IDENT_RE.findall(text):
+        low = tok.lower()
+        terms.append(low)
+        parts = [p for p in tok.split("_") if p]
+        if len(parts) > 1 or tok != low and not tok.isupper():
+            sub = [m.lower() for p in parts for m in _CAMEL_RE.findall(p)]
+            if len(sub) > 1:
+                terms.extend(sub)
+    return terms
+
+
+class LexicalIndex:
+    """Per-scope BM25 (SQLite FTS5), persisted next to the manifest and shared by all workers.
+
+    Each scope is one FTS5 table over its chunks' ``_lexical_terms``; chunk texts stay
+    in the vector store. The writer applies every write's diff (apply_upsert,
+    evict_urls), so queries never rebuild anything and readers see new chunks as soon
+    as the writer commits. A scope written before this index existed is built from its
+    stored chunks once, by whichever process needs it first. Scopes with more than
+    ``RAG_LEXICAL_MAX_CHUNKS`` chunks have no index and are searched by vector only.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = _sqlite_connect(path)
+        try:
+            self._conn.execute("CREATE VIRTUAL TABLE temp.fts5_probe USING fts5(terms)")
+            self._conn.execute("DROP TABLE temp.fts5_probe")
+            self.available = True
+        except sqlite3.OperationalError:  # pragma: no cover - SQLite built without FTS5
+            logger.warning("SQLite has no FTS5; retrieval falls back to vector search only")
+            self.available = False
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexical_scopes"
+            " (id INTEGER PRIMARY KEY, scope TEXT NOT NULL UNIQUE)"
+        )
+        # chunk id -> FTS rowid, so deletes don't scan the (unindexed) cid column
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS lexical_ids (scope_id INTEGER NOT NULL, cid TEXT NOT NULL,"
+            " doc INTEGER NOT NULL, PRIMARY KEY (scope_id, cid)) WITHOUT ROWID"
+        )
+
+    @staticmethod
+    def over_cap(chunks: int) -> bool:
+        return 0 < SETTINGS.lexical_max_chunks < chunks
+
+    def _scope_id(self, name: str) -> Optional[int]:
+        row = self._conn.execute(
+            "SELECT id FROM lexical_scopes WHERE scope = ?", (name,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def _delete(self, scope_id: int, ids: List[str]) -> None:
+        for cid in ids:
+            row = self._conn.execute(
+                "SELECT doc FROM lexical_ids WHERE scope_id = ? AND cid = ?", (scope_id, cid)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(f"DELETE FROM lexical_{scope_id} WHERE rowid = ?", (row[0],))
+                self._conn.execute(
+                    "DELETE FROM lexical_ids WHERE scope_id = ? AND cid = ?", (scope_id, cid)
+                )
+
+    def _insert(self, scope_id: int, ids: List[str], docs: List[str]) -> None:
+        for cid, doc in zip(ids, docs):
+            cur = self._conn.execute(
+                f"INSERT INTO lexical_{scope_id} (terms, cid) VALUES (?, ?)",
+                (" ".join(_lexical_terms(doc or "")), cid),
+            )
+            self._conn.execute(
+                "INSERT INTO lexical_ids (scope_id, cid, doc) VALUES (?, ?, ?)",
+                (scope_id, cid, cur.lastrowid),
+            )
+
+    def _build(self, collection) -> int:
+        res = collection.get(include=["documents"])
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                scope_id = self._scope_id(collection.name)
+                if scope_id is None:  # nobody built it while we were reading the chunks
+                    scope_id = self._conn.execute(
+                        "INSERT INTO lexical_scopes (scope) VALUES (?)", (collection.name,)
+                    ).lastrowid
+                    self._conn.execute(
+                        f"CREATE VIRTUAL TABLE lexical_{scope_id} USING fts5("
+                        "terms, cid UNINDEXED, tokenize = \"unicode61 tokenchars '_'\")"
+                    )
+                    self._insert(scope_id, res.get("ids") or [], res.get("documents") or [])
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        logger.info(
+            "Built lexical index for %s (%d chunks)", collection.name, len(res.get("ids") or [])
+        )
+        return scope_id
+
+    def search(self, collection, query: str, k: int) -> Optional[List[Tuple[str, float]]]:
+        """Best ``k`` (chunk id, BM25 score); None if the scope has no index (over the cap)."""
+        if not self.available:
+            return None
+        with self._lock:
+            scope_id = self._scope_id(collection.name)
+        if scope_id is None:
+            chunks = collection.count()
+            if not chunks:
+                return []
+            if self.over_cap(chunks):
+                return None
+            scope_id = self._build(collection)
+        terms = sorted({f'"{t}"' for t in _lexical_terms(query)})
+        if not terms:
+            return []
+        table = f"lexical_{scope_id}"
+        with self._lock:
+            try:
+                rows = self._conn.execute(
+                    f"SELECT cid, rank FROM {table} WHERE {table} MATCH ? ORDER BY rank LIMIT ?",
+                    (" OR ".join(terms), k),
+                ).fetchall()
+            except sqlite3.OperationalError:
+                return None  # dropped by another worker since we looked it up
+        # FTS5 ranks by negated BM25; flip it so higher is better like every other score.
+        return [(cid, -rank) for cid, rank in rows]
+
+    def update(
+        self, collection, new_ids: List[str], new_docs: List[str], stale_ids: List[str]
+    ) -> None:
+        """Apply one write to the scope's index (writer only; call after the store write)."""
+        if not self.available:
+            return
+        try:
+            if self.over_cap(collection.count()):
+                self.drop(collection.name)
+                return
+            with self._lock:
+                self._conn.execute("BEGIN IMMEDIATE")
+                try:
+                    scope_id = self._scope_id(collection.name)
+                    if scope_id is not None:
+                        self._delete(scope_id, stale_ids + new_ids)
+                        self._insert(scope_id, new_ids, new_docs)
+                    self._conn.execute("COMMIT")
+                except BaseException:
+                    self._conn.execute("ROLLBACK")
+                    raise
+            if scope_id is None:
+                # Build now rather than on a reader's first query: a reader may still see
+                # the store from before this write, and would index without it.
+                self._build(collection)
+        except Exception as e:
+            logger.warning(
+                "Lexical index update failed for %s; rebuilding it: %s", collection.name, e
+            )
+            self.drop(collection.name)
+
+    def drop(self, collection_name: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                scope_id = self._scope_id(collection_name)
+                if scope_id is not None:
+                    self._conn.execute(f"DROP TABLE IF EXISTS lexical_{scope_id}")
+                    self._conn.execute("DELETE FROM lexical_ids WHERE scope_id = ?", (scope_id,))
+                    self._conn.execute("DELETE FROM lexical_scopes WHERE id = ?", (scope_id,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+
+_lexical = LexicalIndex(
+    os.path.join(os.path.dirname(SETTINGS.chroma_dir.rstrip("/")) or ".", "lexical.sqlite3")
+)
+
+
+@dataclass
+class EvictionStats:
+    urls: int = 0
+    chunks: int = 0
+    bytes: int = 0
+
+
+_eviction_lock = threading.Lock()
+
+
+def evict_urls(collection, urls: Iterable[str]) -> int:
+    """Remove every chunk of ``urls`` from the scope; returns how many chunks went."""
+    urls = list(urls)
+    ids: List[str] = []
+    for url in urls:
+        ids.extend(collection.get(where={"url": url}, include=[]).get("ids") or [])
+    if ids:
+        collection.delete(ids=ids)
+        bump_scope_generation(collection.name)
+        _lexical.update(collection, [], [], ids)
+    _manifest.remove(collection, urls)
+    return len(ids)
+
+
+def enforce_scope_limits(collection) -> EvictionStats:
+    """Evict whole URLs until the scope is within its TTL, chunk and byte caps."""
+    max_chunks, max_bytes, ttl = (
+        SETTINGS.scope_max_chunks,
+        SETTINGS.scope_max_bytes,
+        SETTINGS.scope_ttl_s,
+    )
+    if max_chunks <= 0 and max_bytes <= 0 and ttl <= 0:
+        return EvictionStats()
+    with _eviction_lock:
+        entries = _manifest.entries(collection)
+        if SETTINGS.scope_eviction == "oldest":
+            entries.sort(key=lambda e: e.ingested_at)
+        else:
+            entries.sort(key=lambda e: e.last_active)
+        chunks = sum(e.chunks for e in entries)
+        size = sum(e.bytes for e in entries)
+        cutoff = time.time() - ttl if ttl > 0 else None
+        victims: List[ManifestEntry] = []
+        for e in entries:
+            expired = cutoff is not None and e.last_active < cutoff
+            over = (max_chunks > 0 and chunks > max_chunks) or (max_bytes > 0 and size > max_bytes)
+            if not expired and not over:
+                continue
+            victims.append(e)
+            chunks -= e.chunks
+            size -= e.bytes
+        if not victims:
+            return EvictionStats()
+        removed = evict_urls(collection, [e.url for e in victims])
+    logger.info(
+        "Evicted %d URLs (%d chunks) from %s", len(victims), removed, collection.name
+    )
+    return EvictionStats(urls=len(victims), chunks=removed, bytes=sum(e.bytes for e in victims))
+
+
+def compact_scope(collection) -> Tuple[EvictionStats, int]:
+    """Apply the scope limits, then let the backend reclaim space from deleted rows."""
+    evicted = enforce_scope_limits(collection)
+    compact = getattr(collection, "compact", None)
+    return evicted, (compact() if callable(compact) else 0)
+
+
+def drop_scope(collection_name: str) -> int:
+    """Delete a scope's collection, manifest and cached state; returns its chunk count."""
+    with _store_lock:
+        col = _collections.pop(collection_name, None)
+        if col is None and collection_name not in _vector_store().list_names():
+            return -1
+        count = (col or _vector_store().get_or_create(collection_name)).count()
+        _vector_store().drop(collection_name)
+    _manifest.drop_scope(collection_name)
+    _lexical.drop(collection_name)
+    bump_scope_generation(collection_name)
+    return count
+
+
+@dataclass
+class RetrievedChunk:
+    url: str
+    text: str
+    distance: Optional[float] = None  # vector distance (None for lexical-only hits)
+    score: float = 0.0  # higher is better; RRF score in hybrid mode, BM25 in lexical mode
+    chunk: int = -1
+    section: str = ""
+    id: str = ""
+    scope: str = ""
+
+
+def _to_retrieved(cid: str, text: str, meta: Any, **kw: Any) -> RetrievedChunk:
+    meta = meta if isinstance(meta, dict) else {}
+    return RetrievedChunk(
+        url=meta.get("url") or "",
+        text=text or "",
+        chunk=int(meta.get("chunk", -1)),
+        section=meta.get("section") or "",
+        id=cid,
+        **kw,
+    )
+
+
+def embed_query_cached(query: str) -> List[float]:
+    key = (_embedder.model, _normalize_query(query))
+    emb = _query_embedding_cache.get(key)
+    if emb is None:
+        emb = _embedder.embed_query(" ".join(query.split()))[0]
+        _query_embedding_cache.put(key, emb)
+    return emb
+
+
+def embed_queries_cached(queries: List[str]) -> List[List[float]]:
+    """Embed many queries at once: cache hits are served locally, misses go to Ollama together."""
+    keys = [(_embedder.model, _normalize_query(q)) for q in queries]
+    out: List[Optional[List[float]]] = [_query_embedding_cache.get(key) for key in keys]
+    missing: Dict[Tuple[str, str], str] = {}
+    for key, q, emb in zip(keys, queries, out):
+        if emb is None and key not in missing:
+            missing[key] = " ".join(q.split())
+    if missing:
+        embs = _embedder.embed_query(list(missing.values()))
+        fresh = dict(zip(missing.keys(), embs))
+        for key, emb in fresh.items():
+            _query_embedding_cache.put(key, emb)
+        out = [emb if emb is not None else fresh[key] for key, emb in zip(keys, out)]
+    return out  # type: ignore[return-value]
+
+
+def _vector_search_many(
+    collection, query_embeddings: List[List[float]], k: int
+) -> List[List[RetrievedChunk]]:
+    """One Chroma query for several embeddings; one ranked list per embedding."""
+    if not query_embeddings:
+        return []
+    res = collection.query(query_embeddings=query_embeddings, n_results=k)
+    empty = [[] for _ in query_embeddings]
+    out: List[List[RetrievedChunk]] = []
+    for ids, docs, metas, dists in zip(
+        res.get("ids") or empty,
+        res.get("documents") or empty,
+        res.get("metadatas") or empty,
+        res.get("distances") or empty,
+    ):
+        out.append([
+            _to_retrieved(cid, doc, meta, distance=float(dist), score=-float(dist))
+            for cid, doc, meta, dist in zip(ids, docs, metas, dists)
+        ])
+    return out
+
+
+def _vector_search(
+    collection, query: str, k: int, query_embedding: Optional[List[float]] = None
+) -> List[RetrievedChunk]:
+    if query_embedding is None:
+        query_embedding = embed_query_cached(query)
+    return _vector_search_many(collection, [query_embedding], k)[0]
+
+
+def _lexical_search(collection, query: str, k: int) -> Optional[List[RetrievedChunk]]:
+    """BM25 hits, or None when the scope has no lexical index (search by vector instead)."""
+    hits = _lexical.search(collection, query, k)
+    if not hits:
+        return hits
+    res = collection.get(ids=[cid for cid, _ in hits], include=["documents", "metadatas"])
+    stored = {
+        cid: (doc, meta)
+        for cid, doc, meta in zip(
+            res.get("ids") or [], res.get("documents") or [], res.get("metadatas") or []
+        )
+    }
+    # A reader's store handle may not show the newest chunks yet; skip those.
+    return [
+        _to_retrieved(cid, *stored[cid], score=score) for cid, score in hits if cid in stored
+    ]
+
+
+def _rrf_fuse(rankings: List[List[RetrievedChunk]], k: int) -> List[RetrievedChunk]:
+    fused: Dict[str, RetrievedChunk] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking):
+            inc = 1.0 / (SETTINGS.rrf_k + rank + 1)
+            prev = fused.get(item.id)
+            if prev is None:
+                fused[item.id] = RetrievedChunk(**{**asdict(item), "score": inc})
+            else:
+                prev.score += inc
+                if prev.distance is None:
+                    prev.distance = item.distance
+    return sorted(fused.values(), key=lambda it: it.score, reverse=True)[:k]
+
+
+def retrieve(
+    collection,
+    query: str,
+    k: int = 6,
+    mode: Optional[str] = None,
+    query_embedding: Optional[List[float]] = None,
+) -> List[RetrievedChunk]:
+    mode = mode or SETTINGS.retrieval_mode
+    # Read the generation *before* querying: a write racing with us bumps it, so a
+    # result computed against pre-write data is stored under a key nobody asks for again.
+    key = (collection.name, scope_generation(collection.name), _normalize_query(query), k, mode)
+    cached = _retrieval_cache.get(key)
+    if cached is not None:
+        return list(cached)
+
+    lexical = None
+    if mode != "vector":
+        lexical = _lexical_search(collection, query, k if mode == "lexical" else 2 * k)
+    if mode == "vector":
+        out = _vector_search(collection, query, k, query_embedding)
+    elif lexical is None:
+        # No BM25 index for this scope (over RAG_LEXICAL_MAX_CHUNKS): vector only, with
+        # rank-based scores so it still merges with other scopes' results.
+        out = _rrf_fuse([_vector_search(collection, query, k, query_embedding)], k)
+    elif mode == "lexical":
+        out = lexical
+    else:
+        try:
+            vector = _vector_search(collection, query, 2 * k, query_embedding)
+        except Exception as e:
+            # Ollama slow or down: keep answering from the lexical index alone, and don't
+            # cache that, so full hybrid results come back as soon as Ollama does.
+            logger.warning("Vector search failed, answering lexically: %s", e)
+            return lexical[:k]
+        out = _rrf_fuse([vector, lexical], k)
+    _retrieval_cache.put(key, tuple(out))
+    return out
+
+
+_query_pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="query")
+
+
+@timed("retrieve")
+def retrieve_multi(
+    scopes: List[str], query: str, k: int = 6, mode: Optional[str] = None
+) -> List[RetrievedChunk]:
+    """Search several scopes in parallel with one query embedding; merge into one top-k."""
+    mode = mode or SETTINGS.retrieval_mode
+    if len(scopes) == 1:
+        items = retrieve(get_collection(scopes[0]), query, k, mode)
+        return [replace(it, scope=scopes[0]) for it in items]
+
+    query_embedding: Optional[List[float]] = None
+    if mode != "lexical":
+        try:
+            query_embedding = embed_query_cached(query)
+        except Exception as e:
+            if mode == "vector":
+                raise
+            logger.warning("Query embedding failed, answering lexically: %s", e)
+            mode = "lexical"
+
+    futures = [
+        (
+            scope,
+            _query_pool.submit(
+                _with_context(retrieve), get_collection(scope), query, k, mode, query_embedding
+            ),
+        )
+        for scope in scopes
+    ]
+    return _merge_scopes(
+        [[replace(it, scope=scope) for it in fut.result()] for scope, fut in futures], k, mode
+    )
+
+
+def _merge_scopes(per_scope: List[List[RetrievedChunk]], k: int, mode: str) -> List[RetrievedChunk]:
+    merged = [it for items in per_scope for it in items]
+    if mode == "vector":
+        merged.sort(key=lambda it: it.distance if it.distance is not None else float("inf"))
+    else:
+        # RRF / BM25 scores: higher is better. RRF is rank-based, so it compares across scopes.
+        merged.sort(key=lambda it: it.score, reverse=True)
+    return merged[:k]
+
+
+@timed("retrieve")
+def retrieve_batch(
+    scopes: List[str], queries: List[str], ks: List[int], mode: Optional[str] = None
+) -> List[List[RetrievedChunk]]:
+    """Answer many queries in one round trip: one embedding call, one Chroma query per scope.
+
+    Results are the same as calling ``retrieve_multi`` per query, minus the
+    per-query Ollama and Chroma overhead. The retrieval cache is bypassed.
+    """
+    mode = mode or SETTINGS.retrieval_mode
+    embeddings: Optional[List[List[float]]] = None
+    if mode != "lexical":
+        try:
+            embeddings = embed_queries_cached(queries)
+        except Exception as e:
+            if mode == "vector":
+                raise
+            logger.warning("Query embedding failed, answering lexically: %s", e)
+            mode = "lexical"
+
+    depth = max(ks) * (2 if mode == "hybrid" else 1)
+
+    def search_scope(scope: str) -> List[List[RetrievedChunk]]:
+        collection = get_collection(scope)
+        lexical: List[Optional[List[RetrievedChunk]]] = [None] * len(queries)
+        if mode != "vector":
+            lexical = [
+                _lexical_search(collection, q, k if mode == "lexical" else 2 * k)
+                for q, k in zip(queries, ks)
+            ]
+        scope_embeddings = embeddings
+        if scope_embeddings is None and None in lexical:
+            # Lexical mode, but this scope has no BM25 index: embed after all.
+            scope_embeddings = embed_queries_cached(queries)
+        vector = (
+            _vector_search_many(collection, scope_embeddings, depth)
+            if scope_embeddings is not None
+            else [[] for _ in queries]
+        )
+        out: List[List[RetrievedChunk]] = []
+        for k, vec, lex in zip(ks, vector, lexical):
+            if mode == "vector":
+                items = vec[:k]
+            elif lex is None:
+                items = _rrf_fuse([vec[:k]], k)
+            elif mode == "lexical":
+                items = lex
+            else:
+                items = _rrf_fuse([vec[: 2 * k], lex], k)
+            out.append([replace(it, scope=scope) for it in items])
+        return out
+
+    if len(scopes) == 1:
+        per_scope = [search_scope(scopes[0])]
+    else:
+        per_scope = [
+            fut.result()
+            for fut in [_query_pool.submit(_with_context(search_scope), scope) for scope in scopes]
+        ]
+    return [
+        _merge_scopes([scope_results[i] for scope_results in per_scope], k, mode)
+        for i, k in enumerate(ks)
+    ]
+
+
+# Legacy fixed-window chunks overlapped by 200 chars; look a bit further to be safe.
+_MAX_CHUNK_OVERLAP = 400
+_MIN_CHUNK_OVERLAP = 16
+
+
+def _strip_overlap(prev: str, nxt: str) -> str:
+    """Drop the head of ``nxt`` that repeats the tail of ``prev``."""
+    for n in range(min(len(prev), len(nxt), _MAX_CHUNK_OVERLAP), _MIN_CHUNK_OVERLAP - 1, -1):
+        if prev.endswith(nxt[:n]):
+            return nxt[n:]
+    return nxt
+
+
+def _context_runs(items: List[RetrievedChunk]) -> List[List[RetrievedChunk]]:
+    """Group hits into runs of consecutive chunks of one page, ordered by best rank."""
+    by_page: Dict[Tuple[str, str], Dict[int, Tuple[int, RetrievedChunk]]] = {}
+    loose: List[Tuple[int, RetrievedChunk]] = []
+    for rank, it in enumerate(items):
+        if not it.text.strip():
+            continue
+        if not it.url or it.chunk < 0:
+            loose.append((rank, it))
+            continue
+        by_page.setdefault((it.scope, it.url), {}).setdefault(it.chunk, (rank, it))
+
+    runs: List[Tuple[int, List[RetrievedChunk]]] = [(rank, [it]) for rank, it in loose]
+    for chunks in by_page.values():
+        run: List[Tuple[int, RetrievedChunk]] = []
+        for idx in sorted(chunks):
+            if run and idx != run[-1][1].chunk + 1:
+                runs.append((min(r for r, _ in run), [it for _, it in run]))
+                run = []
+            run.append(chunks[idx])
+        runs.append((min(r for r, _ in run), [it for _, it in run]))
+    runs.sort(key=lambda r: r[0])
+    return [run for _, run in runs]
+
+
+def _context_block(run: List[RetrievedChunk], multi_scope: bool) -> str:
+    first = run[0]
+    text = first.text.strip()
+    for prev, it in zip(run, run[1:]):
+        nxt = it.text.strip()
+        rest = _strip_overlap(prev.text.strip(), nxt)
+        # An overlap means the window continues mid-text; otherwise chunks end at blocks.
+        text += rest if len(rest) < len(nxt) else "\n" + nxt
+    distances = [it.distance for it in run if it.distance is not None]
+    # Smaller distance typically means more relevant for Chroma; we don't over-interpret.
+    relevance = (
+        f"RELEVANCE_DISTANCE: {min(distances):.4f}\n"
+        if distances
+        else f"RELEVANCE_SCORE: {max(it.score for it in run):.4f}\n"
+    )
+    return (
+        f"SOURCE: {first.url}\n"
+        + (f"SCOPE: {first.scope}\n" if first.scope and multi_scope else "")
+        + (f"SECTION: {first.section}\n" if first.section else "")
+        + relevance
+        + f"CONTENT:\n{text}\n"
+        f"---\n"
+    )
+
+
+def format_context(
+    items: List[RetrievedChunk],
+    max_tokens: Optional[int] = None,
+    max_chars: Optional[int] = None,
+) -> str:
+    """Pack retrieved chunks into a prompt block within a token budget.
+
+    Consecutive chunks of the same page are merged into one block (with any
+    overlapping text removed), blocks are taken in rank order, and a block
+    that doesn't fit is skipped so smaller ones further down can still use
+    the budget. A merged run that doesn't fit is retried chunk by chunk.
+    """
+    budget = max(1, max_tokens or SETTINGS.context_max_tokens)
+    multi_scope = len({it.scope for it in items}) > 1
+    header = (
+        "You can use the following retrieved documentation excerpts. "
+        "Cite the SOURCE URLs when referencing details.\n\n"
+    )
+    used_tokens = _estimate_tokens(header)
+    used_chars = len(header)
+    parts: List[str] = []
+    rank = {id(it): r for r, it in enumerate(items)}
+
+    def add(block: str) -> bool:
+        nonlocal used_tokens, used_chars
+        tokens = _estimate_tokens(block)
+        if used_tokens + tokens > budget:
+            return False
+        if max_chars is not None and used_chars + len(block) > max_chars:
+            return False
+        parts.append(block)
+        used_tokens += tokens
+        used_chars += len(block)
+        return True
+
+    for run in _context_runs(items):
+        if add(_context_block(run, multi_scope)) or len(run) == 1:
+            continue
+        for it in sorted(run, key=lambda it: rank[id(it)]):
+            add(_context_block([it], multi_scope))
+
+    return header + "".join(parts)
+
+
+@dataclass
+class UrlIngestResult:
+    url: str
+    status: str  # "ingested" | "skipped" | "empty" | "error"
+    chunks: int = 0
+    new_chunks: int = 0
+    unchanged_chunks: int = 0
+    deleted_chunks: int = 0
+    error: Optional[str] = None
+
+
+# -----------------------------
+# API models
+# -----------------------------
+
+class IngestRequest(BaseModel):
+    urls: List[str] = Field(default_factory=list)
+    scope: str = "global"
+    force_refresh: bool = False
+    # Chunks are sized by RAG_CHUNK_MAX_TOKENS; chunk_chars is an optional hard cap on
+    # characters. overlap is ignored (structure-aware chunks don't overlap) and only
+    # kept so existing clients don't break.
+    chunk_chars: Optional[int] = None
+    overlap: int = 0
+    # Queue as a background job and return its id immediately (poll GET /jobs/{id}).
+    background: bool = False
+
+
+class IngestResponse(BaseModel):
+    scope: str
+    ingested_urls: int
+    ingested_chunks: int
+    skipped_urls: int
+    # Incremental re-ingestion breakdown of ingested_chunks (+ removed stale chunks)
+    new_chunks: int = 0
+    unchanged_chunks: int = 0
+    deleted_chunks: int = 0
+    errors: List[str] = Field(default_factory=list)
+    # Set for background requests (counts all zero), and with HTTP 202 when a reader
+    # stopped waiting for the writer (counts cover the URLs finished so far).
+    job_id: Optional[str] = None
+    timings: Optional[Dict[str, float]] = None  # seconds per stage + "total"
+
+
+class UrlResultModel(BaseModel):
+    url: str
+    status: str
+    chunks: int = 0
+    new_chunks: int = 0
+    unchanged_chunks: int = 0
+    deleted_chunks: int = 0
+    error: Optional[str] = None
+
+
+class JobStatusResponse(BaseModel):
+    job_id: str
+    status: str  # "queued" | "running" | "done" | "failed"
+    scope: str
+    total_urls: int
+    done_urls: int
+    created_at: float
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    results: List[UrlResultModel] = Field(default_factory=list)
+    summary: Optional[IngestResponse] = None
+    error: Optional[str] = None
+    kind: str = "ingest"  # or a scope maintenance job ("compact" | "drop")
+    output: Optional[Dict[str, Any]] = None  # maintenance jobs: the admin endpoint's response
+
+
+class ScopeInfo(BaseModel):
+    collection: str
+    chunks: int  # as stored by the vector backend
+    urls: int
+    bytes: int  # UTF-8 size of the chunk texts, from the manifest
+    oldest_ingested_at: float = 0.0
+    last_active_at: float = 0.0  # latest ingestion or query hit
+
+
+class ScopeListResponse(BaseModel):
+    scopes: List[ScopeInfo]
+
+
+class ScopeCompactResponse(BaseModel):
+    collection: str
+    evicted_urls: int
+    evicted_chunks: int
+    evicted_bytes: int
+    compacted_rows: int  # tombstones reclaimed by the backend (numpy backend only)
+    swept_pages: int  # page-store entries of URLs no scope references any more
+    swept_objects: int  # raw page bodies nothing points to
+
+
+class ScopeJobRequest(BaseModel):
+    # Scope maintenance a reader hands to the writer; scope is the collection name.
+    scope: str
+
+
+class ScopeDropResponse(BaseModel):
+    collection: str
+    dropped_chunks: int
+
+
+RetrievalMode = Literal["hybrid", "vector", "lexical"]
+
+
+def normalize_scopes(scope: Union[str, List[str]]) -> List[str]:
+    scopes = [scope] if isinstance(scope, str) else list(scope)
+    out = list(dict.fromkeys(s.strip() for s in scopes if s and s.strip()))
+    return out or ["global"]
+
+
+class QueryRequest(BaseModel):
+    query: str
+    # One scope, or several to search in parallel (results are merged).
+    scope: Union[str, List[str]] = "global"
+    k: int = 6
+    mode: Optional[RetrievalMode] = None  # default: RAG_RETRIEVAL_MODE
+    max_context_tokens: Optional[int] = None  # default: RAG_CONTEXT_MAX_TOKENS
+
+
+class QueryResponse(BaseModel):
+    scope: str  # comma-joined when several scopes were searched
+    context: str
+    sources: List[str]
+    scopes: List[str] = Field(default_factory=list)
+    timings: Optional[Dict[str, float]] = None  # seconds per stage + "total"
+
+
+class BatchQueryItem(BaseModel):
+    query: str
+    k: Optional[int] = None  # default: the request's k
+
+
+class BatchQueryRequest(BaseModel):
+    # Plain strings or {"query": ..., "k": ...} objects.
+    queries: List[Union[str, BatchQueryItem]]
+    scope: Union[str, List[str]] = "global"
+    k: int = 6
+    mode: Optional[RetrievalMode] = None
+    max_context_tokens: Optional[int] = None  # per query
+
+
+class BatchQueryResponse(BaseModel):
+    results: List[QueryResponse]  # same order as the request's queries
+    timings: Optional[Dict[str, float]] = None
 
 
 class AskRequest(BaseModel):
     query: str
-    scope: str = "global"
+    # Several scopes: all are queried, newly found pages are ingested into the first one.
+    scope: Union[str, List[str]] = "global"
     search: bool = True
     max_search_results: int = 5
     max_urls_to_ingest: int = 5
     force_refresh: bool = False
     k: int = 6
+    mode: Optional[RetrievalMode] = None
+    max_context_tokens: Optional[int] = None
+    # Seconds to spend on search + ingestion before answering from the current index.
+    # None -> RAG_ASK_LATENCY_BUDGET_S; 0 -> wait for every URL.
+    latency_budget_s: Optional[float] = None
 
 
 class AskResponse(BaseModel):
     scope: str
     context: str
     sources: List[str]
+    scopes: List[str] = Field(default_factory=list)
     ingested_urls: int
     ingested_chunks: int
+    pending_urls: int = 0  # still being ingested in the background when we answered
+    timings: Optional[Dict[str, float]] = None
+
+
+class IngestPipeline:
+    """Staged ingestion: fetch -> extract/chunk -> batched embed -> upsert.
+
+    URLs move through the stages independently. Fetches run on the domain-limited
+    ingest pool, extraction and chunking on the extract pool, and one embedder
+    thread per pipeline drains every page that is ready and embeds their new
+    chunks in one go. Callers can stop waiting at any point (``wait(timeout)``);
+    work already in flight keeps running and still lands in the index.
+    """
+
+    def __init__(
+        self,
+        collection,
+        max_chars: Optional[int] = None,
+        force_refresh: bool = False,
+        on_result: Optional[Callable[[UrlIngestResult], None]] = None,
+    ):
+        self.collection = collection
+        self.max_chars = max_chars
+        self.force_refresh = force_refresh
+        self.on_result = on_result
+        self._lock = threading.Lock()
+        self._order: List[str] = []
+        self._results: Dict[str, UrlIngestResult] = {}
+        self._pending = 0
+        self._closed = False
+        self._done = threading.Event()
+        self._embed_q: "queue.Queue[Optional[Tuple[UpsertPlan, str]]]" = queue.Queue()
+        self._embed_thread: Optional[threading.Thread] = None
+
+    # -- public API --
+
+    def add_urls(self, urls: Iterable[str]) -> None:
+        with self._lock:
+            fresh_urls = [u for u in dict.fromkeys(urls) if u not in self._order]
+            self._order.extend(fresh_urls)
+            self._pending += len(fresh_urls)
+
+        known = _manifest.lookup(self.collection, fresh_urls)
+        for url in fresh_urls:
+            entry = known.get(url)
+            if entry is not None and not self.force_refresh and _manifest.is_fresh(entry):
+                self._finish(UrlIngestResult(url=url, status="skipped"))
+            else:
+                _ingest_pool.submit(_domain(url), _with_context(partial(self._fetch, url, entry)))
+
+    def close(self) -> None:
+        """No more URLs will be added; ``wait()`` returns once the in-flight ones finish."""
+        with self._lock:
+            self._closed = True
+            self._check_done()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        return self._done.wait(timeout)
+
+    @property
+    def pending(self) -> int:
+        with self._lock:
+            return self._pending
+
+    def results(self) -> List[UrlIngestResult]:
+        """Finished URLs so far, in the order they were added."""
+        with self._lock:
+            return [self._results[u] for u in self._order if u in self._results]
+
+    # -- stages --
+
+    def _fetch(self, url: str, known: Optional[ManifestEntry]) -> None:
+        try:
+            # force_refresh: a full GET; a 304 can't stand in for what the server sends now.
+            page = fetch_page(url, revalidate=not self.force_refresh)
+            if known is not None and page.content_hash == known.content_hash:
+                # Same body as this scope indexed: nothing to re-extract or re-embed.
+                _manifest.record(self.collection, url, page.content_hash, known.chunks)
+                self._finish(UrlIngestResult(url=url, status="skipped"))
+                return
+            # Hand off so this domain slot can start the next download right away.
+            _extract_pool.submit(_with_context(self._extract), page)
+        except Exception as e:
+            self._finish(UrlIngestResult(url=url, status="error", error=f"{url}: {e}"))
+
+    def _extract(self, page: FetchedPage) -> None:
+        url = page.url
+        try:
+            text = extract_main_text(page.html, url=url)
+            if len(text) < 200:
+                self._finish(
+                    UrlIngestResult(url=url, status="error", error=f"Too little extracted text: {url}")
+                )
+                return
+            chunks = chunk_text(text, max_chars=self.max_chars)
+            if not chunks:
+                self._finish(UrlIngestResult(url=url, status="empty"))
+                return
+            plan = plan_upsert(self.collection, url, chunks)
+        except Exception as e:
+            self._finish(UrlIngestResult(url=url, status="error", error=f"{url}: {e}"))
+            return
+
+        if not plan.new_ids:
+            self._store(plan, page.content_hash, None)
+            return
+        with self._lock:
+            if self._embed_thread is None:
+                self._embed_thread = threading.Thread(
+                    target=_with_context(self._embed_loop), name="ingest-embed", daemon=True
+                )
+                self._embed_thread.start()
+        self._embed_q.put((plan, page.content_hash))
+
+    def _embed_loop(self) -> None:
+        # Enough text to keep every parallel embedding slot busy.
+        budget = SETTINGS.embed_batch_chars * max(1, SETTINGS.embed_parallelism)
+        stop = False
+        while not stop:
+            item = self._embed_q.get()
+            if item is None:
+                return
+            group = [item]
+            chars = sum(len(d) for d in item[0].new_docs)
+            while chars < budget:
+                try:
+                    nxt = self._embed_q.get_nowait()
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                group.append(nxt)
+                chars += sum(len(d) for d in nxt[0].new_docs)
+
+            docs = [d for plan, _ in group for d in plan.new_docs]
+            try:
+                embs = _embedder._embed_texts(docs)
+            except Exception as e:
+                for plan, _ in group:
+                    self._finish(
+                        UrlIngestResult(url=plan.url, status="error", error=f"{plan.url}: {e}")
+                    )
+                continue
+            offset = 0
+            for plan, content_hash in group:
+                n = len(plan.new_docs)
+                self._store(plan, content_hash, embs[offset : offset + n])
+                offset += n
+
+    def _store(
+        self, plan: UpsertPlan, content_hash: str, embeddings: Optional[List[List[float]]]
+    ) -> None:
+        try:
+            stats = apply_upsert(plan, embeddings)
+            _manifest.record(self.collection, plan.url, content_hash, stats.total, stats.bytes)
+        except Exception as e:
+            self._finish(UrlIngestResult(url=plan.url, status="error", error=f"{plan.url}: {e}"))
+            return
+        try:
+            enforce_scope_limits(self.collection)
+        except Exception as e:
+            logger.warning("Scope eviction failed for %s: %s", self.collection.name, e)
+        self._finish(
+            UrlIngestResult(
+                url=plan.url,
+                status="ingested",
+                chunks=stats.total,
+                new_chunks=stats.new,
+                unchanged_chunks=stats.unchanged,
+                deleted_chunks=stats.deleted,
+            )
+        )
+
+    def _finish(self, res: UrlIngestResult) -> None:
+        # Notify before counting the URL as done, so observers never see a result
+        # arrive after wait() has returned.
+        if self.on_result is not None:
+            try:
+                self.on_result(res)
+            except Exception as e:
+                logger.warning("Ingest result callback failed for %s: %s", res.url, e)
+        with self._lock:
+            self._results[res.url] = res
+            self._pending -= 1
+            self._check_done()
+
+    def _check_done(self) -> None:
+        # Caller holds self._lock.
+        if self._closed and self._pending == 0 and not self._done.is_set():
+            self._done.set()
+            self._embed_q.put(None)
+
+
+class QueuedIngest:
+    """IngestPipeline's interface for reader processes, which never write to the store.
+
+    ``close()`` queues the URLs as one high-priority job for the writer; ``wait()`` polls
+    the job and reports each URL (``on_result``) as the writer finishes it. Stopping
+    early is fine: the job keeps running and still lands in the index. After
+    ``reader_wait_s`` in total the reader stops waiting (``timed_out``).
+    """
+
+    def __init__(
+        self,
+        scope: str,
+        max_chars: Optional[int] = None,
+        force_refresh: bool = False,
+        on_result: Optional[Callable[[UrlIngestResult], None]] = None,
+    ):
+        self.scope = scope
+        self.max_chars = max_chars
+        self.force_refresh = force_refresh
+        self.on_result = on_result
+        self.job_id: Optional[str] = None
+        self.error: Optional[str] = None  # set if the writer failed the whole job
+        self.timed_out = False
+        self._deadline = float("inf")
+        self._urls: List[str] = []
+        self._status: Optional[JobStatusResponse] = None
+        self._seen = 0
+
+    def add_urls(self, urls: Iterable[str]) -> None:
+        self._urls.extend(u for u in dict.fromkeys(urls) if u not in self._urls)
+
+    def close(self) -> None:
+        """Queue the job (raises HTTPException 429 if the writer's queue is full)."""
+        if self._urls and self.job_id is None:
+            req = IngestRequest(
+                urls=self._urls,
+                scope=self.scope,
+                force_refresh=self.force_refresh,
+                chunk_chars=self.max_chars,
+            )
+            self.job_id = _jobs.submit(req, priority=0)
+            self._deadline = time.monotonic() + SETTINGS.reader_wait_s
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """True once there is nothing left to wait for: the job ended, or we gave up on it."""
+        if self.job_id is None or self.timed_out:
+            return True
+        remaining = self._deadline - time.monotonic()
+        status = wait_for_job(
+            self.job_id,
+            max(0.0, remaining if timeout is None else min(timeout, remaining)),
+            on_status=self._update,
+        )
+        if status is None or status.status in ("done", "failed"):
+            return True
+        if time.monotonic() >= self._deadline:
+            logger.warning(
+                "Stopped waiting for ingest job %s after %.0fs (%s)",
+                self.job_id,
+                SETTINGS.reader_wait_s,
+                status.status,
+            )
+            self.timed_out = True
+            return True
+        return False
+
+    @property
+    def pending(self) -> int:
+        if self._status is None:
+            return len(self._urls[:50]) if self.job_id is not None else 0
+        if self._status.status in ("done", "failed"):
+            return 0
+        return max(0, self._status.total_urls - self._status.done_urls)
+
+    def results(self) -> List[UrlIngestResult]:
+        """Finished URLs so far, in the order the writer finished them."""
+        if self._status is None:
+            return []
+        return [UrlIngestResult(**r.model_dump()) for r in self._status.results]
+
+    def _update(self, status: JobStatusResponse) -> None:
+        self._status = status
+        self.error = status.error
+        # A re-claimed job (lease expired) starts its results over.
+        self._seen = min(self._seen, len(status.results))
+        fresh = status.results[self._seen :]
+        self._seen = len(status.results)
+        if any(r.status == "ingested" for r in fresh):
+            _generations.expire()  # so a query right now sees the pages the writer just stored
+        if self.on_result is None:
+            return
+        for r in fresh:
+            try:
+                self.on_result(UrlIngestResult(**r.model_dump()))
+            except Exception as e:
+                logger.warning("Ingest result callback failed for %s: %s", r.url, e)
+
+
+def ingest_runner(
+    scope: str,
+    max_chars: Optional[int] = None,
+    force_refresh: bool = False,
+    on_result: Optional[Callable[[UrlIngestResult], None]] = None,
+) -> Union[IngestPipeline, QueuedIngest]:
+    """Ingest in-process in the writer; readers queue the work for it."""
+    if is_writer():
+        return IngestPipeline(
+            get_collection(scope),
+            max_chars=max_chars,
+            force_refresh=force_refresh,
+            on_result=on_result,
+        )
+    return QueuedIngest(scope, max_chars=max_chars, force_refresh=force_refresh, on_result=on_result)
+
+
+def summarize_ingest(scope: str, results: List[UrlIngestResult]) -> IngestResponse:
+    resp = IngestResponse(scope=scope, ingested_urls=0, ingested_chunks=0, skipped_urls=0)
+    for res in results:
+        if res.status == "skipped":
+            resp.skipped_urls += 1
+        elif res.status == "ingested":
+            resp.ingested_urls += 1
+            resp.ingested_chunks += res.chunks
+            resp.new_chunks += res.new_chunks
+            resp.unchanged_chunks += res.unchanged_chunks
+            resp.deleted_chunks += res.deleted_chunks
+        elif res.error:
+            resp.errors.append(res.error)
+    return resp
+
+
+class JobQueue:
+    """Bounded, durable queue of background jobs (SQLite in data_dir).
+
+    Only the writer process claims jobs; readers submit ingestion and scope maintenance
+    here and poll for the outcome. A claim is a lease that progress updates renew; jobs
+    whose lease ran out (crashed writer) are claimed again, up to ``max_attempts``
+    claims in total. Each claim gets its own owner token, and progress or results from
+    an older claim are ignored. Lower ``priority`` runs first: requests someone is
+    waiting on (0) overtake background ingestion (1).
+    """
+
+    poll_s = 0.05  # how often an idle consumer looks for jobs queued by other processes
+
+    def __init__(
+        self,
+        path: str,
+        max_depth: int,
+        lease_s: float,
+        retention_s: float,
+        max_attempts: int = 3,
+    ):
+        self.path = path
+        self.max_depth = max(1, max_depth)
+        self.lease_s = lease_s
+        self.retention_s = retention_s
+        self.max_attempts = max(1, max_attempts)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._conn = _sqlite_connect(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            " id TEXT PRIMARY KEY, status TEXT NOT NULL, scope TEXT NOT NULL,"
+            " request TEXT NOT NULL, total INTEGER NOT NULL, results TEXT NOT NULL DEFAULT '[]',"
+            " error TEXT, created_at REAL NOT NULL, started_at REAL, finished_at REAL,"
+            " lease_until REAL, owner TEXT)"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+        if "kind" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'ingest'")
+        if "priority" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN priority INTEGER NOT NULL DEFAULT 1")
+        if "output" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN output TEXT")
+        if "attempts" not in columns:
+            self._conn.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+
+    def submit(self, req: BaseModel, kind: str = "ingest", priority: int = 1) -> str:
+        job_id = uuid.uuid4().hex
+        payload = req.model_dump_json(exclude={"background"})
+        total = len(req.urls[:50]) if isinstance(req, IngestRequest) else 0
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                (depth,) = self._conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+                ).fetchone()
+                if depth >= self.max_depth:
+                    raise HTTPException(
+                        status_code=429,
+                        detail=f"Ingestion queue is full ({depth} jobs); retry later",
+                    )
+                self._conn.execute(
+                    "INSERT INTO jobs (id, status, scope, request, total, created_at, kind, priority)"
+                    " VALUES (?, 'queued', ?, ?, ?, ?, ?, ?)",
+                    (job_id, req.scope, payload, total, time.time(), kind, priority),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._wakeup.set()
+        return job_id
+
+    def claim(self) -> Optional[Tuple[str, str, str, str]]:
+        """Lease the next job; returns (job id, owner token, kind, request JSON)."""
+        now = time.time()
+        owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                while True:
+                    row = self._conn.execute(
+                        "SELECT id, kind, request, attempts FROM jobs WHERE status = 'queued'"
+                        " OR (status = 'running' AND lease_until < ?)"
+                        " ORDER BY priority, created_at LIMIT 1",
+                        (now,),
+                    ).fetchone()
+                    if row is None or row[3] < self.max_attempts:
+                        break
+                    # Every earlier claim died mid-job; don't hand it to another worker.
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'failed', error = ?, finished_at = ?,"
+                        " lease_until = NULL WHERE id = ?",
+                        (f"Gave up after {row[3]} attempts", now, row[0]),
+                    )
+                    logger.warning("Job %s failed after %d attempts", row[0], row[3])
+                if row is not None:
+                    self._conn.execute(
+                        "UPDATE jobs SET status = 'running', started_at = ?, lease_until = ?,"
+                        " owner = ?, results = '[]', attempts = attempts + 1 WHERE id = ?",
+                        (now, now + self.lease_s, owner, row[0]),
+                    )
+                self._conn.execute(
+                    "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished_at < ?",
+                    (now - self.retention_s,),
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        return row[0], owner, row[1], row[2]
+
+    def requeue_running(self) -> int:
+        """Hand back jobs a previous writer left running; only valid while holding the writer lock."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = 'queued', lease_until = NULL, results = '[]'"
+                " WHERE status = 'running'"
+            )
+        if cur.rowcount:
+            self._wakeup.set()
+        return cur.rowcount
+
+    def progress(self, job_id: str, owner: str, results: List[UrlIngestResult]) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET results = ?, lease_until = ?"
+                " WHERE id = ? AND owner = ? AND status = 'running'",
+                (
+                    json.dumps([asdict(r) for r in results]),
+                    time.time() + self.lease_s,
+                    job_id,
+                    owner,
+                ),
+            )
+
+    def finish(
+        self,
+        job_id: str,
+        owner: str,
+        results: List[UrlIngestResult],
+        error: Optional[str] = None,
+        output: Optional[Dict[str, Any]] = None,
+    ) -> bool:
+        """Record the outcome; False if the claim was lost (lease expired, job re-claimed)."""
+        with self._lock:
+            cur = self._conn.execute(
+                "UPDATE jobs SET status = ?, results = ?, error = ?, finished_at = ?,"
+                " lease_until = NULL, output = ? WHERE id = ? AND owner = ? AND status = 'running'",
+                (
+                    "failed" if error else "done",
+                    json.dumps([asdict(r) for r in results]),
+                    error,
+                    time.time(),
+                    json.dumps(output) if output is not None else None,
+                    job_id,
+                    owner,
+                ),
+            )
+        if not cur.rowcount:
+            logger.warning("Job %s was re-claimed; dropping this claim's results", job_id)
+        return bool(cur.rowcount)
+
+    def get(self, job_id: str) -> Optional[JobStatusResponse]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT id, status, scope, total, results, error, created_at, started_at,"
+                " finished_at, kind, output FROM jobs WHERE id = ?",
+                (job_id,),
+            ).fetchone()
+        if row is None:
+            return None
+        results = [UrlIngestResult(**r) for r in json.loads(row[4])]
+        summary = None
+        if row[1] in ("done", "failed") and row[9] == "ingest":
+            summary = summarize_ingest(row[2], results)
+            summary.job_id = row[0]
+        return JobStatusResponse(
+            job_id=row[0],
+            status=row[1],
+            scope=row[2],
+            total_urls=row[3],
+            done_urls=len(results),
+            created_at=row[6],
+            started_at=row[7],
+            finished_at=row[8],
+            results=[UrlResultModel(**asdict(r)) for r in results],
+            summary=summary,
+            error=row[5],
+            kind=row[9],
+            output=json.loads(row[10]) if row[10] else None,
+        )
+
+    def depth(self) -> Dict[str, int]:
+        with self._lock:
+            rows = self._conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+        return {status: n for status, n in rows}
+
+    def wait_for_work(self, timeout: float) -> None:
+        # Local submits wake us instantly; a commit by another process (a reader queueing
+        # a job) shows up as a new data_version within poll_s.
+        deadline = time.monotonic() + timeout
+        with self._lock:
+            version = self._conn.execute("PRAGMA data_version").fetchone()[0]
+        while not self._wakeup.wait(max(0.0, min(self.poll_s, deadline - time.monotonic()))):
+            if time.monotonic() >= deadline:
+                break
+            with self._lock:
+                if self._conn.execute("PRAGMA data_version").fetchone()[0] != version:
+                    break
+        self._wakeup.clear()
+
+
+_jobs = JobQueue(
+    os.path.join(SETTINGS.data_dir, "jobs.sqlite3"),
+    max_depth=SETTINGS.job_queue_depth,
+    lease_s=SETTINGS.job_lease_s,
+    retention_s=SETTINGS.job_retention_s,
+    max_attempts=SETTINGS.job_max_attempts,
+)
+
+
+def run_ingest_job(job_id: str, owner: str, req: IngestRequest) -> None:
+    lock = threading.Lock()
+    done: List[UrlIngestResult] = []
+
+    def on_result(res: UrlIngestResult) -> None:
+        with lock:
+            done.append(res)
+            snapshot = list(done)
+        _jobs.progress(job_id, owner, snapshot)
+
+    try:
+        pipeline = IngestPipeline(
+            get_collection(req.scope),
+            max_chars=req.chunk_chars,
+            force_refresh=req.force_refresh,
+            on_result=on_result,
+        )
+        pipeline.add_urls(req.urls[:50])
+        pipeline.close()
+        pipeline.wait()
+        _jobs.finish(job_id, owner, pipeline.results())
+    except Exception as e:
+        logger.exception("Ingestion job %s failed", job_id)
+        with lock:
+            partial_results = list(done)
+        _jobs.finish(job_id, owner, partial_results, error=str(e))
+
+
+def run_scope_job(job_id: str, owner: str, kind: str, req: ScopeJobRequest) -> None:
+    try:
+        if kind == "compact":
+            resp: BaseModel = _compact_scope_here(req.scope)
+        elif kind == "drop":
+            resp = _drop_scope_here(req.scope)
+        else:
+            raise ValueError(f"Unknown job kind: {kind!r}")
+        _jobs.finish(job_id, owner, [], output=resp.model_dump())
+    except HTTPException as e:
+        _jobs.finish(job_id, owner, [], error=str(e.detail), output={"status_code": e.status_code})
+    except Exception as e:
+        logger.exception("%s job %s failed", kind, job_id)
+        _jobs.finish(job_id, owner, [], error=str(e))
+
+
+def wait_for_job(
+    job_id: str,
+    timeout: float,
+    on_status: Optional[Callable[[JobStatusResponse], None]] = None,
+) -> Optional[JobStatusResponse]:
+    """Poll a job until it finishes or ``timeout`` runs out; returns the last status seen."""
+    deadline = time.monotonic() + timeout
+    delay = 0.02
+    while True:
+        status = _jobs.get(job_id)
+        if status is not None and on_status is not None:
+            on_status(status)
+        if status is None or status.status in ("done", "failed"):
+            # Let this process see the writer's changes on its very next read.
+            _generations.expire()
+            _reopen_due.set()
+            return status
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return status
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, 0.25)
+
+
+def _job_worker() -> None:
+    while True:
+        try:
+            job = _jobs.claim()
+        except Exception as e:
+            logger.warning("Job queue unavailable: %s", e)
+            job = None
+        if job is None:
+            _jobs.wait_for_work(timeout=1.0)
+            continue
+        job_id, owner, kind, payload = job
+        if kind == "ingest":
+            run_ingest_job(job_id, owner, IngestRequest.model_validate_json(payload))
+        else:
+            run_scope_job(job_id, owner, kind, ScopeJobRequest.model_validate_json(payload))
+
+
+_job_workers_started = False
+
+
+def start_job_workers() -> None:
+    global _job_workers_started
+    if _job_workers_started:
+        return
+    _job_workers_started = True
+    for i in range(max(0, SETTINGS.job_workers)):
+        threading.Thread(target=_job_worker, name=f"ingest-job-{i}", daemon=True).start()
+
+
+# -----------------------------
+# Writer election
+# -----------------------------
+
+class WriterLock:
+    """Exclusive ``flock`` on data_dir/writer.lock, held by the writer until it exits.
+
+    The kernel releases it when the process dies, so a standby reader can take over.
+    The file holds the writer's pid, for humans.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd: Optional[int] = None
+
+    @property
+    def held(self) -> bool:
+        return self._fd is not None
+
+    def acquire(self, blocking: bool = False) -> bool:
+        if self._fd is not None:
+            return True
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, f"{os.getpid()}\n".encode())
+        self._fd = fd
+        return True
+
+
+_writer_lock = WriterLock(os.path.join(SETTINGS.data_dir, "writer.lock"))
+# Until the startup hook elects a role, code importing this module (scripts, the
+# benchmark) writes directly, as it always has.
+_role = "writer"
+
+
+def is_writer() -> bool:
+    return _role == "writer"
+
+
+def _become_writer() -> None:
+    global _role
+    with _store_lock:
+        if _role == "reader":
+            # Handles opened as a reader may miss the previous writer's last changes.
+            _vector_store().refresh(force=True)
+            _collections.clear()
+        _role = "writer"
+    if _writer_lock.held:
+        requeued = _jobs.requeue_running()
+        if requeued:
+            logger.info("Re-queued %d job(s) left running by the previous writer", requeued)
+    start_job_workers()
+
+
+def _standby() -> None:
+    while not _writer_lock.acquire():
+        time.sleep(5.0)
+    logger.info("Worker %d takes over as the writer", os.getpid())
+    _become_writer()
+
+
+def elect_role() -> str:
+    """Decide whether this process is the writer (see Settings.role); returns the role."""
+    global _role
+    role = SETTINGS.role.lower()
+    if role == "reader":
+        _role = "reader"
+    elif fcntl is None:
+        logger.warning("No fcntl on this platform: every worker process writes to the store")
+        _become_writer()
+    elif role == "writer":
+        _writer_lock.acquire(blocking=True)
+        _become_writer()
+    elif _writer_lock.acquire():
+        _become_writer()
+    else:
+        _role = "reader"
+        threading.Thread(target=_standby, name="writer-standby", daemon=True).start()
+    logger.info("Worker %d runs as the %s", os.getpid(), _role)
+    return _role
 
 
 # -----------------------------
@@ -474,82 +4812,263 @@ class AskResponse(BaseModel):
 app = FastAPI(title="CoAct WebRAG", version="0.1.0")
 
 
+@app.on_event("startup")
+def _startup() -> None:
+    elect_role()
+    try:
+        loaded = warm_up()
+        logger.info("Chroma warm-up: %d scope(s) loaded", len(loaded))
+    except Exception as e:
+        # Don't refuse to boot; the first request will retry lazily.
+        logger.warning("Chroma warm-up failed: %s", e)
+
+
 @app.get("/health")
 def health() -> Dict[str, str]:
     return {"status": "ok"}
 
 
+@app.get("/stats")
+def stats() -> Dict[str, Any]:
+    return {
+        "role": _role,
+        "embed_cache": _embed_cache.stats() if _embed_cache is not None else None,
+        "embed_batches": _embedder.batch_stats(),
+        "query_embedding_cache": _query_embedding_cache.stats(),
+        "retrieval_cache": _retrieval_cache.stats(),
+        "jobs": _jobs.depth(),
+        "search_cache": _search_cache.stats(),
+        "search_providers": search_provider_stats(),
+    }
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> str:
+    """Prometheus text format. Each worker process keeps its own series (``worker`` label)."""
+    worker = f'worker="{os.getpid()}"'
+    lines = _stage_seconds.render(worker) + _stage_errors.render(worker)
+    lines += _request_seconds.render(worker)
+
+    caches = {
+        "embedding": _embed_cache.stats() if _embed_cache is not None else None,
+        "query_embedding": _query_embedding_cache.stats(),
+        "retrieval": _retrieval_cache.stats(),
+        "search": _search_cache.stats(),
+    }
+    for kind in ("hits", "misses"):
+        name = f"rag_cache_{kind}_total"
+        lines += [f"# HELP {name} Cache {kind}.", f"# TYPE {name} counter"]
+        lines += [
+            f'{name}{{cache="{cache}",{worker}}} {st[kind]}'
+            for cache, st in caches.items()
+            if st is not None
+        ]
+    lines += ["# HELP rag_writer 1 in the process that writes to the store.", "# TYPE rag_writer gauge"]
+    lines += [f"rag_writer{{{worker}}} {int(is_writer())}"]
+    lines += ["# HELP rag_jobs Background ingest jobs by status.", "# TYPE rag_jobs gauge"]
+    lines += [f'rag_jobs{{status="{status}",{worker}}} {n}' for status, n in _jobs.depth().items()]
+    return "\n".join(lines) + "\n"
+
+
 @app.post("/ingest", response_model=IngestResponse)
-def ingest(req: IngestRequest) -> IngestResponse:
-    if not req.urls:
-        raise HTTPException(status_code=400, detail="No URLs provided")
+def ingest(req: IngestRequest) -> Union[IngestResponse, JSONResponse]:
+    with request_timer("/ingest") as timings:
+        if not req.urls:
+            raise HTTPException(status_code=400, detail="No URLs provided")
 
-    collection = get_collection(req.scope)
+        if req.background:
+            job_id = _jobs.submit(req)
+            return IngestResponse(
+                scope=req.scope, ingested_urls=0, ingested_chunks=0, skipped_urls=0, job_id=job_id
+            )
 
-    ingested_urls = 0
-    ingested_chunks = 0
-    skipped = 0
-    errors: List[str] = []
+        pipeline = ingest_runner(
+            req.scope, max_chars=req.chunk_chars, force_refresh=req.force_refresh
+        )
+        pipeline.add_urls(req.urls[:50])  # hard cap
+        pipeline.close()
+        pipeline.wait()
+        resp = summarize_ingest(req.scope, pipeline.results())
+        if isinstance(pipeline, QueuedIngest) and pipeline.error:
+            resp.errors.append(pipeline.error)
+        resp.timings = timings.snapshot()
+        if isinstance(pipeline, QueuedIngest) and pipeline.timed_out:
+            # The writer is still on it: what finished so far, and the job to poll.
+            resp.job_id = pipeline.job_id
+            return JSONResponse(status_code=202, content=resp.model_dump())
+        return resp
 
-    for url in req.urls[:50]:  # hard cap
-        try:
-            if (not req.force_refresh) and already_ingested(collection, url):
-                skipped += 1
-                continue
 
-            html = fetch_url(url)
-            text = extract_main_text(html, url=url)
-            if len(text) < 200:
-                errors.append(f"Too little extracted text: {url}")
-                continue
+def _admin_collection_name(scope: str) -> str:
+    # Accept the scope as used in requests, or the collection name /admin/scopes lists.
+    if scope.startswith("webdocs_") and scope in _vector_store().list_names():
+        return scope
+    return _safe_collection_name(scope)
 
-            chunks = upsert_url(
-                collection,
-                url=url,
-                text=text,
-                chunk_chars=req.chunk_chars,
-                overlap=req.overlap,
+
+@app.get("/admin/scopes", response_model=ScopeListResponse)
+def admin_scopes() -> ScopeListResponse:
+    totals = _manifest.totals()
+    out = []
+    for name in sorted(_vector_store().list_names()):
+        if not name.startswith("webdocs_"):
+            continue
+        t = totals.get(name, {})
+        out.append(
+            ScopeInfo(
+                collection=name,
+                chunks=_get_collection_by_name(name).count(),
+                urls=int(t.get("urls", 0)),
+                bytes=int(t.get("bytes", 0)),
+                oldest_ingested_at=float(t.get("oldest_ingested_at", 0.0)),
+                last_active_at=float(t.get("last_active_at", 0.0)),
             )
-            if chunks:
-                ingested_urls += 1
-                ingested_chunks += chunks
-        except Exception as e:
-            errors.append(f"{url}: {e}")
-
-    return IngestResponse(
-        scope=req.scope,
-        ingested_urls=ingested_urls,
-        ingested_chunks=ingested_chunks,
-        skipped_urls=skipped,
-        errors=errors,
+        )
+    return ScopeListResponse(scopes=out)
+
+
+def _on_writer(kind: str, name: str) -> Union[Dict[str, Any], JSONResponse]:
+    """Readers: run scope maintenance as a job on the writer and return its response.
+
+    If the job hasn't ended within ``reader_wait_s``, returns 202 with the job's status
+    instead; its ``output`` is in ``GET /jobs/{job_id}`` once the writer is done.
+    """
+    job_id = _jobs.submit(ScopeJobRequest(scope=name), kind=kind, priority=0)
+    status = wait_for_job(job_id, SETTINGS.reader_wait_s)
+    if status is None:
+        raise HTTPException(status_code=500, detail=f"The {kind} job for {name} expired")
+    if status.status not in ("done", "failed"):
+        return JSONResponse(status_code=202, content=status.model_dump())
+    if status.status == "failed":
+        code = int((status.output or {}).get("status_code", 500))
+        raise HTTPException(status_code=code, detail=status.error)
+    return status.output or {}
+
+
+def _compact_scope_here(name: str) -> ScopeCompactResponse:
+    if name not in _vector_store().list_names():
+        raise HTTPException(status_code=404, detail=f"Unknown scope: {name}")
+    evicted, compacted = compact_scope(_get_collection_by_name(name))
+    swept_pages = swept_objects = 0
+    if _page_store is not None:
+        swept_pages, swept_objects = _page_store.sweep(_manifest.all_urls())
+    return ScopeCompactResponse(
+        collection=name,
+        evicted_urls=evicted.urls,
+        evicted_chunks=evicted.chunks,
+        evicted_bytes=evicted.bytes,
+        compacted_rows=compacted,
+        swept_pages=swept_pages,
+        swept_objects=swept_objects,
     )
 
 
-@app.post("/query", response_model=QueryResponse)
-def query(req: QueryRequest) -> QueryResponse:
-    if not req.query.strip():
-        raise HTTPException(status_code=400, detail="Empty query")
+def _drop_scope_here(name: str) -> ScopeDropResponse:
+    return ScopeDropResponse(collection=name, dropped_chunks=drop_scope(name))
+
+
+@app.post("/admin/scopes/{scope}/compact", response_model=ScopeCompactResponse)
+def admin_compact_scope(scope: str) -> Union[ScopeCompactResponse, JSONResponse]:
+    name = _admin_collection_name(scope)
+    if name not in _vector_store().list_names():
+        raise HTTPException(status_code=404, detail=f"Unknown scope: {scope}")
+    if is_writer():
+        return _compact_scope_here(name)
+    out = _on_writer("compact", name)
+    return out if isinstance(out, JSONResponse) else ScopeCompactResponse(**out)
+
+
+@app.delete("/admin/scopes/{scope}", response_model=ScopeDropResponse)
+def admin_drop_scope(scope: str) -> Union[ScopeDropResponse, JSONResponse]:
+    name = _admin_collection_name(scope)
+    if is_writer():
+        resp = _drop_scope_here(name)
+    else:
+        out = _on_writer("drop", name)
+        if isinstance(out, JSONResponse):
+            return out
+        resp = ScopeDropResponse(**out)
+    if resp.dropped_chunks < 0:
+        raise HTTPException(status_code=404, detail=f"Unknown scope: {scope}")
+    return resp
+
+
+@app.get("/jobs/{job_id}", response_model=JobStatusResponse)
+def job_status(job_id: str) -> JobStatusResponse:
+    job = _jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Unknown job: {job_id}")
+    return job
+
 
-    collection = get_collection(req.scope)
-    items = retrieve(collection, req.query, k=max(1, min(req.k, 20)))
-    context = format_context(items)
-    sources = [u for (u, _, _) in items if u]
+def _query_response(
+    scopes: List[str], items: List[RetrievedChunk], max_context_tokens: Optional[int] = None
+) -> QueryResponse:
+    context = format_context(items, max_tokens=max_context_tokens)
+    by_scope: Dict[str, List[str]] = {}
+    for it in items:
+        if it.url:
+            by_scope.setdefault(it.scope or scopes[0], []).append(it.url)
+    for scope, urls in by_scope.items():
+        _manifest.touch(get_collection(scope), urls)
+    sources = [it.url for it in items if it.url]
     # de-dup preserve order
     seen = set()
     sources = [u for u in sources if not (u in seen or seen.add(u))]
 
-    return QueryResponse(scope=req.scope, context=context, sources=sources)
+    return QueryResponse(scope=",".join(scopes), context=context, sources=sources, scopes=scopes)
 
 
-@app.post("/ask", response_model=AskResponse)
-def ask(req: AskRequest) -> AskResponse:
-    query_txt = req.query.strip()
-    if not query_txt:
-        raise HTTPException(status_code=400, detail="Empty query")
+@app.post("/query", response_model=QueryResponse)
+def query(req: QueryRequest) -> QueryResponse:
+    with request_timer("/query") as timings:
+        if not req.query.strip():
+            raise HTTPException(status_code=400, detail="Empty query")
 
-    urls: List[str] = []
+        scopes = normalize_scopes(req.scope)
+        items = retrieve_multi(scopes, req.query, k=max(1, min(req.k, 20)), mode=req.mode)
+        resp = _query_response(scopes, items, req.max_context_tokens)
+        resp.timings = timings.snapshot()
+        return resp
+
+
+MAX_BATCH_QUERIES = 64
+
+
+@app.post("/query/batch", response_model=BatchQueryResponse)
+def query_batch(req: BatchQueryRequest) -> BatchQueryResponse:
+    with request_timer("/query/batch") as timings:
+        if not req.queries:
+            raise HTTPException(status_code=400, detail="No queries")
+        if len(req.queries) > MAX_BATCH_QUERIES:
+            raise HTTPException(
+                status_code=400, detail=f"At most {MAX_BATCH_QUERIES} queries per batch"
+            )
+        items = [BatchQueryItem(query=q) if isinstance(q, str) else q for q in req.queries]
+        if any(not it.query.strip() for it in items):
+            raise HTTPException(status_code=400, detail="Empty query")
+
+        scopes = normalize_scopes(req.scope)
+        ks = [max(1, min(it.k if it.k is not None else req.k, 20)) for it in items]
+        results = retrieve_batch(scopes, [it.query for it in items], ks, mode=req.mode)
+        return BatchQueryResponse(
+            results=[_query_response(scopes, r, req.max_context_tokens) for r in results],
+            timings=timings.snapshot(),
+        )
+
+
+def _ask_deadline(req: AskRequest) -> Optional[float]:
+    budget = req.latency_budget_s
+    if budget is None:
+        budget = SETTINGS.ask_latency_budget_s
+    return (time.monotonic() + budget) if budget and budget > 0 else None
+
+
+def _ask_urls(req: AskRequest, query_txt: str) -> Tuple[List[str], List[str]]:
+    """Web search for /ask: (every URL found, the ones worth ingesting, best first)."""
+    found: List[str] = []
     if req.search:
-        urls = search_web(query_txt, max_results=max(1, min(req.max_search_results, 10)))
+        found = search_web(query_txt, max_results=max(1, min(req.max_search_results, 10)))
 
     # Simple heuristic: docs-first preference
     def score_url(u: str) -> int:
@@ -560,26 +5079,201 @@ def ask(req: AskRequest) -> AskResponse:
                 score += 1
         return score
 
-    urls = sorted(urls, key=score_url, reverse=True)[: max(0, min(req.max_urls_to_ingest, 10))]
+    urls = sorted(found, key=score_url, reverse=True)[: max(0, min(req.max_urls_to_ingest, 10))]
+    return found, urls
 
-    ingested_urls = 0
-    ingested_chunks = 0
-    if urls:
-        ir = ingest(
-            IngestRequest(
-                urls=urls,
-                scope=req.scope,
-                force_refresh=req.force_refresh,
+
+def _start_ask_ingest(
+    req: AskRequest,
+    scope: str,
+    urls: List[str],
+    on_result: Optional[Callable[[UrlIngestResult], None]] = None,
+) -> Union[IngestPipeline, QueuedIngest]:
+    pipeline = ingest_runner(scope, force_refresh=req.force_refresh, on_result=on_result)
+    pipeline.add_urls(urls)
+    try:
+        pipeline.close()
+    except HTTPException as e:
+        # The writer is backlogged: answer from what is already indexed.
+        logger.warning("/ask not ingesting %d URL(s): %s", len(urls), e.detail)
+    return pipeline
+
+
+def _ask_query(req: AskRequest, query_txt: str, scopes: List[str]) -> QueryResponse:
+    return query(
+        QueryRequest(
+            query=query_txt,
+            scope=scopes,
+            k=req.k,
+            mode=req.mode,
+            max_context_tokens=req.max_context_tokens,
+        )
+    )
+
+
+@app.post("/ask", response_model=AskResponse)
+def ask(req: AskRequest) -> AskResponse:
+    with request_timer("/ask") as timings:
+        query_txt = req.query.strip()
+        if not query_txt:
+            raise HTTPException(status_code=400, detail="Empty query")
+
+        deadline = _ask_deadline(req)
+        scopes = normalize_scopes(req.scope)
+        _, urls = _ask_urls(req, query_txt)
+        pipeline = _start_ask_ingest(req, scopes[0], urls)
+        # Past the budget we answer from whatever is indexed; the rest finishes in the background.
+        pipeline.wait(None if deadline is None else max(0.0, deadline - time.monotonic()))
+        ir = summarize_ingest(scopes[0], pipeline.results())
+
+        qr = _ask_query(req, query_txt, scopes)
+        return AskResponse(
+            scope=qr.scope,
+            context=qr.context,
+            sources=qr.sources,
+            scopes=scopes,
+            ingested_urls=ir.ingested_urls,
+            ingested_chunks=ir.ingested_chunks,
+            pending_urls=pipeline.pending,
+            timings=timings.snapshot(),
+        )
+
+
+# /ask/stream re-runs retrieval at most this often while pages are still landing.
+STREAM_EXCERPTS_INTERVAL_S = 0.5
+# An idle stream sends a blank line this often; writing it is how a hang-up is noticed.
+STREAM_KEEPALIVE_S = 5.0
+_stream_slots = threading.BoundedSemaphore(max(1, SETTINGS.stream_max_concurrent))
+_stream_pool = ThreadPoolExecutor(
+    max_workers=max(1, SETTINGS.stream_max_concurrent), thread_name_prefix="ask-stream"
+)
+
+
+def _ask_events(
+    req: AskRequest, emit: Callable[[Dict[str, Any]], None], cancelled: threading.Event
+) -> None:
+    """Run /ask, reporting each step through ``emit`` (see ``ask_stream``)."""
+    with request_timer("/ask/stream") as timings:
+        query_txt = req.query.strip()
+        deadline = _ask_deadline(req)
+        scopes = normalize_scopes(req.scope)
+
+        def excerpts(stage: str, qr: QueryResponse) -> None:
+            emit(
+                {"event": "excerpts", "stage": stage, "context": qr.context, "sources": qr.sources}
             )
+
+        # Whatever the index already knows is the earliest useful answer.
+        last = _ask_query(req, query_txt, scopes)
+        if last.sources:
+            excerpts("cached", last)
+        if cancelled.is_set():
+            return
+
+        found, urls = _ask_urls(req, query_txt)
+        emit({"event": "search", "urls": found, "ingesting": urls})
+
+        progress: "queue.Queue[UrlIngestResult]" = queue.Queue()
+        pipeline = _start_ask_ingest(req, scopes[0], urls, on_result=progress.put)
+        results: List[UrlIngestResult] = []
+        stale = False
+        queried_at = time.monotonic()
+        finished = False
+        while not finished and not cancelled.is_set():
+            step = 0.1
+            if deadline is not None:
+                step = min(step, deadline - time.monotonic())
+                if step <= 0:
+                    break
+            finished = pipeline.wait(step)
+            while True:
+                try:
+                    res = progress.get_nowait()
+                except queue.Empty:
+                    break
+                results.append(res)
+                stale = stale or res.status == "ingested"
+                emit({"event": "ingest", **asdict(res), "done": len(results), "total": len(urls)})
+            if stale and (finished or time.monotonic() - queried_at >= STREAM_EXCERPTS_INTERVAL_S):
+                stale = False
+                queried_at = time.monotonic()
+                qr = _ask_query(req, query_txt, scopes)
+                if qr.context != last.context:
+                    excerpts("ingested", qr)
+                last = qr
+        if cancelled.is_set():
+            return  # the client hung up; ingestion carries on in the background
+        if stale:
+            last = _ask_query(req, query_txt, scopes)
+            excerpts("ingested", last)
+
+        ir = summarize_ingest(scopes[0], results)
+        summary = AskResponse(
+            scope=last.scope,
+            context=last.context,
+            sources=last.sources,
+            scopes=scopes,
+            ingested_urls=ir.ingested_urls,
+            ingested_chunks=ir.ingested_chunks,
+            pending_urls=pipeline.pending,
+            timings=timings.snapshot(),
+        )
+        emit({"event": "summary", **summary.model_dump()})
+
+
+@app.post("/ask/stream")
+def ask_stream(req: AskRequest) -> StreamingResponse:
+    """``/ask`` as NDJSON, one event per line as soon as it is known.
+
+    ``excerpts`` (context + sources; each replaces the previous one) comes first from
+    the current index (``"stage": "cached"``) and again whenever newly ingested pages
+    change it (``"stage": "ingested"``); ``search`` lists the URLs found and the ones
+    being ingested; ``ingest`` reports each finished URL. The last line is ``summary``
+    (the ``/ask`` response) or ``error``. Blank lines are keep-alives. Clients may hang
+    up at any point: retrieval for them stops, ingestion carries on in the background.
+    At most ``RAG_STREAM_MAX_CONCURRENT`` streams run per worker; beyond that it's 503.
+    """
+    if not req.query.strip():
+        raise HTTPException(status_code=400, detail="Empty query")
+    if not _stream_slots.acquire(blocking=False):
+        raise HTTPException(
+            status_code=503, detail="Too many /ask/stream requests in progress; retry later"
         )
-        ingested_urls = ir.ingested_urls
-        ingested_chunks = ir.ingested_chunks
-
-    qr = query(QueryRequest(query=query_txt, scope=req.scope, k=req.k))
-    return AskResponse(
-        scope=req.scope,
-        context=qr.context,
-        sources=qr.sources,
-        ingested_urls=ingested_urls,
-        ingested_chunks=ingested_chunks,
-    )
\ No newline at end of file
+    events: "queue.Queue[Optional[Dict[str, Any]]]" = queue.Queue()
+    cancelled = threading.Event()
+
+    def produce() -> None:
+        try:
+            _ask_events(req, events.put, cancelled)
+        except HTTPException as e:
+            events.put({"event": "error", "status_code": e.status_code, "detail": e.detail})
+        except Exception as e:
+            logger.exception("/ask/stream failed")
+            events.put({"event": "error", "status_code": 500, "detail": str(e)})
+        finally:
+            events.put(None)
+            _stream_slots.release()
+
+    try:
+        _stream_pool.submit(_with_context(produce))
+    except BaseException:
+        _stream_slots.release()
+        raise
+
+    def lines() -> Iterator[str]:
+        # Closed when the response ends or the server drops it after a hang-up; the
+        # get() timeout makes sure that happens even while the producer is quiet.
+        try:
+            while True:
+                try:
+                    event = events.get(timeout=STREAM_KEEPALIVE_S)
+                except queue.Empty:
+                    yield "\n"
+                    continue
+                if event is None:
+                    return
+                yield json.dumps(event) + "\n"
+        finally:
+            cancelled.set()
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
@@ -0,0 +1,503 @@
+"""Offline benchmark for the RAG service: ingest throughput and /query, /ask latency.
+
+Everything runs against local fixtures, so neither network nor Ollama is needed:
+
+  * an HTTP server with a generated corpus of documentation-like HTML pages,
+  * a stub Ollama ``/api/embed`` with configurable latency,
+  * a stub Serper ``/search`` endpoint, so ``/ask`` exercises the full path.
+
+The service is imported in-process with its data directory pointed at a temp
+dir, and the endpoint functions are called directly from a thread pool (the
+same way FastAPI runs sync endpoints). RAG_* environment variables apply as
+usual, so a configuration change is benchmarked exactly like a code change.
+
+Usage::
+
+    python rag_service/benchmark.py run --out before.json
+    # ... change something ...
+    python rag_service/benchmark.py run --out after.json
+    python rag_service/benchmark.py compare before.json after.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import importlib
+import json
+import logging
+import math
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+RESULTS_VERSION = 1
+
+_WORDS = (
+    "request response client server session token header cookie cache index query "
+    "vector embedding chunk document page section scope field model schema route "
+    "handler middleware router dependency injection validation serializer parser "
+    "stream buffer socket timeout retry backoff pool worker thread process queue "
+    "event loop task future callback hook plugin config setting option flag default "
+    "error exception warning status code payload body json yaml template render "
+    "database table column transaction commit rollback migration cursor connection "
+    "lock mutex semaphore shard replica cluster node leader follower election lease"
+).split()
+_CODE_NAMES = (
+    "CORSMiddleware", "APIRouter", "BackgroundTasks", "HTTPException", "Depends",
+    "BaseModel", "Field", "validator", "Session", "Retry", "HTTPAdapter", "ThreadPoolExecutor",
+    "allow_origins", "max_retries", "pool_maxsize", "response_model", "status_code",
+)
+
+
+# -----------------------------
+# Fixtures
+# -----------------------------
+
+def make_corpus(pages: int, seed: int) -> Tuple[Dict[str, str], Dict[str, List[str]]]:
+    """Generated doc pages: {path: html}, plus the distinctive terms of each page."""
+    rng = random.Random(seed)
+    html: Dict[str, str] = {}
+    terms: Dict[str, List[str]] = {}
+    for i in range(pages):
+        path = f"/docs/{i:04d}.html"
+        topic = rng.sample(_WORDS, 3)
+        ident = f"{topic[0]}_{topic[1]}_{i}"
+        page_terms = topic + [ident, rng.choice(_CODE_NAMES)]
+        sections: List[str] = []
+        for s in range(rng.randint(4, 10)):
+            parts = [f"<h2>{rng.choice(_WORDS).title()} {rng.choice(_WORDS)} {s}</h2>"]
+            for _ in range(rng.randint(1, 3)):
+                words = [rng.choice(_WORDS) for _ in range(rng.randint(40, 120))]
+                for t in page_terms:
+                    words.insert(rng.randrange(len(words)), t)
+                parts.append(f"<p>{' '.join(words)}.</p>")
+            roll = rng.random()
+            if roll < 0.3:
+                name = rng.choice(_CODE_NAMES)
+                parts.append(
+                    f"<pre><code>from lib import {name}\n\n"
+                    f"app.add({name}, {ident}=True, timeout={rng.randint(1, 60)})\n"
+                    f"result = {ident}.run()\n</code></pre>"
+                )
+            elif roll < 0.5:
+                items = "".join(f"<li>{' '.join(rng.sample(_WORDS, 6))}</li>" for _ in range(5))
+                parts.append(f"<ul>{items}</ul>")
+            elif roll < 0.6:
+                rows = "".join(
+                    f"<tr><td>{rng.choice(_CODE_NAMES)}</td><td>{' '.join(rng.sample(_WORDS, 5))}</td></tr>"
+                    for _ in range(4)
+                )
+                parts.append(f"<table><tr><th>Name</th><th>Description</th></tr>{rows}</table>")
+            sections.append("".join(parts))
+        html[path] = (
+            f"<html><head><title>{' '.join(topic).title()} - Docs</title>"
+            "<style>body{font-family:sans-serif}</style></head><body>"
+            "<nav><a href='/'>Home</a> <a href='/docs'>Docs</a></nav>"
+            f"<main><h1>{' '.join(topic).title()}</h1>{''.join(sections)}</main>"
+            "<footer>Generated benchmark corpus</footer><script>var x = 1;</script></body></html>"
+        )
+        terms[path] = page_terms
+    return html, terms
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """Feature-hashed bag of words: cheap, deterministic, and similar texts stay close."""
+    vec = [0.0] * dim
+    for tok in text.lower().split():
+        h = zlib.crc32(tok.encode("utf-8"))
+        vec[h % dim] += 1.0 if (h >> 16) & 1 else -1.0
+    norm = sum(v * v for v in vec) ** 0.5 or 1.0
+    return [v / norm for v in vec]
+
+
+class FixtureServer:
+    """Serves the corpus, a stub Ollama embed API and a stub Serper search API."""
+
+    def __init__(
+        self,
+        pages: Dict[str, str],
+        terms: Dict[str, List[str]],
+        dim: int,
+        embed_latency_s: float,
+        embed_per_text_s: float,
+    ):
+        self.pages = pages
+        self.dim = dim
+        self.embed_latency_s = embed_latency_s
+        self.embed_per_text_s = embed_per_text_s
+        self.counters = {"page_gets": 0, "not_modified": 0, "embed_calls": 0, "embed_texts": 0, "searches": 0}
+        self._lock = threading.Lock()
+        self._index: Dict[str, List[str]] = {}
+        for path, page_terms in terms.items():
+            for t in page_terms:
+                self._index.setdefault(t.lower(), []).append(path)
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}"
+
+    def start(self) -> "FixtureServer":
+        threading.Thread(target=self._server.serve_forever, name="bench-fixtures", daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        self._server.shutdown()
+
+    def _count(self, key: str, n: int = 1) -> None:
+        with self._lock:
+            self.counters[key] += n
+
+    def search(self, query: str, num: int) -> List[str]:
+        scores: Dict[str, int] = {}
+        for tok in query.lower().split():
+            for path in self._index.get(tok, []):
+                scores[path] = scores.get(path, 0) + 1
+        ranked = sorted(scores, key=lambda p: (-scores[p], p))[:num]
+        return [self.url + p for p in ranked]
+
+    def _handler(self) -> type:
+        fixture = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, *args: Any) -> None:
+                pass
+
+            def _send(self, status: int, body: bytes, ctype: str, headers: Dict[str, str]) -> None:
+                self.send_response(status)
+                self.send_header("Content-Type", ctype)
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self) -> None:
+                page = fixture.pages.get(self.path)
+                if page is None:
+                    self._send(404, b"not found", "text/plain", {})
+                    return
+                fixture._count("page_gets")
+                etag = '"' + hashlib.sha1(page.encode("utf-8")).hexdigest() + '"'
+                if self.headers.get("If-None-Match") == etag:
+                    fixture._count("not_modified")
+                    self._send(304, b"", "text/html", {"ETag": etag})
+                    return
+                self._send(200, page.encode("utf-8"), "text/html; charset=utf-8", {"ETag": etag})
+
+            def do_POST(self) -> None:
+                length = int(self.headers.get("Content-Length") or 0)
+                payload = json.loads(self.rfile.read(length) or b"{}")
+                if self.path == "/api/embed":
+                    texts = payload.get("input") or []
+                    texts = [texts] if isinstance(texts, str) else texts
+                    fixture._count("embed_calls")
+                    fixture._count("embed_texts", len(texts))
+                    time.sleep(fixture.embed_latency_s + fixture.embed_per_text_s * len(texts))
+                    body = {"embeddings": [fake_embedding(t, fixture.dim) for t in texts]}
+                elif self.path == "/search":
+                    fixture._count("searches")
+                    links = fixture.search(payload.get("q", ""), int(payload.get("num", 5)))
+                    body = {"organic": [{"link": u} for u in links]}
+                else:
+                    self._send(404, b"not found", "text/plain", {})
+                    return
+                self._send(200, json.dumps(body).encode("utf-8"), "application/json", {})
+
+        return Handler
+
+
+# -----------------------------
+# Measurements
+# -----------------------------
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def measure_latency(fn: Callable[[Any], Any], requests: List[Any], concurrency: int) -> Dict[str, float]:
+    """Latency percentiles over the successful requests; failures are counted on their own."""
+    latencies: List[float] = []
+    errors = 0
+    lock = threading.Lock()
+
+    def one(req: Any) -> None:
+        nonlocal errors
+        t0 = time.perf_counter()
+        try:
+            fn(req)
+        except Exception as e:
+            logging.getLogger("benchmark").warning("request failed: %s", e)
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(time.perf_counter() - t0)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, requests))
+    wall = time.perf_counter() - t0
+    latencies.sort()
+    return {
+        "requests": len(requests),
+        "errors": errors,
+        "error_rate": errors / len(requests) if requests else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "mean_ms": (sum(latencies) / len(latencies) * 1000) if latencies else 0.0,
+        "max_ms": (latencies[-1] * 1000) if latencies else 0.0,
+        "requests_per_s": len(latencies) / wall if wall else 0.0,
+        "errors_per_s": errors / wall if wall else 0.0,
+    }
+
+
+def bench_ingest(rag: Any, urls: List[str], scope: str, batch: int, force_refresh: bool) -> Dict[str, float]:
+    pages = chunks = errors = 0
+    t0 = time.perf_counter()
+    for start in range(0, len(urls), batch):
+        resp = rag.ingest(
+            rag.IngestRequest(urls=urls[start : start + batch], scope=scope, force_refresh=force_refresh)
+        )
+        pages += resp.ingested_urls + resp.skipped_urls
+        chunks += resp.ingested_chunks
+        errors += len(resp.errors)
+    wall = time.perf_counter() - t0
+    return {
+        "pages": pages,
+        "chunks": chunks,
+        "errors": errors,
+        "seconds": wall,
+        "pages_per_s": pages / wall if wall else 0.0,
+        "chunks_per_s": chunks / wall if wall else 0.0,
+    }
+
+
+def make_queries(terms: Dict[str, List[str]], n: int, seed: int) -> List[str]:
+    """Distinct queries mixing page-specific terms and common words (no cache hits)."""
+    rng = random.Random(seed)
+    paths = sorted(terms)
+    out: List[str] = []
+    seen = set()
+    while len(out) < n:
+        page_terms = terms[rng.choice(paths)]
+        q = " ".join(rng.sample(page_terms, 2) + rng.sample(_WORDS, rng.randint(1, 3)))
+        if q not in seen:
+            seen.add(q)
+            out.append(q)
+    return out
+
+
+def _git_commit(cwd: str) -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=cwd, capture_output=True, text=True, timeout=10
+        )
+        return out.stdout.strip() or None
+    except Exception:
+        return None
+
+
+def run(args: argparse.Namespace) -> Dict[str, Any]:
+    pages, terms = make_corpus(args.pages, args.seed)
+    fixtures = FixtureServer(
+        pages, terms, args.dim, args.embed_latency_ms / 1000.0, args.embed_per_text_ms / 1000.0
+    ).start()
+    data_dir = tempfile.mkdtemp(prefix="rag-bench-")
+
+    # The service reads its settings at import time.
+    os.environ.update(
+        RAG_DATA_DIR=data_dir,
+        CHROMA_DIR=os.path.join(data_dir, "chroma"),
+        OLLAMA_URL=fixtures.url,
+        SERPER_API_KEY="benchmark",
+        RAG_SERPER_URL=fixtures.url + "/search",
+        ANONYMIZED_TELEMETRY="False",
+    )
+    os.environ.pop("TAVILY_API_KEY", None)
+    os.environ.pop("RAG_ALLOWED_DOMAINS", None)
+    if args.backend:
+        os.environ["RAG_VECTOR_BACKEND"] = args.backend
+    here = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, here)
+    rag = importlib.import_module("app")
+
+    try:
+        urls = [fixtures.url + p for p in sorted(pages)]
+        results: Dict[str, Any] = {"ingest": {}, "query": {}, "ask": {}}
+        results["ingest"]["cold"] = bench_ingest(rag, urls, "bench", args.ingest_batch, False)
+        # Second pass: every page revalidates with a conditional GET and is skipped.
+        results["ingest"]["revalidate"] = bench_ingest(rag, urls, "bench", args.ingest_batch, True)
+
+        queries = make_queries(terms, args.queries * len(args.concurrency), args.seed + 1)
+        for i, c in enumerate(args.concurrency):
+            batch = queries[i * args.queries : (i + 1) * args.queries]
+            results["query"][f"c{c}"] = measure_latency(
+                lambda q: rag.query(rag.QueryRequest(query=q, scope="bench", k=args.k, mode=args.mode)),
+                batch,
+                c,
+            )
+
+        asks = make_queries(terms, args.asks * len(args.concurrency), args.seed + 2)
+        for i, c in enumerate(args.concurrency):
+            batch = asks[i * args.asks : (i + 1) * args.asks]
+            # A fresh scope per level, so each level pays for its own first ingestions.
+            results["ask"][f"c{c}"] = measure_latency(
+                lambda q, scope=f"bench_ask_c{c}": rag.ask(
+                    rag.AskRequest(query=q, scope=scope, k=args.k, mode=args.mode)
+                ),
+                batch,
+                c,
+            )
+    finally:
+        fixtures.stop()
+        if not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    metrics: Dict[str, float] = {}
+    for phase, st in results["ingest"].items():
+        metrics[f"ingest.{phase}.pages_per_s"] = st["pages_per_s"]
+        metrics[f"ingest.{phase}.errors"] = st["errors"]
+    metrics["ingest.cold.chunks_per_s"] = results["ingest"]["cold"]["chunks_per_s"]
+    for endpoint in ("query", "ask"):
+        for level, st in results[endpoint].items():
+            for key in ("p50_ms", "p95_ms", "p99_ms", "requests_per_s", "errors", "error_rate"):
+                metrics[f"{endpoint}.{level}.{key}"] = st[key]
+
+    settings = {
+        k: v for k, v in vars(rag.SETTINGS).items() if "key" not in k and "url" not in k and "dir" not in k
+    }
+    return {
+        "version": RESULTS_VERSION,
+        "meta": {
+            "commit": _git_commit(here),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("func", "out")},
+            "settings": settings,
+            "fixtures": dict(fixtures.counters),
+        },
+        "metrics": metrics,
+        "details": results,
+    }
+
+
+# -----------------------------
+# Comparison
+# -----------------------------
+
+def _higher_is_better(metric: str) -> bool:
+    return metric.endswith("_per_s")
+
+
+def _is_error_metric(metric: str) -> bool:
+    return metric.endswith(".errors") or metric.endswith(".error_rate")
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], max_regression_pct: Optional[float]) -> int:
+    """Print per-metric changes; returns 1 if any metric regressed past the threshold.
+
+    Error counts have no tolerance: any increase is a regression (latency over
+    fewer successful requests is not a speedup).
+    """
+    print(f"base: {base['meta'].get('commit')} ({base['meta'].get('timestamp')})")
+    print(f"new:  {new['meta'].get('commit')} ({new['meta'].get('timestamp')})")
+    if base["meta"].get("args") != new["meta"].get("args"):
+        print("warning: the two runs used different benchmark arguments")
+    print(f"{'metric':<34} {'base':>12} {'new':>12} {'change':>9}")
+    failed = False
+    for metric in sorted(set(base["metrics"]) & set(new["metrics"])):
+        a, b = base["metrics"][metric], new["metrics"][metric]
+        change = ((b - a) / a * 100.0) if a else 0.0
+        # Positive "worse" means a regression regardless of the metric's direction.
+        worse = -change if _higher_is_better(metric) else change
+        flag = ""
+        if _is_error_metric(metric):
+            if b > a:
+                flag = "  REGRESSION"
+                failed = True
+        elif max_regression_pct is not None and worse > max_regression_pct:
+            flag = "  REGRESSION"
+            failed = True
+        shown = f"{change:>+8.1f}%" if a or not b else f"{'new':>9}"
+        print(f"{metric:<34} {a:>12.2f} {b:>12.2f} {shown}{flag}")
+    return 1 if failed else 0
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_run = sub.add_parser("run", help="run the benchmark and write JSON results")
+    p_run.add_argument("--pages", type=int, default=200, help="corpus size")
+    p_run.add_argument("--seed", type=int, default=7)
+    p_run.add_argument("--dim", type=int, default=256, help="stub embedding dimension")
+    p_run.add_argument("--embed-latency-ms", type=float, default=20.0, help="stub Ollama latency per call")
+    p_run.add_argument("--embed-per-text-ms", type=float, default=0.5, help="extra stub latency per text")
+    p_run.add_argument("--ingest-batch", type=int, default=50, help="URLs per /ingest call (max 50)")
+    p_run.add_argument("--queries", type=int, default=200, help="/query requests per concurrency level")
+    p_run.add_argument("--asks", type=int, default=30, help="/ask requests per concurrency level")
+    p_run.add_argument(
+        "--concurrency",
+        type=lambda s: [int(x) for x in s.split(",") if x.strip()],
+        default=[1, 4, 16],
+        help="comma-separated client concurrency levels",
+    )
+    p_run.add_argument("--k", type=int, default=6)
+    p_run.add_argument("--mode", choices=["hybrid", "vector", "lexical"], default=None)
+    p_run.add_argument("--backend", choices=["chroma", "numpy", "memory"], default=None)
+    p_run.add_argument("--keep-data", action="store_true", help="keep the temp data dir")
+    p_run.add_argument("--out", help="write results here (default: stdout)")
+
+    p_cmp = sub.add_parser("compare", help="compare two result files")
+    p_cmp.add_argument("base")
+    p_cmp.add_argument("new")
+    p_cmp.add_argument(
+        "--max-regression-pct",
+        type=float,
+        default=None,
+        help="exit with status 1 if any metric is worse by more than this (errors: any increase)",
+    )
+
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.WARNING)
+
+    if args.command == "compare":
+        with open(args.base, "r", encoding="utf-8") as fh:
+            base = json.load(fh)
+        with open(args.new, "r", encoding="utf-8") as fh:
+            new = json.load(fh)
+        return compare(base, new, args.max_regression_pct)
+
+    result = run(args)
+    text = json.dumps(result, indent=2, sort_keys=True, default=str)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fh:
+            fh.write(text + "\n")
+        for metric, value in sorted(result["metrics"].items()):
+            print(f"{metric:<34} {value:>12.2f}")
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,47 @@
+"""trafilatura extraction for the service's extract process pool.
+
+Kept apart from app.py on purpose: pool workers unpickle ``extract`` by module name,
+and importing it must not pull in FastAPI, the vector store or the rest of the service.
+Import only the standard library and trafilatura here.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import List, Optional
+
+try:
+    import trafilatura  # type: ignore
+except Exception:  # pragma: no cover
+    trafilatura = None
+
+
+_MD_ESCAPE_RE = re.compile(r"\\([\\`*_{}\[\]()#+\-.!|<>])")
+
+
+def _unescape_markdown(text: str) -> str:
+    # trafilatura escapes markdown specials (allow\\_origins); undo it outside code fences
+    # so identifiers stay searchable.
+    out: List[str] = []
+    in_fence = False
+    for line in text.split("\n"):
+        if line.strip().startswith("```"):
+            in_fence = not in_fence
+        elif not in_fence and "\\" in line:
+            line = _MD_ESCAPE_RE.sub(r"\1", line)
+        out.append(line)
+    return "\n".join(out)
+
+
+def extract(html: str, url: str) -> Optional[str]:
+    # Markdown output keeps headings and code fences for the structure-aware chunker.
+    text = trafilatura.extract(
+        html,
+        url=url,
+        output_format="markdown",
+        include_formatting=True,
+        include_comments=False,
+        include_tables=True,
+        favor_recall=True,
+    )
+    return _unescape_markdown(text) if text else text
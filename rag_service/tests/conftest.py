@@ -0,0 +1,87 @@
+"""Shared fixtures: the service imported in-process, with no network and no Ollama.
+
+Settings are read at import time, so the environment is prepared before ``app`` is
+imported: a temp data dir, the in-memory vector backend, in-process extraction, and
+the benchmark's fixture server standing in for both the web and Ollama's embed API.
+"""
+
+import os
+import shutil
+import sys
+import tempfile
+
+import pytest
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+
+from benchmark import FixtureServer  # noqa: E402
+
+_PAGES = {}
+_fixtures = FixtureServer(_PAGES, {}, dim=64, embed_latency_s=0.0, embed_per_text_s=0.0).start()
+_DATA_DIR = tempfile.mkdtemp(prefix="rag-tests-")
+
+os.environ.update(
+    RAG_DATA_DIR=_DATA_DIR,
+    CHROMA_DIR=os.path.join(_DATA_DIR, "chroma"),
+    OLLAMA_URL=_fixtures.url,
+    RAG_VECTOR_BACKEND="memory",
+    RAG_EXTRACT_PROCESSES="0",
+    ANONYMIZED_TELEMETRY="False",
+)
+for _key in ("TAVILY_API_KEY", "SERPER_API_KEY", "RAG_ALLOWED_DOMAINS"):
+    os.environ.pop(_key, None)
+
+import app  # noqa: E402
+
+
+def pytest_sessionfinish(session, exitstatus):
+    _fixtures.stop()
+    shutil.rmtree(_DATA_DIR, ignore_errors=True)
+
+
+class Site:
+    """Pages served by the fixture server; change one to simulate a site update."""
+
+    def __init__(self, pages, counters):
+        self._pages = pages
+        self.counters = counters  # page_gets, not_modified, embed_calls, ...
+
+    def put(self, path: str, html: str) -> str:
+        self._pages[path] = html
+        return _fixtures.url + path
+
+
+def doc_page(title: str, words: str, sections: int = 4) -> str:
+    """A documentation-like page with enough text to pass the extraction minimum."""
+    body = "".join(
+        f"<h2>{title} part {i}</h2><p>{' '.join([words] * 12)} section {i}.</p>"
+        for i in range(sections)
+    )
+    return f"<html><head><title>{title}</title></head><body><main><h1>{title}</h1>{body}</main></body></html>"
+
+
+@pytest.fixture
+def rag():
+    return app
+
+
+@pytest.fixture
+def site():
+    yield Site(_PAGES, _fixtures.counters)
+    _PAGES.clear()
+
+
+@pytest.fixture
+def settings():
+    """``settings(name=value, ...)`` overrides SETTINGS (a frozen dataclass) for one test."""
+    saved = {}
+
+    def override(**values):
+        for name, value in values.items():
+            saved.setdefault(name, getattr(app.SETTINGS, name))
+            object.__setattr__(app.SETTINGS, name, value)
+
+    yield override
+    for name, value in saved.items():
+        object.__setattr__(app.SETTINGS, name, value)
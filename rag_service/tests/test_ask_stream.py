@@ -0,0 +1,46 @@
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from conftest import doc_page
+
+
+@pytest.fixture
+def client(rag):
+    return TestClient(rag.app)
+
+
+def _events(response):
+    return [json.loads(line) for line in response.iter_lines() if line]
+
+
+def test_stream_ends_with_summary(rag, site, client):
+    url = site.put("/stream/a.html", doc_page("Stream", "streaming responses send events"))
+    rag.ingest(rag.IngestRequest(urls=[url], scope="stream_a"))
+
+    body = {"query": "streaming events", "scope": "stream_a", "search": False}
+    with client.stream("POST", "/ask/stream", json=body) as response:
+        events = _events(response)
+    assert events[0]["event"] == "excerpts" and events[0]["stage"] == "cached"
+    assert events[-1]["event"] == "summary" and url in events[-1]["sources"]
+
+
+def test_streams_over_the_cap_get_503(rag, client, monkeypatch):
+    slots = threading.BoundedSemaphore(1)
+    monkeypatch.setattr(rag, "_stream_slots", slots)
+    slots.acquire()  # one stream already running
+    response = client.post("/ask/stream", json={"query": "anything", "search": False})
+    assert response.status_code == 503
+    slots.release()
+
+
+def test_cancelled_stream_stops_before_searching(rag, monkeypatch):
+    searched = []
+    monkeypatch.setattr(rag, "_ask_urls", lambda req, q: searched.append(q) or ([], []))
+    events = []
+    cancelled = threading.Event()
+    cancelled.set()  # the client hung up while the first query ran
+    rag._ask_events(rag.AskRequest(query="anything", scope="stream_c"), events.append, cancelled)
+    assert not searched and not any(e["event"] == "summary" for e in events)
@@ -0,0 +1,90 @@
+DOC = """# Guide
+
+Intro paragraph about the library.
+
+## Install
+
+Run the installer.
+It takes a minute.
+
+```python
+pip install thing
+thing --version
+```
+
+## Configure
+
+| option | default |
+| ------ | ------- |
+| debug  | false   |
+
+### CORS
+
+Set allow_origins to the trusted hosts.
+"""
+
+
+def _crumb_of(chunks, snippet):
+    (crumb,) = [c.breadcrumb for c in chunks if snippet in c.text]
+    return crumb
+
+
+def test_blocks_and_breadcrumbs(rag):
+    chunks = rag.chunk_text(DOC, max_tokens=16)
+    # Prose lines re-join into a paragraph; code and table rows keep their lines.
+    assert _crumb_of(chunks, "Run the installer. It takes a minute.") == "Guide > Install"
+    assert _crumb_of(chunks, "```python\npip install thing\nthing --version\n```") == (
+        "Guide > Install"
+    )
+    table = "| option | default |\n| ------ | ------- |\n| debug | false |"
+    assert _crumb_of(chunks, table) == "Guide > Configure"
+    assert _crumb_of(chunks, "allow_origins") == "Guide > Configure > CORS"
+
+
+def test_large_budget_keeps_sections_together(rag):
+    chunks = rag.chunk_text(DOC, max_tokens=512)
+    assert len(chunks) == 1 and chunks[0].breadcrumb == "Guide"
+    assert chunks[0].text.startswith("# Guide") and "```python" in chunks[0].text
+
+
+def test_chunks_fit_the_budget_and_do_not_overlap(rag):
+    words = [f"word{i}" for i in range(2000)]
+    text = "\n\n".join(" ".join(words[i : i + 50]) for i in range(0, len(words), 50))
+    chunks = rag.chunk_text(text, max_tokens=64)
+    # The budget is checked against per-block estimates, so allow rounding slack.
+    assert all(rag._estimate_tokens(c.text) <= 64 * 1.05 for c in chunks)
+    assert " ".join(c.text for c in chunks).split() == words
+
+
+def test_oversized_code_fence_is_split_into_valid_fences(rag):
+    code = "\n".join(f"value_{i} = compute({i})" for i in range(200))
+    chunks = rag.chunk_text(f"```python\n{code}\n```", max_tokens=64)
+    assert len(chunks) > 1
+    lines = []
+    for c in chunks:
+        assert c.text.startswith("```python\n") and c.text.endswith("\n```")
+        lines.extend(c.text.split("\n")[1:-1])
+    assert lines == code.split("\n")
+
+
+def test_oversized_table_is_split_by_rows_under_its_header(rag):
+    head = "| option | default | description |\n| --- | --- | --- |"
+    rows = [f"| opt_{i} | {i} | what option {i} does |" for i in range(60)]
+    chunks = rag.chunk_text("\n".join([head] + rows), max_tokens=64)
+    assert len(chunks) > 1
+    body = []
+    for c in chunks:
+        assert c.text.startswith(head + "\n")
+        body.extend(c.text.split("\n")[2:])
+    assert body == rows
+
+
+def test_unterminated_fence_is_closed(rag):
+    chunks = rag.chunk_text("Intro\n\n```\nprint(1)")
+    assert chunks[-1].text.endswith("```\nprint(1)\n```")
+
+
+def test_max_chars_hard_cap(rag):
+    chunks = rag.chunk_text("x" * 1000, max_tokens=512, max_chars=100)
+    assert all(len(c.text) <= 100 for c in chunks)
+    assert "".join(c.text for c in chunks) == "x" * 1000
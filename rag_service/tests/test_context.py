@@ -0,0 +1,69 @@
+def _hit(rag, text, url="https://docs.example.com/a", chunk=0, distance=0.5, **kw):
+    return rag.RetrievedChunk(url=url, text=text, chunk=chunk, distance=distance, **kw)
+
+
+def _blocks(context):
+    return [b for b in context.split("---\n") if "SOURCE:" in b]
+
+
+def test_adjacent_chunks_merge_into_one_block(rag):
+    items = [
+        _hit(rag, "second part", chunk=1, distance=0.2),
+        _hit(rag, "first part", chunk=0, distance=0.4),
+        _hit(rag, "other page", url="https://docs.example.com/b", distance=0.3),
+    ]
+    blocks = _blocks(rag.format_context(items, max_tokens=1000))
+    assert len(blocks) == 2
+    # The merged run ranks by its best chunk, keeps page order and its best distance.
+    assert "first part\nsecond part" in blocks[0] and "RELEVANCE_DISTANCE: 0.2000" in blocks[0]
+    assert "other page" in blocks[1]
+
+
+def test_overlapping_legacy_chunks_are_not_repeated(rag):
+    shared = "the overlapping sentence that both windows contain"
+    items = [
+        _hit(rag, f"Opening words. {shared}", chunk=0),
+        _hit(rag, f"{shared} and what follows.", chunk=1),
+    ]
+    context = rag.format_context(items, max_tokens=1000)
+    assert context.count(shared) == 1
+    assert f"Opening words. {shared} and what follows." in context
+
+
+def test_block_that_does_not_fit_is_skipped_for_smaller_ones(rag):
+    items = [
+        _hit(rag, "best but long " * 200, url="https://docs.example.com/long"),
+        _hit(rag, "short answer", url="https://docs.example.com/short"),
+    ]
+    context = rag.format_context(items, max_tokens=120)
+    assert "short answer" in context and "best but long" not in context
+    assert rag._estimate_tokens(context) <= 120
+
+
+def test_run_that_does_not_fit_falls_back_to_its_best_chunks(rag):
+    items = [
+        _hit(rag, "key fact", chunk=3, distance=0.1),
+        _hit(rag, "filler " * 200, chunk=4, distance=0.9),
+    ]
+    blocks = _blocks(rag.format_context(items, max_tokens=120))
+    assert len(blocks) == 1 and "key fact" in blocks[0] and "filler" not in blocks[0]
+
+
+def test_scope_and_section_labels(rag):
+    items = [
+        _hit(rag, "alpha", section="Guide > Install", scope="docs"),
+        _hit(
+            rag, "bravo", url="https://docs.example.com/b", scope="blog", distance=None, score=0.7
+        ),
+    ]
+    context = rag.format_context(items, max_tokens=1000)
+    assert "SCOPE: docs\nSECTION: Guide > Install\n" in context
+    assert "SCOPE: blog\nRELEVANCE_SCORE: 0.7000\n" in context
+    # One scope: no SCOPE lines.
+    assert "SCOPE:" not in rag.format_context(items[:1], max_tokens=1000)
+
+
+def test_max_chars_caps_the_context(rag):
+    items = [_hit(rag, f"chunk {i} " * 20, url=f"https://docs.example.com/{i}") for i in range(10)]
+    context = rag.format_context(items, max_tokens=10_000, max_chars=800)
+    assert len(context) <= 800 and _blocks(context)
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+import requests
+
+
+class FakeSession:
+    """Answers /api/embed by a rule on the batch size, and records each batch size."""
+
+    def __init__(self, rule):
+        self.rule = rule
+        self.batches = []
+
+    def post(self, url, json=None, timeout=None):
+        texts = json["input"]
+        self.batches.append(len(texts))
+        return self.rule(texts)
+
+
+def _response(status, body=None):
+    resp = requests.Response()
+    resp.status_code = status
+    resp._content = json.dumps(body or {}).encode("utf-8")
+    return resp
+
+
+def _ok(texts):
+    return _response(200, {"embeddings": [[float(len(t)), 1.0] for t in texts]})
+
+
+def _embedder(rag, rule):
+    session = FakeSession(rule)
+    fn = rag.OllamaEmbeddingFunction(
+        "http://ollama.invalid", "test-model", session=session, batch_size=8, parallelism=1
+    )
+    return fn, session
+
+
+def test_payload_too_large_splits_the_batch(rag):
+    fn, session = _embedder(rag, lambda texts: _response(413) if len(texts) > 2 else _ok(texts))
+    texts = [f"text {i}" for i in range(8)]
+    assert fn(texts) == [[float(len(t)), 1.0] for t in texts]
+    assert session.batches == [8, 4, 2, 2, 4, 2, 2]
+
+
+@pytest.mark.parametrize("status", [500, 503])
+def test_server_error_fails_without_splitting(rag, status):
+    fn, session = _embedder(rag, lambda texts: _response(status))
+    with pytest.raises(RuntimeError):
+        fn([f"text {i}" for i in range(8)])
+    assert session.batches == [8]
+
+
+def test_timeout_fails_without_splitting(rag):
+    def rule(texts):
+        raise requests.ReadTimeout("read timed out")
+
+    fn, session = _embedder(rag, rule)
+    with pytest.raises(RuntimeError):
+        fn([f"text {i}" for i in range(8)])
+    assert session.batches == [8]
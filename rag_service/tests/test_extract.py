@@ -0,0 +1,20 @@
+import extract_worker
+
+
+def test_unescape_markdown_outside_code_fences():
+    text = "Set allow\\_origins to \\[\\*\\].\n```\nkeep\\_this\n```\nand\\_this"
+    assert extract_worker._unescape_markdown(text) == (
+        "Set allow_origins to [*].\n```\nkeep\\_this\n```\nand_this"
+    )
+
+
+def test_extract_in_process_pool_matches_in_thread(rag, settings):
+    html = (
+        "<html><body><article><h1>Config</h1>"
+        + "<p>" + "The allow_origins option lists trusted origins. " * 20 + "</p>"
+        + "</article></body></html>"
+    )
+    expected = rag.extract_main_text(html, "https://docs.example.com/config")
+    settings(extract_processes=1)
+    assert rag.extract_main_text(html, "https://docs.example.com/config") == expected
+    assert "allow_origins" in expected
@@ -0,0 +1,66 @@
+import os
+
+URL = "https://docs.example.com/generations.html"
+
+
+def _generations(rag, tmp_path, recheck_s=60.0):
+    return rag.ScopeGenerations(str(tmp_path / "generations.sqlite3"), recheck_s)
+
+
+def test_bump_is_visible_to_the_bumping_process_at_once(rag, tmp_path):
+    gens = _generations(rag, tmp_path)
+    assert gens.get("webdocs_a") == 0
+    assert gens.bump("webdocs_a") == 1
+    assert gens.bump("webdocs_a") == 2
+    assert gens.get("webdocs_a") == 2 and gens.get("webdocs_b") == 0
+    assert gens.snapshot() == {"webdocs_a": 2}
+
+
+def test_other_processes_see_bumps_after_recheck(rag, tmp_path):
+    writer = _generations(rag, tmp_path)
+    reader = _generations(rag, tmp_path, recheck_s=60.0)
+    assert reader.get("webdocs_a") == 0
+
+    writer.bump("webdocs_a")
+    assert reader.get("webdocs_a") == 0  # within recheck_s: the memo still answers
+    reader.expire()
+    assert reader.get("webdocs_a") == 1
+
+    eager = _generations(rag, tmp_path, recheck_s=0.0)
+    writer.bump("webdocs_a")
+    assert eager.get("webdocs_a") == 2
+
+
+def test_write_invalidates_cached_retrievals(rag):
+    col = rag.get_collection("gen_cache")
+    chunks = [rag.Chunk(text="alpha text", breadcrumb="Page")]
+    rag.apply_upsert(rag.plan_upsert(col, URL, chunks))
+    assert [it.text for it in rag.retrieve(col, "alpha", k=3, mode="lexical")] == ["alpha text"]
+
+    before = rag.scope_generation(col.name)
+    chunks.append(rag.Chunk(text="alpha beta text", breadcrumb="Page"))
+    rag.apply_upsert(rag.plan_upsert(col, URL, chunks))
+    assert rag.scope_generation(col.name) == before + 1
+    assert sorted(it.text for it in rag.retrieve(col, "alpha", k=3, mode="lexical")) == [
+        "alpha beta text",
+        "alpha text",
+    ]
+
+
+def test_bump_by_another_process_invalidates_cached_retrievals(rag):
+    col = rag.get_collection("gen_remote")
+    rag.apply_upsert(
+        rag.plan_upsert(col, URL, [rag.Chunk(text="alpha text", breadcrumb="Page")])
+    )
+    first = rag.retrieve(col, "alpha", k=3, mode="lexical")
+    hits = rag._retrieval_cache.hits
+    assert rag.retrieve(col, "alpha", k=3, mode="lexical") == first
+    assert rag._retrieval_cache.hits == hits + 1
+
+    # Another worker bumps the shared counter; this one notices on its next recheck.
+    other = rag.ScopeGenerations(os.path.join(rag.SETTINGS.data_dir, "generations.sqlite3"), 0.0)
+    other.bump(col.name)
+    rag._generations.expire()
+    misses = rag._retrieval_cache.misses
+    assert rag.retrieve(col, "alpha", k=3, mode="lexical") == first
+    assert rag._retrieval_cache.misses == misses + 1
@@ -0,0 +1,47 @@
+from conftest import doc_page
+
+
+def _ingest(rag, url, scope, force_refresh=False):
+    return rag.ingest(rag.IngestRequest(urls=[url], scope=scope, force_refresh=force_refresh))
+
+
+def _stored_text(rag, scope, url):
+    return " ".join(rag.get_collection(scope).get(where={"url": url})["documents"])
+
+
+def test_refresh_sees_change_fetched_through_another_scope(rag, site):
+    # The page cache is shared by all scopes; a 304 only says the page matches what
+    # *some* scope fetched last, not what this scope has indexed.
+    url = site.put("/docs/shared.html", doc_page("Shared", "alpha release notes"))
+    assert _ingest(rag, url, "xs_a").ingested_urls == 1
+
+    site.put("/docs/shared.html", doc_page("Shared", "bravo migration guide"))
+    assert _ingest(rag, url, "xs_b").ingested_urls == 1
+
+    resp = _ingest(rag, url, "xs_a", force_refresh=True)
+    assert resp.ingested_urls == 1
+    text = _stored_text(rag, "xs_a", url)
+    assert "bravo" in text
+    assert "alpha" not in text
+
+
+def test_refresh_skips_unchanged_page(rag, site):
+    url = site.put("/docs/stable.html", doc_page("Stable", "charlie api reference"))
+    assert _ingest(rag, url, "xs_c").ingested_urls == 1
+
+    not_modified = site.counters["not_modified"]
+    resp = _ingest(rag, url, "xs_c", force_refresh=True)
+    assert (resp.ingested_urls, resp.skipped_urls) == (0, 1)
+    # force_refresh is a full GET, never answered from the cache by a 304.
+    assert site.counters["not_modified"] == not_modified
+
+
+def test_expired_entry_revalidates_with_conditional_get(rag, site, settings):
+    url = site.put("/docs/expiring.html", doc_page("Expiring", "delta config options"))
+    assert _ingest(rag, url, "xs_d").ingested_urls == 1
+
+    settings(ingest_ttl_s=0.0)
+    not_modified = site.counters["not_modified"]
+    resp = _ingest(rag, url, "xs_d")
+    assert (resp.ingested_urls, resp.skipped_urls) == (0, 1)
+    assert site.counters["not_modified"] == not_modified + 1
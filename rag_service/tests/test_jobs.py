@@ -0,0 +1,95 @@
+import time
+
+import pytest
+
+
+def _queue(rag, tmp_path, **kwargs):
+    options = dict(max_depth=10, lease_s=60.0, retention_s=3600.0, max_attempts=3)
+    options.update(kwargs)
+    return rag.JobQueue(str(tmp_path / "jobs.sqlite3"), **options)
+
+
+def _submit(rag, queue, scope="jobs"):
+    return queue.submit(rag.IngestRequest(urls=["https://docs.example.com/a"], scope=scope))
+
+
+def _result(rag):
+    return rag.UrlIngestResult(url="https://docs.example.com/a", status="ingested", chunks=3)
+
+
+def test_claim_then_finish(rag, tmp_path):
+    queue = _queue(rag, tmp_path)
+    job_id = _submit(rag, queue)
+    claimed_id, owner, kind, _ = queue.claim()
+    assert (claimed_id, kind) == (job_id, "ingest")
+    assert queue.claim() is None  # leased, not handed out twice
+
+    assert queue.finish(job_id, owner, [_result(rag)])
+    status = queue.get(job_id)
+    assert status.status == "done" and status.done_urls == 1
+
+
+def test_writer_restart_requeues_running_jobs(rag, tmp_path):
+    queue = _queue(rag, tmp_path)
+    job_id = _submit(rag, queue)
+    _, dead_owner, _, _ = queue.claim()
+    queue.progress(job_id, dead_owner, [_result(rag)])
+
+    # A new writer opens the same database after the old one crashed.
+    restarted = _queue(rag, tmp_path)
+    assert restarted.requeue_running() == 1
+    status = restarted.get(job_id)
+    assert status.status == "queued" and status.done_urls == 0
+
+    claimed_id, owner, _, _ = restarted.claim()
+    assert claimed_id == job_id and owner != dead_owner
+    assert restarted.finish(job_id, owner, [_result(rag)])
+    assert restarted.get(job_id).status == "done"
+
+
+def test_expired_lease_is_claimed_again(rag, tmp_path):
+    queue = _queue(rag, tmp_path, lease_s=0.05)
+    job_id = _submit(rag, queue)
+    _, first_owner, _, _ = queue.claim()
+    assert queue.claim() is None
+    time.sleep(0.1)
+
+    claimed_id, second_owner, _, _ = queue.claim()
+    assert claimed_id == job_id and second_owner != first_owner
+    # The first claim came back late: its progress and result are dropped.
+    queue.progress(job_id, first_owner, [_result(rag)])
+    assert queue.get(job_id).done_urls == 0
+    assert not queue.finish(job_id, first_owner, [], error="late")
+    assert queue.finish(job_id, second_owner, [_result(rag)])
+    assert queue.get(job_id).status == "done"
+
+
+def test_progress_renews_the_lease(rag, tmp_path):
+    queue = _queue(rag, tmp_path, lease_s=0.2)
+    job_id = _submit(rag, queue)
+    _, owner, _, _ = queue.claim()
+    for _ in range(3):
+        time.sleep(0.1)
+        queue.progress(job_id, owner, [])
+        assert queue.claim() is None
+    assert queue.finish(job_id, owner, [])
+
+
+def test_job_fails_after_max_attempts(rag, tmp_path):
+    queue = _queue(rag, tmp_path, lease_s=0.01, max_attempts=2)
+    job_id = _submit(rag, queue)
+    for _ in range(2):
+        assert queue.claim()[0] == job_id
+        time.sleep(0.03)
+
+    assert queue.claim() is None
+    status = queue.get(job_id)
+    assert status.status == "failed" and "2 attempts" in status.error
+
+
+def test_full_queue_rejects_submits(rag, tmp_path):
+    queue = _queue(rag, tmp_path, max_depth=1)
+    _submit(rag, queue)
+    with pytest.raises(rag.HTTPException) as exc:
+        _submit(rag, queue)
+    assert exc.value.status_code == 429
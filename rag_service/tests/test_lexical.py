@@ -0,0 +1,63 @@
+URL = "https://docs.example.com/lexical.html"
+
+
+def _write(rag, collection, *texts):
+    chunks = [rag.Chunk(text=t, breadcrumb="Page > Intro") for t in texts]
+    return rag.apply_upsert(rag.plan_upsert(collection, URL, chunks))
+
+
+def _texts(items):
+    return [it.text for it in items]
+
+
+def test_identifier_parts_are_searchable(rag):
+    col = rag.get_collection("lex_terms")
+    doc = "Set allow_origins on CORSMiddleware."
+    _write(rag, col, doc, "Unrelated text about caching.")
+    assert _texts(rag._lexical_search(col, "origins", 5)) == [doc]
+    assert _texts(rag._lexical_search(col, "cors middleware", 5)) == [doc]
+    assert rag._lexical_search(col, "nothing matches", 5) == []
+
+
+def test_index_is_shared_through_sqlite(rag):
+    col = rag.get_collection("lex_shared")
+    _write(rag, col, "alpha text", "bravo text")
+
+    # Another worker opens the same file and sees the writer's chunks without rebuilding.
+    other = rag.LexicalIndex(rag._lexical.path)
+    assert [cid for cid, _ in other.search(col, "bravo", 5)] == [
+        it.id for it in rag._lexical_search(col, "bravo", 5)
+    ]
+    _write(rag, col, "alpha text", "charlie text")
+    assert other.search(col, "bravo", 5) == []
+    assert len(other.search(col, "charlie", 5)) == 1
+
+
+def test_scope_without_index_is_built_on_first_search(rag):
+    col = rag.get_collection("lex_backfill")
+    _write(rag, col, "alpha text", "bravo text")
+    rag._lexical.drop(col.name)  # e.g. a scope stored before the index existed
+
+    assert _texts(rag._lexical_search(col, "alpha", 5)) == ["alpha text"]
+    assert rag._lexical._scope_id(col.name) is not None
+
+
+def test_evicted_urls_leave_the_index(rag):
+    col = rag.get_collection("lex_evict")
+    _write(rag, col, "alpha text")
+    rag.evict_urls(col, [URL])
+    assert rag._lexical_search(col, "alpha", 5) == []
+
+
+def test_scope_over_the_cap_falls_back_to_vector_search(rag, settings):
+    settings(lexical_max_chunks=2)
+    col = rag.get_collection("lex_cap")
+    _write(rag, col, "alpha text", "bravo text", "charlie text")
+
+    assert rag._lexical_search(col, "alpha", 5) is None
+    assert rag._lexical._scope_id(col.name) is None
+    for mode in ("lexical", "hybrid"):
+        items = rag.retrieve(col, "alpha", k=2, mode=mode)
+        assert len(items) == 2 and all(it.distance is not None for it in items)
+    batch = rag.retrieve_batch(["lex_cap"], ["alpha"], [2], mode="lexical")
+    assert len(batch[0]) == 2
@@ -0,0 +1,123 @@
+import numpy as np
+import pytest
+
+DIM = 32
+
+
+def _data(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.standard_normal((n, DIM)).astype(np.float32)
+
+
+def _fill(col, vecs, prefix="c"):
+    ids = [f"{prefix}{i}" for i in range(len(vecs))]
+    col.upsert(
+        ids=ids,
+        embeddings=vecs.tolist(),
+        documents=[f"doc {i}" for i in ids],
+        metadatas=[{"url": f"https://docs.example.com/{i}", "chunk": 0} for i in ids],
+    )
+    return ids
+
+
+def _brute_force(vecs, ids, queries, k):
+    dist = ((queries[:, None, :] - vecs[None, :, :]) ** 2).sum(axis=2)
+    return [[ids[j] for j in np.argsort(row)[:k]] for row in dist]
+
+
+def _recall(got, expected):
+    return np.mean([len(set(g) & set(e)) / len(e) for g, e in zip(got, expected)])
+
+
+def test_exact_search_matches_brute_force(rag):
+    vecs, queries = _data(600), _data(20, seed=1)
+    col = rag.NumpyCollection("np_exact", None, dtype="float32")
+    ids = _fill(col, vecs)
+
+    res = col.query(query_embeddings=queries.tolist(), n_results=10)
+    assert res["ids"] == _brute_force(vecs, ids, queries, 10)
+    expected = ((queries[0] - vecs[ids.index(res["ids"][0][0])]) ** 2).sum()
+    assert res["distances"][0][0] == pytest.approx(expected, rel=1e-4)
+
+
+def test_exact_search_matches_chroma(rag):
+    chromadb = pytest.importorskip("chromadb")
+    vecs, queries = _data(600), _data(20, seed=1)
+    col = rag.NumpyCollection("np_parity", None, dtype="float32")
+    _fill(col, vecs)
+    client = chromadb.EphemeralClient()
+    chroma = client.create_collection("np_parity", metadata={"hnsw:search_ef": 600})
+    _fill(chroma, vecs)
+
+    ours = col.query(query_embeddings=queries.tolist(), n_results=10)
+    theirs = chroma.query(query_embeddings=queries.tolist(), n_results=10)
+    assert ours["ids"] == theirs["ids"]
+    # Same squared-L2 space, so scores stay comparable across backends.
+    assert np.allclose(ours["distances"], theirs["distances"], rtol=1e-3)
+
+
+@pytest.mark.parametrize("dtype, min_recall", [("float16", 0.99), ("int8", 0.9)])
+def test_quantized_vectors_keep_recall(rag, dtype, min_recall):
+    vecs, queries = _data(600), _data(20, seed=1)
+    col = rag.NumpyCollection(f"np_{dtype}", None, dtype=dtype)
+    ids = _fill(col, vecs)
+
+    res = col.query(query_embeddings=queries.tolist(), n_results=10)
+    assert _recall(res["ids"], _brute_force(vecs, ids, queries, 10)) >= min_recall
+
+
+def _clustered(n, clusters=40, seed=0):
+    # Embeddings of real pages cluster by topic; uniform noise is the IVF worst case.
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, DIM)) * 4
+    return (centers[rng.integers(clusters, size=n)] + rng.standard_normal((n, DIM))).astype(
+        np.float32
+    )
+
+
+def test_partitioned_search_keeps_recall(rag):
+    points = _clustered(2020)
+    vecs, queries = points[:2000], points[2000:]
+    col = rag.NumpyCollection("np_ivf", None, dtype="float32", ivf_min_rows=1000, nprobe=8)
+    ids = _fill(col, vecs)
+    assert col._centroids is not None
+    expected = _brute_force(vecs, ids, queries, 10)
+
+    res = col.query(query_embeddings=queries.tolist(), n_results=10)
+    assert _recall(res["ids"], expected) >= 0.9
+    col.nprobe = len(col._centroids)  # probing every partition is an exact search
+    assert col.query(query_embeddings=queries.tolist(), n_results=10)["ids"] == expected
+
+
+def test_compact_drops_tombstones_and_keeps_results(rag, tmp_path):
+    vecs, queries = _data(300), _data(10, seed=1)
+    col = rag.NumpyCollection("np_compact", str(tmp_path / "np_compact"), dtype="float16")
+    ids = _fill(col, vecs)
+    deleted = ids[::3]
+    col.delete(ids=deleted)
+    before = col.query(query_embeddings=queries.tolist(), n_results=5)
+    assert not set(deleted) & {cid for hits in before["ids"] for cid in hits}
+
+    assert col.compact() == len(deleted)
+    assert col.compact() == 0
+    assert col.count() == len(ids) - len(deleted)
+    after = col.query(query_embeddings=queries.tolist(), n_results=5)
+    assert after["ids"] == before["ids"]
+    assert np.allclose(after["distances"], before["distances"])
+    assert col.get(ids=[ids[1]])["documents"] == [f"doc {ids[1]}"]
+
+    # Another process opening the compacted files sees the same scope.
+    reopened = rag.NumpyCollection("np_compact", str(tmp_path / "np_compact"))
+    assert reopened.query(query_embeddings=queries.tolist(), n_results=5)["ids"] == before["ids"]
+
+
+def test_upsert_replaces_rows_by_id(rag):
+    vecs = _data(3)
+    col = rag.NumpyCollection("np_replace", None, dtype="float32")
+    _fill(col, vecs)
+    col.upsert(ids=["c0"], embeddings=[vecs[2].tolist()], documents=["new"], metadatas=[{}])
+
+    assert col.count() == 3
+    res = col.query(query_embeddings=[vecs[2].tolist()], n_results=2)
+    assert sorted(res["ids"][0]) == ["c0", "c2"]
+    assert col.get(ids=["c0"])["documents"] == ["new"]
@@ -0,0 +1,36 @@
+import pytest
+
+
+@pytest.fixture
+def providers(rag, monkeypatch):
+    """Fresh breakers and stats, so tests don't see each other's failures."""
+    for name in rag._SEARCH_FUNCS:
+        monkeypatch.setitem(rag._search_breakers, name, rag.CircuitBreaker(2, 60.0))
+        monkeypatch.setitem(rag._search_stats, name, rag.ProviderStats())
+    return monkeypatch
+
+
+def _search_error(rag, query):
+    with pytest.raises(rag.HTTPException) as exc:
+        rag.search_web(query)
+    assert exc.value.status_code == 503
+    return exc.value.detail
+
+
+def test_missing_configuration_is_reported_every_time(rag, providers):
+    providers.setattr(rag, "DDGS", None)
+    for _ in range(5):
+        assert "No search provider configured" in _search_error(rag, "fastapi cors")
+    assert all(b.state == "closed" for b in rag._search_breakers.values())
+
+
+def test_failing_provider_trips_its_breaker(rag, providers):
+    def broken(query, max_results):
+        raise RuntimeError("rate limited")
+
+    providers.setattr(rag, "DDGS", object())
+    providers.setitem(rag._SEARCH_FUNCS, "ddgs", broken)
+    for _ in range(2):
+        assert "ddgs: rate limited" in _search_error(rag, "fastapi cors")
+    assert "cool-down" in _search_error(rag, "fastapi cors")
+    assert rag._search_stats["ddgs"].snapshot()["skipped"] == 1
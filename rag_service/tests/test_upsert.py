@@ -0,0 +1,82 @@
+URL = "https://docs.example.com/page.html"
+
+
+def _chunks(rag, *texts, section="Page > Intro"):
+    return [rag.Chunk(text=t, breadcrumb=section) for t in texts]
+
+
+def _apply(rag, collection, chunks):
+    plan = rag.plan_upsert(collection, URL, chunks)
+    return plan, rag.apply_upsert(plan)
+
+
+def _stored(collection):
+    got = collection.get(where={"url": URL})
+    return sorted(zip(got["documents"], (m["chunk"] for m in got["metadatas"])))
+
+
+def test_first_ingest_adds_every_chunk(rag):
+    col = rag.get_collection("up_first")
+    plan, stats = _apply(rag, col, _chunks(rag, "alpha text", "bravo text"))
+    assert len(plan.new_ids) == 2 and not plan.moved_ids and not plan.stale_ids
+    assert (stats.total, stats.new, stats.unchanged, stats.deleted) == (2, 2, 0, 0)
+    assert _stored(col) == [("alpha text", 0), ("bravo text", 1)]
+
+
+def test_identical_page_is_a_no_op(rag):
+    col = rag.get_collection("up_same")
+    _apply(rag, col, _chunks(rag, "alpha text", "bravo text"))
+    generation = rag.scope_generation(col.name)
+
+    plan, stats = _apply(rag, col, _chunks(rag, "alpha text", "bravo text"))
+    assert not plan.new_ids and not plan.moved_ids and not plan.stale_ids
+    assert (stats.new, stats.unchanged, stats.deleted) == (0, 2, 0)
+    # Nothing written: cached retrievals for the scope stay valid.
+    assert rag.scope_generation(col.name) == generation
+
+
+def test_inserted_chunk_only_adds_one_and_moves_the_rest(rag):
+    col = rag.get_collection("up_insert")
+    _apply(rag, col, _chunks(rag, "alpha text", "bravo text"))
+
+    plan, stats = _apply(rag, col, _chunks(rag, "new intro", "alpha text", "bravo text"))
+    assert plan.new_docs == ["new intro"]
+    assert len(plan.moved_ids) == 2 and not plan.stale_ids
+    assert (stats.new, stats.unchanged) == (1, 2)
+    assert _stored(col) == [("alpha text", 1), ("bravo text", 2), ("new intro", 0)]
+
+
+def test_removed_chunk_is_deleted(rag):
+    col = rag.get_collection("up_remove")
+    _apply(rag, col, _chunks(rag, "alpha text", "bravo text", "charlie text"))
+
+    plan, stats = _apply(rag, col, _chunks(rag, "alpha text", "charlie text"))
+    assert not plan.new_ids and len(plan.stale_ids) == 1
+    assert stats.deleted == 1
+    assert _stored(col) == [("alpha text", 0), ("charlie text", 1)]
+
+
+def test_renamed_heading_updates_metadata_without_re_embedding(rag):
+    col = rag.get_collection("up_rename")
+    _apply(rag, col, _chunks(rag, "alpha text", section="Page > Old"))
+
+    plan, _ = _apply(rag, col, _chunks(rag, "alpha text", section="Page > New"))
+    assert not plan.new_ids and len(plan.moved_ids) == 1
+    assert col.get(where={"url": URL})["metadatas"][0]["section"] == "Page > New"
+
+
+def test_repeated_chunks_are_stored_once(rag):
+    col = rag.get_collection("up_dupes")
+    plan, stats = _apply(rag, col, _chunks(rag, "footer", "alpha text", "footer"))
+    assert stats.total == 2
+    assert _stored(col) == [("alpha text", 1), ("footer", 0)]
+
+
+def test_upsert_keeps_a_built_lexical_index_in_sync(rag):
+    col = rag.get_collection("up_lexical")
+    _apply(rag, col, _chunks(rag, "alpha text", "bravo text"))
+    assert [c.text for c in rag._lexical_search(col, "bravo", 5)] == ["bravo text"]
+
+    _apply(rag, col, _chunks(rag, "alpha text", "charlie text"))
+    assert rag._lexical_search(col, "bravo", 5) == []
+    assert [c.text for c in rag._lexical_search(col, "charlie", 5)] == ["charlie text"]
@@ -9,6 +9,10 @@ The microservice (rag_service) is responsible for:
 This tool returns a compact "context" string with SOURCE URLs + excerpts.
 Agents can paste it into their reasoning and cite the sources.
 
+It reads the service's streaming endpoint (/ask/stream) and returns as soon as the
+excerpts cite enough pages; the service keeps ingesting the rest in the background.
+If the stream breaks or runs out of time, the latest excerpts received are returned.
+
 Env vars
 --------
 RAG_SERVICE_URL: base url of the rag service (default: http://localhost:8001)
@@ -16,14 +20,22 @@ RAG_SERVICE_URL: base url of the rag service (default: http://localhost:8001)
 
 from __future__ import annotations
 
+import json
 import os
-from typing import Type
+import time
+from typing import Any, Dict, Type
 
 import requests
 from pydantic import BaseModel, Field
 
 from crewai.tools import BaseTool
 
+# TIMEOUT_S bounds the whole call, streaming included. While it works the service
+# sends a keep-alive line well within READ_TIMEOUT_S, so the deadline is checked often.
+TIMEOUT_S = 90.0
+CONNECT_TIMEOUT_S = 10.0
+READ_TIMEOUT_S = 30.0
+
 
 class WebRAGInput(BaseModel):
     query: str = Field(
@@ -46,6 +58,12 @@ class WebRAGInput(BaseModel):
         default=False,
         description="If true, re-download & re-index URLs even if already cached.",
     )
+    min_sources: int = Field(
+        default=3,
+        ge=0,
+        le=20,
+        description="Return as soon as the excerpts cite this many pages (0 = wait for all).",
+    )
 
 
 class WebRAGTool(BaseTool):
@@ -65,6 +83,7 @@ class WebRAGTool(BaseTool):
         k: int = 6,
         max_search_results: int = 5,
         force_refresh: bool = False,
+        min_sources: int = 3,
     ) -> str:
         base = os.getenv("RAG_SERVICE_URL", "http://localhost:8001").rstrip("/")
         payload = {
@@ -76,12 +95,66 @@ class WebRAGTool(BaseTool):
             "force_refresh": force_refresh,
         }
         try:
-            resp = requests.post(f"{base}/ask", json=payload, timeout=90)
-            resp.raise_for_status()
-            data = resp.json()
-            return data.get("context", "") or ""
+            return self._ask_stream(base, payload, min_sources)
         except Exception as e:
             return (
                 "[web_rag error] Could not reach WebRAG service. "
                 f"Make sure docker-compose is running and RAG_SERVICE_URL is correct. Details: {e}"
             )
+
+    @staticmethod
+    def _ask_stream(base: str, payload: Dict[str, Any], min_sources: int) -> str:
+        """Latest context from /ask/stream: stop at the summary, or earlier once it cites
+        ``min_sources`` pages. Falls back to /ask on services without streaming.
+
+        Excerpts from before the search (``"stage": "cached"``) only show what was already
+        indexed, so with ``search`` on, stopping early waits for this query's own pages.
+        A broken stream or the ``TIMEOUT_S`` deadline ends the call with the excerpts
+        received so far; it only fails if there are none.
+        """
+        deadline = time.monotonic() + TIMEOUT_S
+        context = ""
+        searching = payload.get("search", True)
+        ingested = False
+        with requests.post(
+            f"{base}/ask/stream",
+            json=payload,
+            stream=True,
+            timeout=(CONNECT_TIMEOUT_S, READ_TIMEOUT_S),
+        ) as resp:
+            if resp.status_code != 404:
+                resp.raise_for_status()
+                try:
+                    for line in resp.iter_lines():
+                        if time.monotonic() >= deadline:
+                            if context:
+                                break
+                            raise TimeoutError(f"no excerpts within {TIMEOUT_S:.0f}s")
+                        if not line:
+                            continue  # keep-alive
+                        event = json.loads(line)
+                        kind = event.get("event")
+                        if kind == "error":
+                            raise RuntimeError(event.get("detail"))
+                        if kind == "ingest":
+                            ingested = True
+                        if kind in ("excerpts", "summary"):
+                            context = event.get("context", "") or ""
+                            if kind == "summary":
+                                break
+                            if not min_sources or len(event.get("sources") or []) < min_sources:
+                                continue
+                            if not searching or (ingested and event.get("stage") != "cached"):
+                                break
+                except Exception:
+                    # Read timeout, error event, garbled line: what arrived is still an answer.
+                    if not context:
+                        raise
+                return context
+
+        remaining = max(1.0, deadline - time.monotonic())
+        resp = requests.post(
+            f"{base}/ask", json=payload, timeout=(CONNECT_TIMEOUT_S, remaining)
+        )
+        resp.raise_for_status()
+        return resp.json().get("context", "") or ""